@@ -0,0 +1,124 @@
+"""
+Plans the columns and joins a GraphQL query needs from its selection set.
+
+Without this, every node in a connection is loaded with all of its columns,
+including prompt text and encrypted API keys nobody asked for, and each
+nested object such as a prompt's dirnode is a query of its own. Here the
+selection set is walked once and turned into only() and select_related()
+calls, so what's read from the database tracks what the client selected.
+
+Fields without a model column of the same name, such as those computed by
+a resolver, declare the columns they read in their type's field_dependencies.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Model, QuerySet
+from graphene.utils.str_converters import to_snake_case
+from graphene_django.registry import get_global_registry
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLResolveInfo,
+    InlineFragmentNode,
+    SelectionSetNode,
+)
+
+Selections = dict[str, list[SelectionSetNode]]
+
+
+def get_selections(
+    selection_sets: list[SelectionSetNode], info: GraphQLResolveInfo
+) -> Selections:
+    """
+    Merge selection sets into their fields' names and sub-selections.
+
+    Fragments are expanded in place, and a field selected more than once
+    keeps all of its sub-selections.
+    """
+    selections: Selections = {}
+    for selection_set in selection_sets:
+        for selection in selection_set.selections if selection_set else []:
+            if isinstance(selection, FieldNode):
+                subselections = selections.setdefault(selection.name.value, [])
+                if selection.selection_set:
+                    subselections.append(selection.selection_set)
+            elif isinstance(selection, InlineFragmentNode):
+                nested = get_selections([selection.selection_set], info)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = info.fragments[selection.name.value]
+                nested = get_selections([fragment.selection_set], info)
+            if not isinstance(selection, FieldNode):
+                for name, subselections in nested.items():
+                    selections.setdefault(name, []).extend(subselections)
+    return selections
+
+
+def plan(
+    model: type[Model], selections: Selections, info: GraphQLResolveInfo, prefix=''
+) -> tuple[set[str], set[str]]:
+    """
+    The columns and forward relations needed to resolve some selections.
+
+    Returns:
+        tuple[set[str], set[str]]: Paths for only() and for select_related()
+    """
+    object_type = get_global_registry().get_type_for_model(model)
+    dependencies = getattr(object_type, 'field_dependencies', {})
+    only, related = set(), set()
+
+    for name, subselections in selections.items():
+        attname = to_snake_case(name)
+        if attname in dependencies:
+            for path in dependencies[attname]:
+                *relations, _ = path.split('__')
+                for depth in range(1, len(relations) + 1):
+                    relation = prefix + '__'.join(relations[:depth])
+                    only.add(relation)
+                    related.add(relation)
+                only.add(prefix + path)
+            continue
+
+        try:
+            field = model._meta.get_field(attname)
+        except FieldDoesNotExist:
+            continue
+        if field.many_to_many or field.one_to_many:
+            # Paged by a connection field of its own
+            continue
+        only.add(prefix + field.name)
+        if field.is_relation and subselections:
+            related.add(prefix + field.name)
+            nested_only, nested_related = plan(
+                field.related_model,
+                get_selections(subselections, info),
+                info,
+                prefix=f'{prefix}{field.name}__',
+            )
+            only |= nested_only
+            related |= nested_related
+
+    return only, related
+
+
+def optimize(
+    queryset: QuerySet, info: GraphQLResolveInfo, path: tuple[str, ...] = ()
+) -> QuerySet:
+    """
+    Restrict a queryset to what a GraphQL field's selection set reads.
+
+    Args:
+        queryset: The queryset the field resolves to
+        info: The field's resolve info
+        path: The fields leading from the resolved field to the model's
+            fields, such as ('edges', 'node') for a connection
+    """
+    selection_sets = [node.selection_set for node in info.field_nodes]
+    for name in path:
+        selection_sets = get_selections(selection_sets, info).get(name, [])
+    if not selection_sets:
+        return queryset
+
+    only, related = plan(queryset.model, get_selections(selection_sets, info), info)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(*only) if only else queryset
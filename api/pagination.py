@@ -0,0 +1,179 @@
+"""
+Keyset pagination for Relay connections.
+
+Rather than counting a queryset and slicing it at an offset, a cursor holds
+the values a node is ordered by, so fetching the page after it is a filter
+on those values that an index can answer directly. Every page costs the
+same however deep it is, and pages don't shift when rows are inserted.
+"""
+
+import base64
+import json
+from typing import Any
+
+import graphene
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q, QuerySet
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphql import GraphQLError
+
+from .optimizer import optimize
+
+
+class CountableConnection(graphene.relay.Connection):
+    """A connection that can count its nodes, but only when asked to."""
+
+    total_count = graphene.Int(
+        estimate=graphene.Boolean(
+            default_value=False,
+            description="Use the query planner's estimate if the database has one",
+        )
+    )
+
+    class Meta:
+        abstract = True
+
+    def resolve_total_count(self, info, estimate=False):
+        if estimate:
+            return estimate_count(self.iterable)
+        return self.iterable.count()
+
+
+def estimate_count(queryset: QuerySet) -> int:
+    """
+    The number of rows a queryset returns, estimated by PostgreSQL's planner.
+
+    Other databases have no cheap estimate, so they count exactly.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_ordering(queryset: QuerySet) -> list[str]:
+    """The fields a queryset is ordered by, ending with its primary key."""
+    ordering = list(queryset.query.order_by)
+    if not ordering and queryset.query.default_ordering:
+        ordering = list(queryset.model._meta.ordering)
+    if not all(isinstance(field, str) for field in ordering):
+        raise GraphQLError('This ordering cannot be paginated')
+    if not {'pk', '-pk', 'id', '-id'} & set(ordering):
+        ordering.append('pk')
+    return ordering
+
+
+def encode_cursor(values: list[Any]) -> str:
+    return base64.urlsafe_b64encode(
+        json.dumps(values, cls=DjangoJSONEncoder).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str, length: int) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != length:
+        raise GraphQLError(f'Invalid cursor: {cursor}')
+    return values
+
+
+def seek(ordering: list[str], values: list[Any], forwards: bool) -> Q:
+    """
+    Match the rows after a cursor in the given ordering, or before it.
+
+    (a, b, c) > (x, y, z) expands to a > x, or a = x and b > y, and so on,
+    with each comparison flipped for descending fields.
+    """
+    q = Q(pk__in=[])
+    equal = Q()
+    for field, value in zip(ordering, values, strict=True):
+        name = field.lstrip('-')
+        lookup = 'gt' if field.startswith('-') != forwards else 'lt'
+        q |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return q
+
+
+class KeysetConnectionField(DjangoFilterConnectionField):
+    """
+    A filterable connection paginated by keyset cursors instead of offsets.
+
+    Nodes are paged in the queryset's ordering, such as a model's default
+    (type_order, display) or an orderBy argument, with the primary key added
+    to break ties. Ordered fields must not be null.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Offsets are what keyset pagination replaces
+        del self.args['offset']
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, **kwargs):
+        queryset = super().resolve_queryset(connection, iterable, info, args, **kwargs)
+        return optimize(queryset, info, path=('edges', 'node'))
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        ordering = get_ordering(iterable)
+        keys = {f'_keyset_{i}': F(name.lstrip('-')) for i, name in enumerate(ordering)}
+        queryset = iterable.annotate(**keys)
+
+        first, last = args.get('first'), args.get('last')
+        after, before = args.get('after'), args.get('before')
+        if after:
+            queryset = queryset.filter(
+                seek(ordering, decode_cursor(after, len(ordering)), forwards=True)
+            )
+        if before:
+            queryset = queryset.filter(
+                seek(ordering, decode_cursor(before, len(ordering)), forwards=False)
+            )
+        if first is None and last is None:
+            first = max_limit
+
+        if first is not None or last is None:
+            queryset = queryset.order_by(*ordering)
+            if first is None:
+                nodes, has_next_page = list(queryset), False
+            else:
+                nodes = list(queryset[: first + 1])
+                has_next_page = len(nodes) > first
+                nodes = nodes[:first]
+            has_previous_page = bool(after)
+            if last is not None:
+                has_previous_page = has_previous_page or len(nodes) > last
+                nodes = nodes[-last:] if last else []
+        else:
+            reverse = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ]
+            nodes = list(queryset.order_by(*reverse)[: last + 1])
+            has_previous_page = len(nodes) > last
+            nodes = nodes[:last][::-1]
+            has_next_page = bool(before)
+
+        edges = [
+            connection.Edge(
+                node=node,
+                cursor=encode_cursor([getattr(node, key) for key in keys]),
+            )
+            for node in nodes
+        ]
+        result = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous_page,
+                has_next_page=has_next_page,
+            ),
+        )
+        # Counted lazily by CountableConnection, without the cursor filters
+        result.iterable = iterable
+        return result
@@ -1,11 +1,40 @@
 # api/schema.py
 import graphene
-from django_filters import CharFilter, FilterSet
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from django_filters import BaseInFilter, CharFilter, FilterSet, OrderingFilter
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.filter import TypedFilter
+from graphql import GraphQLError
+from graphql_relay import from_global_id
 
 from yesand.models import AIModel, DirNode, Field, Prompt
 
+from .optimizer import optimize
+from .pagination import CountableConnection, KeysetConnectionField
+
+
+def subtree_q(paths, field_name='path') -> Q:
+    """Match anything at or beneath any of the given materialised paths."""
+    q = Q(pk__in=[])
+    for path in paths:
+        q |= Q(**{f'{field_name}__startswith': path})
+    return q
+
+
+def in_scope(queryset: QuerySet, info, field_name='path') -> QuerySet:
+    """
+    Restrict a queryset to the subtree the request's API key is scoped to.
+
+    The key's directory is matched by path prefix in the same query, reading
+    its current path, so nothing matches if the directory has been deleted.
+    """
+    scope = getattr(info.context, 'api_key_scope', None)
+    if scope is None:
+        return queryset
+    return scope.filter(queryset, field_name)
+
 
 class DirNodeFilter(FilterSet):
     path_contains = CharFilter(field_name='path', lookup_expr='contains')
@@ -21,14 +50,43 @@ class DirNodeFilter(FilterSet):
 
     def filter_by_parent_name(self, queryset, name, value):
         """Filter directories by parent name based on display name pattern"""
-        parent_paths = DirNode.objects.filter(display=value).values_list(
-            'path', flat=True
+        parent_paths = (
+            DirNode.objects.alive().filter(display=value).values_list('path', flat=True)
         )
-        return queryset.filter(path__startswith=tuple(parent_paths))
+        return queryset.filter(subtree_q(parent_paths))
+
+
+class JSONObjectField(forms.JSONField):
+    def validate(self, value):
+        super().validate(value)
+        if value is not None and not isinstance(value, dict):
+            raise ValidationError('Enter a JSON object.', code='invalid')
+
+
+class JSONObjectFilter(TypedFilter):
+    """A filter taking a JSON object, sent as a JSONString."""
+
+    field_class = JSONObjectField
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(graphene.JSONString, *args, **kwargs)
 
 
 class AIModelFilter(FilterSet):
     directory = CharFilter(method='filter_by_directory')
+    # Parameters are searched by dotted key paths, such as options.top_p
+    parameters_equal = JSONObjectFilter(
+        method='filter_by_parameters',
+        help_text='Key paths and the values the parameters must have at them',
+    )
+    parameters_contains = JSONObjectFilter(
+        method='filter_by_parameters',
+        help_text='A JSON object the parameters must contain',
+    )
+    parameters_has_key = CharFilter(
+        method='filter_by_parameters',
+        help_text='A key path the parameters must have',
+    )
 
     class Meta:
         model = AIModel
@@ -40,24 +98,53 @@ class AIModelFilter(FilterSet):
 
     def filter_by_directory(self, queryset, name, value):
         """Filter AI models by directory based on display name pattern"""
-        dirnodes = DirNode.objects.filter(display=value)
-        valid_dirs = []
-        for dirnode in dirnodes:
-            valid_dirs.extend([d.id for d in dirnode.get_tree()])
-        return queryset.filter(dirnode_id__in=valid_dirs)
+        paths = (
+            DirNode.objects.alive().filter(display=value).values_list('path', flat=True)
+        )
+        return queryset.filter(subtree_q(paths, 'dirnode__path'))
+
+    def filter_by_parameters(self, queryset, name, value):
+        """Filter AI models by the JSON in their parameters"""
+        lookup = {
+            'parameters_equal': queryset.parameters_equal,
+            'parameters_contains': queryset.parameters_contain,
+            'parameters_has_key': queryset.parameters_have_key,
+        }[name]
+        try:
+            return lookup(value)
+        except ValueError as e:
+            raise GraphQLError(str(e)) from e
+
+
+class CharInFilter(BaseInFilter, CharFilter):
+    pass
 
 
 class PromptFilter(FilterSet):
     ai_model = CharFilter(method='filter_by_ai_model')
     directory = CharFilter(method='filter_by_directory')
     prompt_type = CharFilter(method='filter_by_prompt_type')
+    # Text and its hash are stored in a blob, referenced by hash
+    text__icontains = CharFilter(field_name='blob__text', lookup_expr='icontains')
+    content_hash = CharFilter(field_name='blob')
+    content_hash__in = CharInFilter(field_name='blob', lookup_expr='in')
+    order_by = OrderingFilter(
+        fields=(
+            ('display', 'display'),
+            ('length', 'length'),
+            ('token_count', 'token_count'),
+            ('blob', 'content_hash'),
+            ('id', 'id'),
+        )
+    )
 
     class Meta:
         model = Prompt
         fields = {
             'display': ['exact', 'icontains', 'istartswith'],
             'dirnode__display': ['exact', 'icontains'],
-            'text': ['icontains'],
+            'length': ['exact', 'lt', 'lte', 'gt', 'gte'],
+            'token_count': ['exact', 'lt', 'lte', 'gt', 'gte'],
         }
 
     def filter_by_ai_model(self, queryset, name, value):
@@ -66,11 +153,10 @@ class PromptFilter(FilterSet):
 
     def filter_by_directory(self, queryset, name, value):
         """Filter prompts by directory based on display name pattern"""
-        dirnodes = DirNode.objects.filter(display=value)
-        valid_dirs = []
-        for dirnode in dirnodes:
-            valid_dirs.extend([d.id for d in dirnode.get_tree()])
-        return queryset.filter(dirnode_id__in=valid_dirs)
+        paths = (
+            DirNode.objects.alive().filter(display=value).values_list('path', flat=True)
+        )
+        return queryset.filter(subtree_q(paths, 'dirnode__path'))
 
     def filter_by_prompt_type(self, queryset, name, value):
         """Filter prompts by type based on display name pattern"""
@@ -85,32 +171,76 @@ class FieldType(DjangoObjectType):
 
 
 class AIModelType(DjangoObjectType):
-    prompt_count = graphene.Int()
+    dirnode = graphene.NonNull(lambda: DirNodeType)
     api_key = graphene.String()
 
+    field_dependencies = {'api_key': ['encrypted_api_key']}
+
     class Meta:
         model = AIModel
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = AIModelFilter
-        fields = ('id', 'display', 'dirnode', 'endpoint', 'parameters', 'prompts')
+        fields = (
+            'id',
+            'display',
+            'dirnode',
+            'endpoint',
+            'parameters',
+            'prompts',
+            'prompt_count',
+        )
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return in_scope(queryset.alive(), info, 'dirnode__path')
+
+    def resolve_dirnode(self, info):
+        """Return the directory, joined if the optimizer selected it"""
+        # Alive whenever its items are, so doesn't need get_queryset
+        return self.dirnode
 
     def resolve_api_key(self, info):
-        """Return the API key if the user is authenticated"""
-        user = info.context.user
-        if not user.is_authenticated:
+        """Return the API key to signed-in users and API key holders"""
+        request = info.context
+        if not (
+            getattr(request, 'api_key_scope', None) or request.user.is_authenticated
+        ):
             return None
         return self.key
 
-    def resolve_prompt_count(self, info):
-        return self.prompts.count()
-
 
 class PromptType(DjangoObjectType):
+    dirnode = graphene.NonNull(lambda: DirNodeType)
+    text = graphene.String()
+    content_hash = graphene.String()
+
+    field_dependencies = {'text': ['blob__text'], 'content_hash': ['blob']}
+
     class Meta:
         model = Prompt
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = PromptFilter
-        fields = ('id', 'display', 'text', 'dirnode', 'aimodels', 'fields')
+        fields = (
+            'id',
+            'display',
+            'text',
+            'length',
+            'token_count',
+            'content_hash',
+            'dirnode',
+            'aimodels',
+            'fields',
+        )
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return in_scope(queryset.alive(), info, 'dirnode__path')
+
+    def resolve_dirnode(self, info):
+        """Return the directory, joined if the optimizer selected it"""
+        return self.dirnode
 
 
 class DirNodeType(DjangoObjectType):
@@ -118,15 +248,31 @@ class DirNodeType(DjangoObjectType):
     aimodels = graphene.List(AIModelType)
     prompts = graphene.List(PromptType)
 
+    field_dependencies = {'children': ['path', 'depth', 'numchild']}
+
     class Meta:
         model = DirNode
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
         filterset_class = DirNodeFilter
-        fields = ('id', 'display', 'depth', 'path')
+        fields = (
+            'id',
+            'display',
+            'depth',
+            'path',
+            'prompt_count',
+            'aimodel_count',
+            'subtree_prompt_count',
+            'subtree_aimodel_count',
+        )
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return in_scope(queryset.alive(), info)
 
     def resolve_children(self, info):
         """Return the children of this directory"""
-        return self.get_children()
+        return self.get_alive_children()
 
     def resolve_aimodels(self, info):
         """Return the AI models in this directory"""
@@ -144,9 +290,9 @@ class Query(graphene.ObjectType):
     prompt = graphene.relay.Node.Field(PromptType)
 
     # List queries with filtering
-    all_dirnodes = DjangoFilterConnectionField(DirNodeType)
-    all_aimodels = DjangoFilterConnectionField(AIModelType)
-    all_prompts = DjangoFilterConnectionField(PromptType)
+    all_dirnodes = KeysetConnectionField(DirNodeType)
+    all_aimodels = KeysetConnectionField(AIModelType)
+    all_prompts = KeysetConnectionField(PromptType)
 
     # Custom queries for specific use cases
     model_prompts = graphene.List(
@@ -156,6 +302,11 @@ class Query(graphene.ObjectType):
         prompt_type=graphene.String(),
         exact_name=graphene.String(),
     )
+    effective_prompts = graphene.List(
+        PromptType,
+        directory=graphene.ID(required=True),
+        model=graphene.String(required=True),
+    )
 
     def resolve_model_prompts(
         self, info, model_name, directory=None, prompt_type=None, exact_name=None
@@ -169,7 +320,11 @@ class Query(graphene.ObjectType):
             prompt_type: Optional prompt type (system, question, etc)
             exact_name: Optional exact prompt name to match
         """
-        query = Prompt.objects.filter(aimodels__display=model_name)
+        query = in_scope(
+            Prompt.objects.alive().filter(aimodels__display=model_name),
+            info,
+            'dirnode__path',
+        )
 
         if exact_name:
             query = query.filter(display=exact_name)
@@ -181,5 +336,33 @@ class Query(graphene.ObjectType):
 
         return query.distinct()
 
+    def resolve_effective_prompts(self, info, directory, model):
+        """
+        Fetch the prompts a directory inherits for a model, one per name.
+
+        Each is the prompt of that name in the directory or its nearest
+        ancestor with one, looked up in a table kept as the tree changes.
+
+        Args:
+            directory: ID of the directory
+            model: Name of the AI model
+        """
+        try:
+            type_name, dirnode_id = from_global_id(directory)
+        except Exception:
+            type_name = dirnode_id = None
+        if type_name != DirNodeType._meta.name or not dirnode_id.isdigit():
+            raise GraphQLError(f'Not a directory ID: {directory}')
+
+        query = in_scope(
+            Prompt.objects.filter(
+                effective__dirnode_id=dirnode_id, effective__model_name=model
+            ),
+            info,
+            # Prompts are inherited from above, so this also scopes the directory
+            'dirnode__path',
+        )
+        return optimize(query.order_by('display'), info)
+
 
 schema = graphene.Schema(query=Query)
@@ -0,0 +1,150 @@
+"""
+Per-client rate limits and concurrency caps, shared through the cache.
+
+Clients are told apart by their API key, or otherwise their IP address.
+Rates are token buckets kept as a generic cell rate algorithm: a bucket is a
+single "theoretical arrival time", which each request pushes forward by one
+token's worth of time with an atomic incr, so workers sharing Redis or
+Memcached never admit more than the rate between them. With the default
+per-process memory cache each worker keeps its own buckets.
+"""
+
+import math
+import re
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpRequest
+
+from yesand import metrics
+
+CACHE_PREFIX = 'throttle:'
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Seconds a client's in-flight count lasts, so a count left too high by a
+# worker dying mid-request corrects itself
+CONCURRENCY_TIMEOUT = 60
+
+rate_limited = metrics.Counter(
+    'graphql_rate_limited_total', 'GraphQL requests refused by a rate limit'
+)
+concurrency_limited = metrics.Counter(
+    'graphql_concurrency_limited_total',
+    'GraphQL requests refused for having too many others in flight',
+)
+
+
+class Rate(NamedTuple):
+    # Requests allowed at once after a quiet spell
+    burst: int
+    # Milliseconds it takes to earn back one request
+    interval: int
+
+
+@lru_cache
+def parse_rate(rate: str) -> Rate:
+    """Parse a rate such as 100/m, meaning bursts of 100 and 100 a minute."""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*([smhd])\s*', rate)
+    if not match or not int(match[1]):
+        raise ImproperlyConfigured(f'Invalid rate limit: {rate!r}')
+    count, period = int(match[1]), PERIODS[match[2]]
+    return Rate(burst=count, interval=math.ceil(period * 1000 / count))
+
+
+def get_client(request: HttpRequest) -> str:
+    """Who a request counts against: its API key, or its IP address."""
+    if request.api_key_scope:
+        return f'key:{request.api_key_scope.key_id}'
+    return f'ip:{request.META.get("REMOTE_ADDR", "")}'
+
+
+def take(client: str, name: str, rate: Rate) -> float:
+    """
+    Take a token from a client's bucket.
+
+    Returns:
+        float: 0 if a token was taken, otherwise seconds until one is free
+    """
+    key = f'{CACHE_PREFIX}{client}:{name}'
+    now = int(time.time() * 1000)
+    # Outlives a full refill, so expiring only resets buckets that are full
+    # anyway, or that have been busy for an hour; refusals refresh it
+    timeout = rate.burst * rate.interval // 1000 + 3600
+
+    if cache.add(key, now + rate.interval, timeout):
+        return 0
+    try:
+        arrival = cache.incr(key, rate.interval)
+    except ValueError:
+        # Expired between the add and the incr
+        cache.set(key, now + rate.interval, timeout)
+        return 0
+
+    if arrival - rate.interval < now:
+        # Quiet for long enough that the bucket is full again
+        cache.set(key, now + rate.interval, timeout)
+        return 0
+    wait = arrival - now - rate.burst * rate.interval
+    if wait <= 0:
+        return 0
+    # Refused requests don't spend tokens
+    cache.decr(key, rate.interval)
+    cache.touch(key, timeout)
+    return wait / 1000
+
+
+def check_rates(request: HttpRequest, fields: tuple[str, ...]) -> float:
+    """
+    Take a token from each bucket a request draws on.
+
+    Every request draws on the `default` limit, if there is one, and on the
+    limit for each root field it selects, such as allPrompts.
+
+    Returns:
+        float: 0 if the request is allowed, otherwise seconds to wait
+    """
+    limits = settings.GRAPHQL_RATE_LIMITS
+    client = get_client(request)
+    for name in ('default', *fields):
+        if name in limits and (wait := take(client, name, parse_rate(limits[name]))):
+            rate_limited.increment()
+            return wait
+    return 0
+
+
+@contextmanager
+def concurrency_slot(request: HttpRequest) -> Iterator[bool]:
+    """
+    Count a request as in flight for its client while the block runs.
+
+    Yields:
+        bool: Whether the client is within GRAPHQL_CONCURRENCY_LIMIT
+    """
+    limit = settings.GRAPHQL_CONCURRENCY_LIMIT
+    if not limit:
+        yield True
+        return
+
+    key = f'{CACHE_PREFIX}{get_client(request)}:in-flight'
+    cache.add(key, 0, CONCURRENCY_TIMEOUT)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, CONCURRENCY_TIMEOUT)
+        count = 1
+    try:
+        if count > limit:
+            concurrency_limited.increment()
+        yield count <= limit
+    finally:
+        try:
+            cache.decr(key)
+        except ValueError:
+            # Expired while the request ran
+            pass
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import math
+from functools import lru_cache
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from graphene_django.views import GraphQLView
+from graphql import (
+    FieldNode,
+    GraphQLError,
+    OperationType,
+    get_operation_ast,
+    parse,
+    print_ast,
+)
+
+from yesand import metrics
+from yesand.models import DataVersion
+from yesand.views import data_etag
+
+from . import throttle
+from .middleware import unauthorized
+
+CACHE_PREFIX = 'graphql:'
+
+cache_hits = metrics.Counter(
+    'graphql_cache_hits_total', 'GraphQL responses served from the cache'
+)
+cache_misses = metrics.Counter(
+    'graphql_cache_misses_total', 'GraphQL responses executed and then cached'
+)
+cache_bypasses = metrics.Counter(
+    'graphql_cache_bypasses_total', 'GraphQL requests that skipped the cache'
+)
+
+
+def graphql_etag(request: HttpRequest, *args, **kwargs) -> str | None:
+    """Data-version ETag for GraphQL queries sent by GET, but not GraphiQL."""
+    if request.method not in ('GET', 'HEAD') or 'query' not in request.GET:
+        return None
+    if GraphQLView.can_display_graphiql(request, {}):
+        return None
+    return data_etag(request)
+
+
+class Operation(NamedTuple):
+    query: str
+    name: str | None
+    cacheable: bool
+    # The operation's root fields, such as allPrompts
+    fields: tuple[str, ...]
+
+
+@lru_cache(maxsize=1024)
+def normalise(query: str, operation_name: str | None) -> Operation | None:
+    """
+    Reprint a query without comments or formatting, and check it's cacheable.
+
+    Only queries are cacheable; mutations are always executed.
+
+    Returns:
+        Operation | None: None if the query doesn't parse, which is left for
+            the execution to report
+    """
+    try:
+        document = parse(query)
+    except GraphQLError:
+        return None
+    operation = get_operation_ast(document, operation_name)
+    return Operation(
+        query=print_ast(document),
+        name=operation.name.value if operation and operation.name else None,
+        cacheable=(
+            operation is not None and operation.operation == OperationType.QUERY
+        ),
+        fields=tuple(
+            selection.name.value
+            for selection in operation.selection_set.selections
+            if isinstance(selection, FieldNode)
+        )
+        if operation
+        else (),
+    )
+
+
+def too_many_requests(message: str) -> JsonResponse:
+    return JsonResponse({'errors': [{'message': message}]}, status=429)
+
+
+def cache_scope(request: HttpRequest) -> str | None:
+    """
+    Who a cached response may be shared with, or None if it mustn't be cached.
+
+    An API key only grants its directory, so every key scoped to the same
+    directory sees the same data. What a signed-in user sees can depend on
+    who they are, so their responses are only cached, for them alone, with
+    GRAPHQL_CACHE_USERS.
+    """
+    if request.api_key_scope:
+        return f'directory:{request.api_key_scope.dirnode_id}'
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}' if settings.GRAPHQL_CACHE_USERS else None
+    return 'anonymous'
+
+
+class CachedGraphQLView(GraphQLView):
+    """
+    Serves repeated queries from the shared cache until the data changes.
+
+    Requests sending an API key only see the directory it's scoped to, and
+    beneath it. Responses are keyed on the normalised query, its variables,
+    the caller's scope and the data version, which every write bumps, so a
+    cached response is never stale and old ones simply expire. Mutations,
+    signed-in users' requests unless GRAPHQL_CACHE_USERS is set, operations
+    named in GRAPHQL_CACHE_EXCLUDE and requests sent with
+    `Cache-Control: no-cache` are always executed.
+    """
+
+    def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        request.graphql_cache = None
+        request.retry_after = None
+        # Keys are checked by APIKeyMiddleware, before sessions would be read
+        if (
+            settings.API_KEY_REQUIRED
+            and not request.api_key_scope
+            and not request.user.is_authenticated
+        ):
+            return unauthorized('An API key is required')
+
+        with throttle.concurrency_slot(request) as admitted:
+            if admitted:
+                response = super().dispatch(request, *args, **kwargs)
+            else:
+                request.retry_after = 1
+                response = too_many_requests('Too many requests in flight')
+        if request.graphql_cache:
+            response['X-Cache'] = request.graphql_cache
+        if request.retry_after:
+            response['Retry-After'] = str(math.ceil(request.retry_after))
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def get_response(self, request, data, show_graphiql=False):
+        if not show_graphiql and (wait := self.check_rates(request, data)):
+            request.retry_after = wait
+            return json.dumps({'errors': [{'message': 'Rate limit exceeded'}]}), 429
+
+        key = None if show_graphiql else self.get_cache_key(request, data)
+        if key is None:
+            cache_bypasses.increment()
+            request.graphql_cache = 'BYPASS'
+            return super().get_response(request, data, show_graphiql)
+
+        if cached := cache.get(key):
+            cache_hits.increment()
+            request.graphql_cache = 'HIT'
+            return cached
+
+        cache_misses.increment()
+        request.graphql_cache = 'MISS'
+        result, status_code = super().get_response(request, data, show_graphiql)
+        if not request.graphql_errors:
+            cache.set(key, (result, status_code), settings.GRAPHQL_CACHE_TIMEOUT)
+        return result, status_code
+
+    def execute_graphql_request(self, request, *args, **kwargs):
+        result = super().execute_graphql_request(request, *args, **kwargs)
+        # Errors may be transient, so responses with any aren't cached
+        request.graphql_errors = result is None or bool(result.errors)
+        return result
+
+    def check_rates(self, request: HttpRequest, data: dict) -> float:
+        """Seconds the request must wait under its client's rate limits."""
+        if not settings.GRAPHQL_RATE_LIMITS:
+            return 0
+        query, _, operation_name, _ = self.get_graphql_params(request, data)
+        operation = normalise(query, operation_name) if query else None
+        return throttle.check_rates(request, operation.fields if operation else ())
+
+    def get_cache_key(self, request: HttpRequest, data: dict) -> str | None:
+        """The key a request's response is cached under, or None to bypass."""
+        if not settings.GRAPHQL_CACHE_TIMEOUT:
+            return None
+        if 'no-cache' in request.headers.get('Cache-Control', ''):
+            return None
+
+        query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        if not query:
+            return None
+        operation = normalise(query, operation_name)
+        if operation is None or not operation.cacheable:
+            return None
+        if operation.name in settings.GRAPHQL_CACHE_EXCLUDE:
+            return None
+        if (scope := cache_scope(request)) is None:
+            return None
+
+        digest = hashlib.sha256(
+            json.dumps(
+                [
+                    operation.query,
+                    variables,
+                    operation_name,
+                    scope,
+                    bool(self.pretty or request.GET.get('pretty')),
+                ],
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+        return f'{CACHE_PREFIX}{settings.RELEASE}:{DataVersion.current()}:{digest}'
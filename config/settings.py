@@ -58,10 +58,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.APIKeyMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -100,6 +102,12 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT', ''),
     }
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Take the write lock when a transaction starts, so transactions that read
+    # then write, such as tree inserts, queue up instead of failing
+    DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE', 'timeout': 20}
+    # In-memory test databases fail concurrent writers instead of queueing them
+    DATABASES['default']['TEST'] = {'NAME': os.path.join(BASE_DIR, 'test.sqlite3')}
 
 
 # Password validation
@@ -147,6 +155,54 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'yesand.staticfiles.BundleFinder',
+]
+
+# Files joined into one static file each, in order
+STATIC_BUNDLES = {
+    'bundles/yesand.js': [
+        'vendor/popper/popper.min.js',
+        'vendor/bootstrap/bootstrap.min.js',
+        'vendor/htmx/htmx.min.js',
+        'js/yesand.js',
+    ],
+}
+
+# In production collectstatic writes content-hashed copies of every file with
+# gzip and brotli variants, which WhiteNoise serves with immutable caching
+PRODUCTION = os.getenv('DJANGO_ENV') == 'production'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'whitenoise.storage.CompressedManifestStaticFilesStorage'
+            if PRODUCTION
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
+WHITENOISE_USE_FINDERS = not PRODUCTION
+
+WHITENOISE_AUTOREFRESH = not PRODUCTION
+
+# Icons are read from the vendored copies rather than fetched at render time
+BS_ICONS_BASE_PATH = BASE_DIR / 'static' / 'vendor' / 'bootstrap-icons'
+
+
+# Start-up
+
+# Import the app, compile templates and render the first pages when the WSGI
+# module loads, so with gunicorn --preload the master does it once for every
+# worker; /ready/ answers 503 until it's done
+WARM_UP = env.bool('WARM_UP', default=PRODUCTION)
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -155,12 +211,69 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 BOOTSTRAP5 = {
-    'theme_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/pulse/bootstrap.min.css',
     'color_mode': 'dark',
-    'javascript_in_head': False,
 }
 
 
+# Deletion
+
+# Seconds a deleted directory stays restorable before purge_deleted removes it
+DELETION_GRACE_PERIOD = int(os.getenv('DELETION_GRACE_PERIOD', '3600'))
+
+# Seconds prompt text is kept after it was last stored, even if no prompt uses
+# it, so collect_prompt_blobs can't remove it before the prompt is written
+PROMPT_BLOB_GRACE_PERIOD = int(os.getenv('PROMPT_BLOB_GRACE_PERIOD', '600'))
+
+
+# Snapshots
+
+# Where published snapshot files are written and served from
+SNAPSHOT_ROOT = Path(os.getenv('SNAPSHOT_ROOT', BASE_DIR / 'snapshots'))
+
+
+# Jobs
+
+# Seconds without a progress report before a running job's worker is presumed
+# dead and the job is queued again
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', '300'))
+
+
+# Change events
+
+# Seconds change events are kept, so clients can resume streams from them
+CHANGE_EVENT_RETENTION = int(os.getenv('CHANGE_EVENT_RETENTION', '86400'))
+
+# Seconds between each process's reads of the events other processes publish
+CHANGE_EVENT_POLL_INTERVAL = float(os.getenv('CHANGE_EVENT_POLL_INTERVAL', '1'))
+
+# Seconds an event stream stays open before the client is made to reconnect,
+# and is possibly served by another process
+CHANGE_EVENT_STREAM_TIMEOUT = int(os.getenv('CHANGE_EVENT_STREAM_TIMEOUT', '300'))
+
+# Event streams each process keeps open at once, each holding one of its
+# threads; keep it below GUNICORN_THREADS, so ordinary requests have threads
+# left, as streams over it are refused with a 503
+CHANGE_EVENT_MAX_STREAMS = int(os.getenv('CHANGE_EVENT_MAX_STREAMS', '8'))
+
+
+# Prompts
+
+# Dotted path to a callable counting the tokens in a string, stored with each
+# prompt; run backfill_prompt_metadata after changing it
+PROMPT_TOKENIZER = os.getenv('PROMPT_TOKENIZER', 'yesand.tokenizers.estimate_tokens')
+
+
+# Caching
+
+# Shared by every process when pointed at Redis or Memcached, for example
+# redis://localhost:6379/0 (needs the redis package)
+CACHES = {'default': env.cache_url('CACHE_URL', default='locmemcache://')}
+
+# Part of every data-version ETag; change it on deploy so clients revalidate
+# fragments rendered by the previous templates
+RELEASE = os.getenv('RELEASE', '')
+
+
 # Admin
 
 X_FRAME_OPTIONS = 'SAMEORIGIN'
@@ -171,3 +284,56 @@ SILENCED_SYSTEM_CHECKS = ['security.W019']
 # GraphQL
 
 GRAPHENE = {'SCHEMA': 'api.schema.schema'}
+
+# Bearer token to scrape /metrics/ with, which otherwise only signed-in
+# staff can read
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Seconds a GraphQL query's response is cached for; 0 turns the cache off.
+# Entries are keyed on the data version, so writes never serve stale data.
+GRAPHQL_CACHE_TIMEOUT = int(os.getenv('GRAPHQL_CACHE_TIMEOUT', '300'))
+
+# Names of operations that are always executed, never served from the cache
+GRAPHQL_CACHE_EXCLUDE = env.list('GRAPHQL_CACHE_EXCLUDE', default=[])
+
+# Cache signed-in users' responses, each for that user alone; off by default,
+# as what a user sees may depend on who they are
+GRAPHQL_CACHE_USERS = env.bool('GRAPHQL_CACHE_USERS', default=False)
+
+# GraphQL rate limits per client, meaning API key or IP address, as token
+# buckets such as 100/m: bursts of 100, refilled at 100 a minute. `default`
+# applies to every request, and others to queries selecting that root field,
+# for example GRAPHQL_RATE_LIMITS=default=600/m,allPrompts=60/m
+GRAPHQL_RATE_LIMITS = env.dict('GRAPHQL_RATE_LIMITS', default={})
+
+# GraphQL requests a client may have in flight at once, across every worker;
+# 0 for no limit
+GRAPHQL_CONCURRENCY_LIMIT = int(os.getenv('GRAPHQL_CONCURRENCY_LIMIT', '0'))
+
+# Refuse GraphQL requests without an API key, or a signed-in user
+API_KEY_REQUIRED = env.bool('API_KEY_REQUIRED', default=False)
+
+# Seconds each process trusts a checked API key before checking it again, so
+# also how long a revoked key can go on working in other processes
+API_KEY_CACHE_TIMEOUT = int(os.getenv('API_KEY_CACHE_TIMEOUT', '60'))
+
+
+# Inference gateway
+
+# Serve /gateway/, which forwards prompts to AI model endpoints for API key
+# holders, so they don't have to fetch keys and connect to endpoints themselves
+GATEWAY_ENABLED = env.bool('GATEWAY_ENABLED', default=False)
+
+# Requests each process has in flight to one endpoint origin at once, which
+# is also how many keep-alive connections it keeps open to it
+GATEWAY_MAX_CONNECTIONS = int(os.getenv('GATEWAY_MAX_CONNECTIONS', '10'))
+
+# Seconds a request waits for one of those before it's refused with a 503
+GATEWAY_QUEUE_TIMEOUT = float(os.getenv('GATEWAY_QUEUE_TIMEOUT', '5'))
+
+# Seconds to wait for an endpoint to connect, or to send more of a response
+GATEWAY_TIMEOUT = float(os.getenv('GATEWAY_TIMEOUT', '60'))
+
+# Seconds an idle connection is kept for reuse; keep it below the endpoints'
+# own keep-alive timeouts
+GATEWAY_IDLE_TIMEOUT = float(os.getenv('GATEWAY_IDLE_TIMEOUT', '30'))
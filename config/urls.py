@@ -3,26 +3,73 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+from django.views.decorators.http import require_POST
 
+from api.views import CachedGraphQLView, graphql_etag
 from yesand import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('health/', views.health_check, name='health'),
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True)), name='api'),
+    path('ready/', views.ready_check, name='ready'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path(
+        'graphql/',
+        views.conditional(
+            csrf_exempt(CachedGraphQLView.as_view(graphiql=True)),
+            etag_func=graphql_etag,
+        ),
+        name='api',
+    ),
     path('', views.ProjectsView.as_view(), name='projects'),
-    path('filesystem/', views.TreeView.get_filesystem, name='get_filesystem'),
+    path(
+        'filesystem/',
+        views.conditional(views.TreeView.get_filesystem),
+        name='get_filesystem',
+    ),
     path(
         'breadcrumb/<str:node_type>/<int:node_id>/',
-        views.TreeView.get_breadcrumb,
+        views.conditional(views.TreeView.get_breadcrumb),
         name='get_breadcrumb',
     ),
+    path(
+        'menu/<str:node_type>/<int:node_id>/',
+        views.conditional(views.TreeView.get_menu),
+        name='get_menu',
+    ),
     path(
         'content/<str:node_type>/<int:node_id>/',
-        views.TreeView.get_content,
+        views.conditional(views.TreeView.get_content),
         name='get_content',
     ),
+    path('events/', views.EventView.stream, name='events'),
+    path(
+        'events/<int:dirnode_id>/',
+        views.EventView.stream,
+        name='directory_events',
+    ),
+    path(
+        'gateway/',
+        csrf_exempt(require_POST(views.GatewayView.forward)),
+        name='gateway',
+    ),
+    path('targets/', views.ModalView.search_targets, name='search_targets'),
+    path('jobs/<int:job_id>/', views.JobView.get_progress, name='job_progress'),
+    path(
+        'snapshots/<int:dirnode_id>/latest/',
+        views.SnapshotView.get_latest,
+        name='get_latest_snapshot',
+    ),
+    path(
+        'snapshots/<int:dirnode_id>/<int:version>/',
+        views.SnapshotView.get_snapshot,
+        name='get_snapshot',
+    ),
+    path(
+        'jobs/<int:job_id>/cancel/',
+        require_POST(views.JobView.cancel),
+        name='cancel_job',
+    ),
     path(
         'modal/<str:node_type>/<str:action>/',
         views.ModalView.handle_modal,
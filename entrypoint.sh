@@ -14,21 +14,36 @@ wait_for_db() {
 
 wait_for_db
 
-# Apply migrations
-echo "Applying database migrations..."
-poetry run python manage.py migrate
+# Run queued jobs instead of serving requests
+if [ "$1" = "worker" ]; then
+    echo "Starting job worker..."
+    exec python manage.py worker
+fi
+
+# Apply migrations, unless there are none to apply
+if python manage.py migrate --check > /dev/null 2>&1; then
+    echo "Database migrations are up to date"
+else
+    echo "Applying database migrations..."
+    python manage.py migrate
+fi
 
 # Start server based on environment
 if [ "$DJANGO_ENV" = "production" ]; then
     echo "Starting Gunicorn server..."
-    exec poetry run gunicorn myproject.wsgi:application \
+    # Load and warm up the app once, then fork it into the workers. Event
+    # streams each hold a thread, so serve with threads; see
+    # CHANGE_EVENT_MAX_STREAMS
+    exec gunicorn config.wsgi:application \
+        --preload \
         --bind 0.0.0.0:8000 \
         --workers ${GUNICORN_WORKERS:-3} \
-        --worker-class ${GUNICORN_WORKER_CLASS:-sync} \
+        --worker-class ${GUNICORN_WORKER_CLASS:-gthread} \
+        --threads ${GUNICORN_THREADS:-16} \
         --timeout ${GUNICORN_TIMEOUT:-30} \
         --access-logfile - \
         --error-logfile -
 else
     echo "Starting development server..."
-    exec poetry run python manage.py runserver 0.0.0.0:8000
+    exec python manage.py runserver 0.0.0.0:8000
 fi
\ No newline at end of file
@@ -0,0 +1,86 @@
+// Filesystem
+// The breadcrumb arrives as an out-of-band swap with each content response
+
+// Listen for form submissions that modify data
+document.body.addEventListener('htmx:afterRequest', function(evt) {
+    if (evt.detail.successful && evt.detail.pathInfo.requestPath.includes('save')) {
+        // Trigger updates
+        htmx.trigger(document.body, 'filesystemChanged');
+
+        // Close modal if open
+        var modal = bootstrap.Modal.getInstance(document.getElementById('itemModal'));
+        if (modal) {
+            modal.hide();
+        }
+    }
+});
+
+// Modal
+document.addEventListener('DOMContentLoaded', function() {
+    var itemModal = document.getElementById('itemModal');
+    var bsModal = new bootstrap.Modal(itemModal);
+
+    htmx.on('htmx:afterSwap', function(event) {
+        if (event.detail.target.id === 'modal-content') {
+            bsModal.show();
+        }
+    });
+
+    htmx.on('htmx:beforeSwap', function(event) {
+        if (event.detail.target.id === 'filesystem') {
+            bsModal.hide();
+        }
+    });
+
+    // Actions send back only the parts of the sidebar they changed
+    htmx.on('htmx:afterRequest', function(event) {
+        var verb = event.detail.requestConfig.verb;
+        if (event.detail.successful && verb === 'post' && itemModal.contains(event.detail.elt)) {
+            bsModal.hide();
+        }
+    });
+
+    itemModal.addEventListener('hidden.bs.modal', function () {
+        document.getElementById('modal-content').innerHTML = '';
+    });
+});
+
+// Text field autoresize
+function autoResize(textarea) {
+    textarea.style.height = 'auto';
+    const lineHeight = parseFloat(getComputedStyle(textarea).lineHeight);
+    const minHeight = 3 * lineHeight;
+    const contentHeight = textarea.scrollHeight;
+    const extraRowHeight = lineHeight;
+
+    textarea.style.height = Math.max(contentHeight + extraRowHeight, minHeight) + 'px';
+}
+
+function initAutoResize(textarea) {
+    autoResize(textarea); // Initial resize
+    textarea.addEventListener('input', function() {
+        autoResize(this);
+    });
+}
+
+// Initialize for existing textareas
+document.querySelectorAll('.auto-resize').forEach(initAutoResize);
+
+// Set up a MutationObserver to watch for new textareas
+const observer = new MutationObserver(function(mutations) {
+    mutations.forEach(function(mutation) {
+        mutation.addedNodes.forEach(function(node) {
+            if (node.nodeType === Node.ELEMENT_NODE) {
+                node.querySelectorAll('.auto-resize').forEach(initAutoResize);
+            }
+        });
+    });
+});
+
+// Start observing the document body for changes
+observer.observe(document.body, { childList: true, subtree: true });
+
+// Handle HTMX after-swap event
+document.body.addEventListener('htmx:afterSwap', function(event) {
+    event.detail.elt.querySelectorAll('.auto-resize').forEach(initAutoResize);
+});
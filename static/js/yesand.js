@@ -0,0 +1,58 @@
+// Refresh after saves
+// Listen for form submissions that modify data
+document.body.addEventListener('htmx:afterRequest', function(evt) {
+    if (evt.detail.successful && evt.detail.pathInfo.requestPath.includes('save')) {
+        // Trigger updates
+        htmx.trigger(document.body, 'filesystemChanged');
+        htmx.trigger(document.body, 'breadcrumbChanged');
+        htmx.trigger(document.body, 'contentChanged');
+
+        // Close modal if open
+        var modal = bootstrap.Modal.getInstance(document.getElementById('itemModal'));
+        if (modal) {
+            modal.hide();
+        }
+    }
+});
+
+// Bootstrap dropdowns
+document.addEventListener('DOMContentLoaded', function() {
+    htmx.onLoad(function(content) {
+        var dropdowns = content.querySelectorAll('[data-bs-toggle="dropdown"]');
+        dropdowns.forEach(function(dropdownToggle) {
+            new bootstrap.Dropdown(dropdownToggle);
+        });
+    })
+});
+
+// Theme toggle functionality
+document.addEventListener('DOMContentLoaded', function() {
+    const themeDropdown = document.getElementById('themeDropdown');
+    const dropdownMenu = themeDropdown.nextElementSibling;
+
+    function setTheme(theme) {
+        document.documentElement.setAttribute('data-bs-theme', theme);
+        localStorage.setItem('theme', theme);
+    }
+
+    const savedTheme = localStorage.getItem('theme') || 'light';
+    setTheme(savedTheme);
+
+    // Use event delegation for dropdown items
+    dropdownMenu.addEventListener('click', (e) => {
+        const item = e.target.closest('[data-theme]');
+        if (item) {
+            e.preventDefault();
+            const newTheme = item.getAttribute('data-theme');
+            setTheme(newTheme);
+        }
+    });
+
+    // Initialize Bootstrap dropdown
+    new bootstrap.Dropdown(themeDropdown);
+});
+
+// Signal that JS has loaded
+document.addEventListener('htmx:afterSettle', function() {
+    document.dispatchEvent(new Event('js-loaded'));
+});
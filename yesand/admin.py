@@ -1,23 +1,237 @@
-from django.contrib import admin
+from urllib.parse import urlencode
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.views.main import ChangeList
+from django.db import transaction
 from django.db.models import JSONField
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
 from django_json_widget.widgets import JSONEditorWidget
 from treebeard.admin import TreeAdmin
 from treebeard.forms import movenodeform_factory
 
-from .models import AIModel, DirNode, Field, Prompt
+from .models import (
+    AIModel,
+    APIKey,
+    ChangeEvent,
+    DataVersion,
+    DirNode,
+    EffectivePrompt,
+    Field,
+    Job,
+    Prompt,
+    Snapshot,
+)
+
+
+class DirNodeChangeList(ChangeList):
+    def get_results(self, request):
+        """Fetch the parents the tree template looks up in one query."""
+        super().get_results(request)
+        steplen = DirNode.steplen
+        paths = {node.path[:-steplen] for node in self.result_list if node.depth > 1}
+        parents = {
+            parent.path: parent
+            for parent in DirNode.objects.filter(path__in=paths).only('id', 'path')
+        }
+        for node in self.result_list:
+            if node.depth > 1:
+                node._cached_parent_obj = parents[node.path[:-steplen]]
 
 
 class DirNodeAdmin(TreeAdmin):
+    """
+    A page of the tree at a time, in path order.
+
+    Directories with subdirectories link to a page of just those, so large
+    trees can be walked a level at a time.
+    """
+
     form = movenodeform_factory(DirNode)
+    list_display = ['display', 'subdirectories', 'deleted_at']
+    list_filter = ['depth', ('deleted_at', admin.EmptyFieldListFilter)]
+    search_fields = ['display']
+    ordering = ['path']
+    show_full_result_count = False
+    actions = ['restore_directories']
+
+    def get_changelist(self, request, **kwargs):
+        return DirNodeChangeList
+
+    @admin.display(description='Subdirectories')
+    def subdirectories(self, node):
+        if not node.numchild:
+            return 0
+        query = urlencode({'path__startswith': node.path, 'depth': node.depth + 1})
+        url = reverse('admin:yesand_dirnode_changelist')
+        return format_html('<a href="{}?{}">{}</a>', url, query, node.numchild)
+
+    @admin.action(description='Restore selected deleted directories')
+    def restore_directories(self, request, queryset):
+        restored = 0
+        for node in queryset.tombstoned().order_by('depth'):
+            node.refresh_from_db()
+            try:
+                restored += node.restore()
+            except ValueError as e:
+                self.message_user(request, str(e), messages.WARNING)
+        self.message_user(request, f'Restored {restored} directories.')
 
 
 admin.site.register(DirNode, DirNodeAdmin)
-admin.site.register(Field)
-admin.site.register(Prompt)
+
+
+@admin.register(Field)
+class FieldAdmin(admin.ModelAdmin):
+    search_fields = ['template']
+
+
+class DirectoryActionForm(ActionForm):
+    directory = forms.ModelChoiceField(
+        DirNode.objects.alive(),
+        required=False,
+        widget=forms.NumberInput,
+        label='Directory id:',
+        help_text='The directory to move the selected items to',
+    )
+
+
+class PromptAdminForm(forms.ModelForm):
+    text = forms.CharField(required=False, widget=forms.Textarea)
+
+    class Meta:
+        model = Prompt
+        fields = ['display', 'dirnode', 'text', 'aimodels', 'fields']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial.setdefault('text', self.instance.text)
+
+    def save(self, commit=True):
+        self.instance.text = self.cleaned_data['text']
+        return super().save(commit)
+
+
+@admin.register(Prompt)
+class PromptAdmin(admin.ModelAdmin):
+    form = PromptAdminForm
+    action_form = DirectoryActionForm
+    list_display = ['display', 'dirnode', 'length', 'token_count']
+    list_select_related = ['dirnode']
+    search_fields = ['display']
+    autocomplete_fields = ['dirnode', 'aimodels', 'fields']
+    readonly_fields = ['length', 'token_count', 'content_hash']
+    show_full_result_count = False
+    actions = ['move_prompts', 'clear_aimodels']
+
+    @admin.action(description='Move selected prompts to the directory')
+    def move_prompts(self, request, queryset):
+        # The action form was validated before the action was called
+        field = self.action_form.base_fields['directory']
+        directory = field.clean(request.POST.get('directory'))
+        if directory is None:
+            self.message_user(request, 'Enter a directory id.', messages.WARNING)
+            return
+        aimodels = Prompt.get_ancestor_aimodels_for_dirnode(directory.id)
+        with transaction.atomic():
+            # Only AI models from the new directory's ancestors can stay
+            # linked; the moved rows are unlinked first, while the queryset
+            # still matches them
+            links = Prompt.aimodels.through.objects.filter(prompt__in=queryset).exclude(
+                aimodel__in=aimodels
+            )
+            unlinked = set(links.values_list('aimodel_id', flat=True))
+            links.delete()
+            moved = queryset.update(dirnode=directory)
+            # Deleting the links directly sends no m2m_changed to recount
+            AIModel.objects.filter(id__in=unlinked).recount_prompts()
+        self.message_user(request, f'Moved {moved} prompts to {directory}.')
+
+    @admin.action(description='Unlink AI models from selected prompts')
+    def clear_aimodels(self, request, queryset):
+        with transaction.atomic():
+            event = ChangeEvent.for_rows(queryset, ChangeEvent.Action.UPDATED)
+            links = Prompt.aimodels.through.objects.filter(prompt__in=queryset)
+            unlinked = set(links.values_list('aimodel_id', flat=True))
+            cleared, _ = links.delete()
+            # Deleting the links directly sends no m2m_changed to refresh
+            # what the prompts' subtrees inherit, recount the AI models' prompts
+            # and publish the change
+            EffectivePrompt.refresh(*EffectivePrompt.scope(queryset))
+            AIModel.objects.filter(id__in=unlinked).recount_prompts()
+            DataVersion.bump()
+            if event:
+                event.publish()
+        self.message_user(request, f'Removed {cleared} AI model links.')
 
 
 @admin.register(AIModel)
 class AIModelAdmin(admin.ModelAdmin):
+    list_display = ['display', 'dirnode', 'endpoint']
+    list_select_related = ['dirnode']
+    search_fields = ['display']
+    autocomplete_fields = ['dirnode']
+    show_full_result_count = False
     formfield_overrides = {
         JSONField: {'widget': JSONEditorWidget},
     }
+    actions = ['clear_api_keys']
+
+    @admin.action(description='Clear API keys of selected AI models')
+    def clear_api_keys(self, request, queryset):
+        cleared = queryset.filter(encrypted_api_key__isnull=False).update(
+            encrypted_api_key=None
+        )
+        self.message_user(request, f'Cleared {cleared} API keys.')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'name', 'status', 'progress', 'total', 'created_at']
+    list_filter = ['status', 'name']
+    actions = ['cancel_jobs']
+
+    @admin.action(description='Cancel selected jobs')
+    def cancel_jobs(self, request, queryset):
+        for job in queryset.exclude(status__in=Job.FINISHED):
+            job.cancel()
+        self.message_user(request, 'Cancellation requested.')
+
+
+@admin.register(Snapshot)
+class SnapshotAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'size', 'sha256', 'created_at']
+    readonly_fields = ['filename', 'sha256', 'size']
+
+
+@admin.register(APIKey)
+class APIKeyAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'dirnode', 'created_at', 'revoked_at']
+    list_select_related = ['dirnode']
+    list_filter = ['revoked_at']
+    readonly_fields = ['prefix', 'created_at']
+    raw_id_fields = ['dirnode']
+    actions = ['revoke_keys']
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            key = obj.set_key()
+        super().save_model(request, obj, form, change)
+        if not change:
+            self.message_user(
+                request,
+                f'The new API key is {key}. Copy it now; it cannot be shown again.',
+                messages.WARNING,
+            )
+
+    @admin.action(description='Revoke selected API keys')
+    def revoke_keys(self, request, queryset):
+        revoked = queryset.filter(revoked_at__isnull=True).update(
+            revoked_at=timezone.now()
+        )
+        APIKey._cache.clear()
+        self.message_user(request, f'Revoked {revoked} API keys.')
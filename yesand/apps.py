@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class YesandConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'yesand'
+
+    def ready(self) -> None:
+        from . import signals  # noqa: F401
@@ -0,0 +1,291 @@
+"""
+Streams change events to clients as server-sent events.
+
+Every write to the tree publishes a ChangeEvent row. Each process has one
+Broadcaster, which reads new rows into a short in-memory buffer that all of
+the process's streams wait on, so a process polls the database once per
+CHANGE_EVENT_POLL_INTERVAL however many clients it streams to. There's no
+thread of its own: whichever stream is waiting when a poll is due makes it.
+Events published by the process itself are read as soon as they commit.
+
+Each open stream holds a server thread, so a process streams to at most
+CHANGE_EVENT_MAX_STREAMS clients at once, leaving its other threads for
+ordinary requests. Streams over the cap are refused.
+
+Event ids come from a sequence, so a transaction that commits late can add
+an id below ones already read. Skipped ids are looked for again for
+GAP_TIMEOUT seconds before they're given up as rolled back.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Iterator, NamedTuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Q
+
+from . import metrics
+from .models import ChangeEvent, change_published
+
+logger = logging.getLogger(__name__)
+
+# Events kept in memory per process, for streams that fall behind or resume
+BUFFER_SIZE = 1000
+
+# Events read from the database at a time
+BATCH_SIZE = 500
+
+# Seconds to keep looking for the events of ids skipped by a poll
+GAP_TIMEOUT = 10
+
+# Seconds between comments sent to keep idle streams open through proxies
+KEEPALIVE = 15
+
+# Milliseconds clients wait before reconnecting to a closed stream
+RETRY = 1000
+
+streams_refused = metrics.Counter(
+    'event_streams_refused_total',
+    'Event streams refused for a process having too many open already',
+)
+
+
+class StreamsFull(Exception):
+    """Raised when a process already has as many streams open as it may."""
+
+
+class Event(NamedTuple):
+    id: int
+    node_type: str
+    node_id: int | None
+    action: str
+    version: int
+    path: str
+    from_path: str
+
+    def encode(self, name: str = 'change') -> str:
+        """The event in the text/event-stream format."""
+        data = {
+            'type': self.node_type,
+            'id': self.node_id,
+            'action': self.action,
+            'version': self.version,
+        }
+        return f'id: {self.id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+def read_events(rows: Q) -> list[Event]:
+    return [
+        Event(*row)
+        for row in ChangeEvent.objects.filter(rows)
+        .order_by('id')
+        .values_list(*Event._fields)[:BATCH_SIZE]
+    ]
+
+
+class Subscription(NamedTuple):
+    """Which events a stream is sent."""
+
+    # The directory subscribed to, '' for the whole tree
+    path: str
+    # The directory an API key limits the stream to, '' for none
+    scope: str = ''
+
+    def matches(self, event: Event) -> bool:
+        """
+        Whether an event affects the subscribed subtree, and can be seen.
+
+        Writes in the subtree affect it, and so do writes to the directories
+        above it, which hold its AI models and can move or delete it.
+        """
+        paths = [event.path, event.from_path] if event.from_path else [event.path]
+        return any(self._affects(path) for path in paths)
+
+    def _affects(self, path: str) -> bool:
+        related = path.startswith(self.path) or self.path.startswith(path)
+        # Writes spanning several roots, at '', name no node
+        return related and (not path or path.startswith(self.scope))
+
+
+class Broadcaster:
+    """Reads new change events once per process, for every stream to share."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.poll_lock = threading.Lock()
+        # (sequence, event) pairs, oldest first
+        self.buffer: deque[tuple[int, Event]] = deque(maxlen=BUFFER_SIZE)
+        # Counts the events buffered, so streams can tell what they've seen
+        self.sequence = 0
+        self.last_id = 0
+        # Ids skipped by a poll, to when they're given up on
+        self.gaps: dict[int, float] = {}
+        self.polled_at = 0.0
+        self.subscribers = 0
+
+    def subscribe(self) -> int:
+        """
+        Register a new stream.
+
+        Returns:
+            int: The sequence the stream has seen up to
+
+        Raises:
+            StreamsFull: If CHANGE_EVENT_MAX_STREAMS streams are open
+        """
+        with self.condition:
+            if self.subscribers >= settings.CHANGE_EVENT_MAX_STREAMS:
+                streams_refused.increment()
+                raise StreamsFull
+            if not self.subscribers:
+                # Nothing was read while no one listened, so start at the end
+                latest = ChangeEvent.objects.order_by('-id').values_list('id').first()
+                self.last_id = latest[0] if latest else 0
+                self.gaps = {}
+                self.polled_at = time.monotonic()
+            self.subscribers += 1
+            return self.sequence
+
+    def unsubscribe(self) -> None:
+        with self.condition:
+            self.subscribers -= 1
+
+    def poll_soon(self, **kwargs) -> None:
+        """Have the next waiting stream poll, when this process published."""
+        with self.condition:
+            self.polled_at = 0.0
+            self.condition.notify_all()
+
+    def poll(self) -> None:
+        """Read the events committed since the last poll into the buffer."""
+        self.polled_at = now = time.monotonic()
+        self.gaps = {gap: until for gap, until in self.gaps.items() if until > now}
+        events = read_events(Q(id__gt=self.last_id) | Q(id__in=self.gaps))
+        expected = self.last_id + 1
+        for event in events:
+            self.gaps.pop(event.id, None)
+            if event.id >= expected:
+                self.gaps.update(
+                    (gap, now + GAP_TIMEOUT) for gap in range(expected, event.id)
+                )
+                expected = event.id + 1
+        self.last_id = expected - 1
+
+        if events:
+            with self.condition:
+                for event in events:
+                    self.sequence += 1
+                    self.buffer.append((self.sequence, event))
+                self.condition.notify_all()
+
+    def wait(self, seen: int, timeout: float) -> tuple[list[Event] | None, int]:
+        """
+        Wait for events after a sequence, polling when it's due.
+
+        Returns:
+            tuple: The new events, or None if some fell out of the buffer
+                before they were read, and the sequence now seen up to
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.condition:
+                if self.sequence > seen:
+                    if not self.buffer or self.buffer[0][0] > seen + 1:
+                        return None, self.sequence
+                    return [e for s, e in self.buffer if s > seen], self.sequence
+
+            now = time.monotonic()
+            if now >= deadline:
+                return [], seen
+            due = self.polled_at + settings.CHANGE_EVENT_POLL_INTERVAL
+            if now >= due and self.poll_lock.acquire(blocking=False):
+                try:
+                    self.poll()
+                except DatabaseError:
+                    logger.warning('Polling for change events failed', exc_info=True)
+                    # Reconnect on the next poll
+                    connection.close()
+                finally:
+                    self.poll_lock.release()
+                continue
+            with self.condition:
+                # Another stream may be polling, so look again shortly
+                self.condition.wait(min(deadline - now, max(0.01, due - now)))
+
+    def find(self, event_id: int) -> int | None:
+        """The sequence of a buffered event, if it's still buffered."""
+        with self.condition:
+            return next((s for s, e in self.buffer if e.id == event_id), None)
+
+
+broadcaster = Broadcaster()
+change_published.connect(broadcaster.poll_soon)
+
+
+class Stream:
+    """
+    The events matching a subscription, as text/event-stream.
+
+    A stream resuming from an event that's no longer buffered is sent what
+    the database still has since then. Whenever events may have been missed,
+    a `reset` event tells the client to reload whatever it shows. Streams
+    end after CHANGE_EVENT_STREAM_TIMEOUT seconds, and clients reconnect.
+
+    The stream takes its place among the process's open streams as soon as
+    it's made, and gives it up when it ends or is closed, even unread.
+
+    Raises:
+        StreamsFull: If CHANGE_EVENT_MAX_STREAMS streams are open
+    """
+
+    def __init__(self, subscription: Subscription, last_event_id: int | None):
+        self.subscription = subscription
+        self.last_event_id = last_event_id
+        self.broadcaster = broadcaster
+        self.seen = self.broadcaster.subscribe()
+        self.closed = False
+
+    def __iter__(self) -> Iterator[str]:
+        return self.events()
+
+    def close(self) -> None:
+        """Give up the stream's place, once, when the response is closed."""
+        if not self.closed:
+            self.closed = True
+            self.broadcaster.unsubscribe()
+
+    def events(self) -> Iterator[str]:
+        seen = self.seen
+        # Events read from the database, which the buffer may also have by now
+        resent = set()
+        try:
+            yield f'retry: {RETRY}\n\n'
+            if self.last_event_id is not None:
+                if (resumed := self.broadcaster.find(self.last_event_id)) is not None:
+                    seen = resumed
+                else:
+                    missed = read_events(Q(id__gt=self.last_event_id))
+                    if len(missed) == BATCH_SIZE:
+                        yield 'event: reset\ndata: {}\n\n'
+                    else:
+                        resent = {event.id for event in missed}
+                        for event in missed:
+                            if self.subscription.matches(event):
+                                yield event.encode()
+
+            deadline = time.monotonic() + settings.CHANGE_EVENT_STREAM_TIMEOUT
+            while (remaining := deadline - time.monotonic()) > 0:
+                events, seen = self.broadcaster.wait(seen, min(KEEPALIVE, remaining))
+                if events is None:
+                    yield 'event: reset\ndata: {}\n\n'
+                elif not events:
+                    yield ': keep-alive\n\n'
+                for event in events or ():
+                    if event.id not in resent and self.subscription.matches(event):
+                        yield event.encode()
+        finally:
+            self.close()
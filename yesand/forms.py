@@ -1,4 +1,5 @@
 from django import forms
+from django.db.models import QuerySet
 from django.forms import ModelForm
 from django_json_widget.widgets import JSONEditorWidget
 
@@ -20,20 +21,35 @@ class DisplayNameForm(ModelForm):
 
 
 class TargetNodeForm(forms.Form):
-    """Base form for operations that need a target directory."""
-
-    target_id = forms.ChoiceField(
-        required=False,
-        widget=forms.Select(
-            attrs={'class': 'form-select', 'aria-label': 'Select destination directory'}
-        ),
-    )
+    """
+    Base form for operations that need a target directory.
+
+    Targets are picked with the search in modal/target_search.html rather than
+    a full dropdown, so only the chosen directory is ever checked here.
+    """
+
+    target_id = forms.IntegerField(required=False)
+
+    def __init__(
+        self,
+        *args,
+        targets: QuerySet[DirNode] | None = None,
+        allow_root: bool = False,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.targets = DirNode.objects.alive() if targets is None else targets
+        self.allow_root = allow_root
 
     def clean_target_id(self):
-        """Convert empty string to None for the target_id field."""
+        """Check the target is a directory this node can be sent to."""
         value = self.cleaned_data['target_id']
-        if value == '':
+        if value is None:
+            if not self.allow_root:
+                raise forms.ValidationError('Select a destination directory.')
             return None
+        if not self.targets.filter(id=value).exists():
+            raise forms.ValidationError('Select a valid destination directory.')
         return value
 
 
@@ -90,6 +106,7 @@ class AddPromptForm(DisplayNameForm):
 
     def save(self):
         instance = super().save(commit=False)
+        instance.text = self.cleaned_data['text']
         if parent_id := self.cleaned_data.get('parent_id'):
             instance.dirnode_id = parent_id
         instance.save()
@@ -159,18 +176,23 @@ class EditAIModelForm(EditFormMixin, forms.ModelForm):
 class EditPromptForm(EditFormMixin, forms.ModelForm):
     """Form for editing Prompts."""
 
+    # Prompt text lives in a blob, so it's a property rather than a model field
+    text = forms.CharField(
+        required=False,
+        widget=forms.Textarea(
+            attrs={
+                'rows': '3',
+                'placeholder': 'Enter prompt text',
+                'class': 'auto-resize',
+            }
+        ),
+    )
+
     class Meta:
         model = Prompt
         fields = ['display', 'text', 'aimodels']
         widgets = {
             'display': forms.TextInput(attrs={'placeholder': 'Enter display name'}),
-            'text': forms.Textarea(
-                attrs={
-                    'rows': '3',
-                    'placeholder': 'Enter prompt text',
-                    'class': 'auto-resize',
-                }
-            ),
             'aimodels': forms.CheckboxSelectMultiple(
                 attrs={'class': 'form-check-input'}
             ),
@@ -179,6 +201,7 @@ class EditPromptForm(EditFormMixin, forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if self.instance and self.instance.pk:
+            self.initial.setdefault('text', self.instance.text)
             # Only show AI models from ancestor directories
             self.fields['aimodels'].queryset = self.instance.get_ancestor_aimodels()
 
@@ -186,6 +209,14 @@ class EditPromptForm(EditFormMixin, forms.ModelForm):
         self.fields['aimodels'].widget.attrs['class'] = 'form-check-input'
         self.fields['aimodels'].label_attrs = {'class': 'form-check-label'}
 
+    def save(self, commit=True):
+        instance = super().save(commit=False)
+        instance.text = self.cleaned_data['text']
+        if commit:
+            instance.save()
+            self.save_m2m()
+        return instance
+
 
 class MoveForm(TargetNodeForm):
     """Form for move operations."""
@@ -203,3 +234,9 @@ class DeleteForm(forms.Form):
     """Form for delete operations."""
 
     pass
+
+
+class PublishForm(forms.Form):
+    """Form for publishing a directory as a snapshot."""
+
+    pass
@@ -0,0 +1,227 @@
+"""
+Forwards prompts to AI model endpoints over pooled keep-alive connections.
+
+Each process keeps a pool of connections per endpoint origin (scheme, host
+and port), so consecutive requests reuse a connection instead of repeating
+the TCP and TLS handshakes. A pool also caps the requests a process has in
+flight to its origin at GATEWAY_MAX_CONNECTIONS; requests over the cap wait
+up to GATEWAY_QUEUE_TIMEOUT seconds for one to finish.
+"""
+
+import http.client
+import json
+import re
+import select
+import threading
+import time
+from typing import Iterator
+from urllib.parse import SplitResult, urlsplit
+
+from django.conf import settings
+
+from . import metrics
+from .models import AIModel, Prompt
+
+# Bytes read from an endpoint's response at a time, at most
+CHUNK_SIZE = 8192
+
+# A variable in prompt text, such as {question}
+VARIABLE = re.compile(r'\{(\w+)\}')
+
+requests_forwarded = metrics.Counter(
+    'gateway_requests_total', 'Requests forwarded to AI model endpoints'
+)
+connections_opened = metrics.Counter(
+    'gateway_connections_opened_total',
+    'Connections opened to AI model endpoints, rather than reused',
+)
+gateway_busy = metrics.Counter(
+    'gateway_busy_total',
+    'Gateway requests refused for having too many others in flight to the '
+    'same endpoint',
+)
+
+
+class GatewayBusy(Exception):
+    """Raised when no connection to an endpoint frees up in time."""
+
+
+class ConnectionPool:
+    """Keep-alive connections to one origin, shared by a process's threads."""
+
+    def __init__(self, url: SplitResult):
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        self.host, self.port = url.hostname, url.port
+        self.slots = threading.BoundedSemaphore(settings.GATEWAY_MAX_CONNECTIONS)
+        self.lock = threading.Lock()
+        # (connection, when it was last used), most recently used last
+        self.idle: list[tuple[http.client.HTTPConnection, float]] = []
+
+    def acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """
+        Take a connection, waiting for one if the origin is at its cap.
+
+        Returns:
+            tuple: The connection, and whether it was used before
+
+        Raises:
+            GatewayBusy: If none is free within GATEWAY_QUEUE_TIMEOUT
+        """
+        if not self.slots.acquire(timeout=settings.GATEWAY_QUEUE_TIMEOUT):
+            gateway_busy.increment()
+            raise GatewayBusy
+        try:
+            with self.lock:
+                while self.idle:
+                    connection, used_at = self.idle.pop()
+                    if time.monotonic() - used_at < settings.GATEWAY_IDLE_TIMEOUT:
+                        if not closed_by_endpoint(connection):
+                            return connection, True
+                    # Likely closed by the endpoint by now
+                    connection.close()
+            connections_opened.increment()
+            return (
+                self.connection_class(
+                    self.host, self.port, timeout=settings.GATEWAY_TIMEOUT
+                ),
+                False,
+            )
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection: http.client.HTTPConnection, reusable: bool) -> None:
+        """Give back a connection, keeping it open for the next request if it can."""
+        if reusable:
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+        else:
+            connection.close()
+        self.slots.release()
+
+
+def closed_by_endpoint(connection: http.client.HTTPConnection) -> bool:
+    """Whether an idle connection was closed, as it has nothing more to read."""
+    if connection.sock is None:
+        return True
+    readable, _, _ = select.select([connection.sock], [], [], 0)
+    return bool(readable)
+
+
+pools: dict[tuple[str, str, int | None], ConnectionPool] = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(url: SplitResult) -> ConnectionPool:
+    origin = (url.scheme, url.hostname, url.port)
+    with pools_lock:
+        if origin not in pools:
+            pools[origin] = ConnectionPool(url)
+        return pools[origin]
+
+
+class ResponseBody:
+    """
+    An endpoint's response body, streamed as it arrives.
+
+    The connection goes back to its pool when the body is closed, which
+    Django does once the response is sent or the client goes away. Only
+    connections whose response was read to the end are kept open.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        connection: http.client.HTTPConnection,
+        response: http.client.HTTPResponse,
+    ):
+        self.pool = pool
+        self.connection = connection
+        self.response = response
+        self.finished = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        while chunk := self.response.read1(CHUNK_SIZE):
+            yield chunk
+        self.finished = True
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.release(
+                self.connection, self.finished and not self.response.will_close
+            )
+            self.pool = None
+
+
+def parse_endpoint(endpoint: str) -> SplitResult:
+    """
+    Split an AI model's endpoint into the parts a request is sent to.
+
+    Raises:
+        ValueError: If it isn't an HTTP or HTTPS URL with a host and valid port
+    """
+    url = urlsplit(endpoint)
+    if url.scheme not in ('http', 'https') or not url.hostname:
+        raise ValueError(f'Not an HTTP or HTTPS URL: {endpoint!r}')
+    # Reading the port raises a ValueError if it isn't a number up to 65535
+    if url.port == 0:
+        raise ValueError(f'Not a port that can be connected to: {endpoint!r}')
+    return url
+
+
+def render(text: str, variables: dict) -> str:
+    """Fill in a prompt's {variables}, leaving any not given as they are."""
+    return VARIABLE.sub(lambda match: str(variables.get(match[1], match[0])), text)
+
+
+def forward(
+    aimodel: AIModel, prompt: Prompt, variables: dict
+) -> tuple[http.client.HTTPResponse, ResponseBody]:
+    """
+    Send a prompt to an AI model's endpoint.
+
+    The endpoint is POSTed the AI model's parameters as JSON, with the
+    rendered prompt added as `prompt`, and its API key as a bearer token.
+
+    Returns:
+        tuple: The response, whose status and headers can be read straight
+            away, and its body
+
+    Raises:
+        ValueError: If the AI model's endpoint isn't a valid URL
+        GatewayBusy: If the endpoint has too many requests in flight
+        OSError, http.client.HTTPException: If the endpoint can't be reached
+    """
+    url = parse_endpoint(aimodel.endpoint)
+    parameters = aimodel.parameters if isinstance(aimodel.parameters, dict) else {}
+    body = json.dumps({**parameters, 'prompt': render(prompt.text, variables)})
+    headers = {'Content-Type': 'application/json'}
+    if key := aimodel.key:
+        headers['Authorization'] = f'Bearer {key}'
+    target = (url.path or '/') + (f'?{url.query}' if url.query else '')
+
+    pool = get_pool(url)
+    connection, reused = pool.acquire()
+    try:
+        try:
+            connection.request('POST', target, body.encode(), headers)
+        except ConnectionError:
+            if not reused:
+                raise
+            # The endpoint closed the idle connection before the request could
+            # be sent, so it never reached it; send it again on a new one
+            connection.close()
+            connections_opened.increment()
+            connection.request('POST', target, body.encode(), headers)
+        # Once sent, the endpoint may have run the prompt even if no response
+        # comes back, so it's never sent again
+        response = connection.getresponse()
+    except BaseException:
+        pool.release(connection, reusable=False)
+        raise
+    requests_forwarded.increment()
+    return response, ResponseBody(pool, connection, response)
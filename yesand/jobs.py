@@ -0,0 +1,155 @@
+"""
+Tasks that are too slow for a web request, run by `manage.py worker`.
+
+Register a task with @task and queue it with enqueue(). A task receives its
+Job first, then the job's arguments, and can call job.report() to publish
+progress; report() raises JobCancelled once someone cancels the job.
+"""
+
+import logging
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable
+
+from django.conf import settings
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import DirNode, Job, JobCancelled, Snapshot
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a failed job is retried, doubled after every attempt
+RETRY_DELAY = 10
+
+TASKS: dict[str, Callable[..., object]] = {}
+
+
+def task(func: Callable[..., object]) -> Callable[..., object]:
+    """Register a function as a task that jobs can run by name."""
+    TASKS[func.__name__] = func
+    return func
+
+
+def enqueue(
+    name: str,
+    description: str = '',
+    run_after: datetime | None = None,
+    **arguments,
+) -> Job:
+    """Queue a registered task to run with the given JSON-serialisable arguments."""
+    if name not in TASKS:
+        raise ValueError(f'Unknown task "{name}"')
+    return Job.objects.create(
+        name=name,
+        description=description,
+        arguments=arguments,
+        run_after=run_after or timezone.now(),
+    )
+
+
+def requeue_stale() -> int:
+    """
+    Queue running jobs again if their worker has stopped reporting.
+
+    A worker that dies mid-job leaves it running; once its heartbeat is older
+    than JOB_STALE_AFTER seconds it's retried, or failed if out of attempts.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.Status.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=settings.JOB_STALE_AFTER),
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.Status.FAILED,
+        error='The worker stopped responding.',
+        finished_at=now,
+    )
+    return failed + stale.update(status=Job.Status.QUEUED, run_after=now)
+
+
+def claim(worker: str) -> Job | None:
+    """
+    Claim the next job that's due, or return None if there isn't one.
+
+    Each candidate is claimed with a conditional UPDATE, so any number of
+    workers can poll the same table without running a job twice.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.Status.QUEUED, run_after__lte=now)
+    for job_id in due.order_by('run_after', 'id').values_list('id', flat=True)[:10]:
+        if Job.objects.filter(id=job_id, status=Job.Status.QUEUED).update(
+            status=Job.Status.RUNNING,
+            worker=worker,
+            attempts=F('attempts') + 1,
+            started_at=now,
+            heartbeat_at=now,
+        ):
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def run(job: Job) -> None:
+    """Run a claimed job, recording its result, or scheduling a retry on error."""
+    running = Job.objects.filter(id=job.id, status=Job.Status.RUNNING)
+    try:
+        result = TASKS[job.name](job, **job.arguments)
+    except JobCancelled:
+        running.update(status=Job.Status.CANCELLED, finished_at=timezone.now())
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.id, job.name)
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts and job.name in TASKS:
+            delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+            running.update(
+                status=Job.Status.QUEUED,
+                error=error,
+                run_after=timezone.now() + timedelta(seconds=delay),
+            )
+        else:
+            running.update(
+                status=Job.Status.FAILED, error=error, finished_at=timezone.now()
+            )
+    else:
+        running.update(
+            status=Job.Status.SUCCEEDED, result=result, finished_at=timezone.now()
+        )
+    job.refresh_from_db()
+
+
+@task
+def copy_directory(job: Job, node_id: int, target_id: int | None = None) -> dict:
+    """Copy a directory and everything in it."""
+    node = DirNode.objects.alive().get(id=node_id)
+    target = DirNode.objects.alive().get(id=target_id) if target_id else None
+    try:
+        copy = node.copy_to(target, progress=job.report)
+    except BaseException:
+        # What was copied is tombstoned, so purge it like a deleted directory
+        enqueue(
+            'purge_deleted',
+            description=f'Purge the partial copy of "{node.display}"',
+            run_after=timezone.now()
+            + timedelta(seconds=settings.DELETION_GRACE_PERIOD),
+        )
+        raise
+    return {'dirnode_id': copy.id}
+
+
+@task
+def purge_deleted(job: Job) -> dict:
+    """Permanently remove directories whose grace period is over."""
+    before = timezone.now() - timedelta(seconds=settings.DELETION_GRACE_PERIOD)
+    return {'purged': DirNode.purge_deleted(before=before, progress=job.report)}
+
+
+@task
+def publish_snapshot(job: Job, node_id: int) -> dict:
+    """Publish a directory as a new snapshot version."""
+    node = DirNode.objects.alive().get(id=node_id)
+    snapshot = Snapshot.publish(node, progress=job.report)
+    return {
+        'snapshot_id': snapshot.id,
+        'url': reverse('get_snapshot', args=[node.id, snapshot.version]),
+    }
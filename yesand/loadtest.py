@@ -0,0 +1,369 @@
+"""
+Drives mixed, concurrent traffic at a running server and reports latency.
+
+Each simulated client keeps one connection open and picks requests at
+random, by weight, from the traffic a real session produces: GraphQL reads,
+the HTMX fragments behind navigating the tree, and modal writes. Requests
+are drawn from a sample of the database the server is using, so reads hit
+real rows. The report is plain JSON, so runs with different worker counts,
+worker classes or code can be compared with compare().
+"""
+
+import http.client
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from http.cookies import SimpleCookie
+from typing import Callable
+from urllib.parse import urlencode, urlsplit
+
+from django.db.models import F
+
+from .models import AIModel, DirNode, Prompt
+
+REPORT_FORMAT = 1
+
+PERCENTILES = (50, 95, 99)
+
+MODEL_PROMPTS = """
+query ModelPrompts($model: String!, $directory: String) {
+    modelPrompts(modelName: $model, directory: $directory) { display text }
+}
+"""
+
+ALL_PROMPTS = """
+query AllPrompts($directory: String) {
+    allPrompts(directory: $directory, first: 20) {
+        edges { node { display text dirnode { display } } }
+    }
+}
+"""
+
+
+@dataclass
+class Dataset:
+    """Rows sampled from the database for requests to refer to."""
+
+    dirnode_ids: list[int]
+    prompt_ids: list[int]
+    aimodel_ids: list[int]
+    directories: list[str]
+    # (AI model name, directory name) pairs with linked prompts
+    model_directories: list[tuple[str, str]]
+
+    @classmethod
+    def sample(cls, size: int = 1000) -> 'Dataset':
+        """Sample up to `size` rows of each kind from the live tree."""
+        dirnodes = DirNode.objects.alive().order_by('?')[:size]
+        model_directories = (
+            Prompt.aimodels.through.objects.filter(
+                prompt__dirnode__deleted_at__isnull=True
+            )
+            .annotate(
+                model=F('aimodel__display'), directory=F('prompt__dirnode__display')
+            )
+            .values_list('model', 'directory')
+            .distinct()
+            .order_by('?')[:size]
+        )
+        dataset = cls(
+            dirnode_ids=list(dirnodes.values_list('id', flat=True)),
+            prompt_ids=list(
+                Prompt.objects.alive().order_by('?').values_list('id', flat=True)[:size]
+            ),
+            aimodel_ids=list(
+                AIModel.objects.alive()
+                .order_by('?')
+                .values_list('id', flat=True)[:size]
+            ),
+            directories=list(dirnodes.values_list('display', flat=True)),
+            model_directories=list(model_directories),
+        )
+        if not dataset.dirnode_ids:
+            raise ValueError('There are no directories; run `manage.py seed` first')
+        return dataset
+
+
+# A request as (method, path, form or JSON body, headers)
+Request = tuple[str, str, dict | None, dict]
+
+HTMX = {'HX-Request': 'true'}
+
+
+def graphql(query: str, **variables) -> Request:
+    return ('POST', '/graphql/', {'query': query, 'variables': variables}, {})
+
+
+def model_prompts(data: Dataset, rng: random.Random) -> Request:
+    if not data.model_directories:
+        return all_prompts(data, rng)
+    model, directory = rng.choice(data.model_directories)
+    return graphql(MODEL_PROMPTS, model=model, directory=directory)
+
+
+def all_prompts(data: Dataset, rng: random.Random) -> Request:
+    return graphql(ALL_PROMPTS, directory=rng.choice(data.directories))
+
+
+def filesystem(data: Dataset, rng: random.Random) -> Request:
+    return ('GET', '/filesystem/', None, HTMX)
+
+
+def content(data: Dataset, rng: random.Random) -> Request:
+    node_type, ids = rng.choice(
+        [
+            ('dirnode', data.dirnode_ids),
+            ('prompt', data.prompt_ids),
+            ('aimodel', data.aimodel_ids),
+        ]
+    )
+    if not ids:
+        node_type, ids = 'dirnode', data.dirnode_ids
+    return ('GET', f'/content/{node_type}/{rng.choice(ids)}/', None, HTMX)
+
+
+def breadcrumb(data: Dataset, rng: random.Random) -> Request:
+    return ('GET', f'/breadcrumb/dirnode/{rng.choice(data.dirnode_ids)}/', None, HTMX)
+
+
+def add_prompt(data: Dataset, rng: random.Random) -> Request:
+    return (
+        'POST',
+        '/modal/prompt/add/',
+        {
+            'display': f'load {rng.randrange(10**6)}',
+            'text': 'You are a helpful assistant. ' * rng.randint(1, 20),
+            'parent_id': rng.choice(data.dirnode_ids),
+        },
+        HTMX,
+    )
+
+
+def rename_prompt(data: Dataset, rng: random.Random) -> Request:
+    if not data.prompt_ids:
+        return add_prompt(data, rng)
+    prompt_id = rng.choice(data.prompt_ids)
+    return (
+        'POST',
+        f'/modal/prompt/rename/{prompt_id}/',
+        {'display': f'renamed {rng.randrange(10**6)}'},
+        HTMX,
+    )
+
+
+# Request builders by endpoint name, with their share of the traffic
+MIX: dict[str, tuple[Callable[[Dataset, random.Random], Request], int]] = {
+    'graphql:modelPrompts': (model_prompts, 20),
+    'graphql:allPrompts': (all_prompts, 20),
+    'htmx:filesystem': (filesystem, 15),
+    'htmx:content': (content, 20),
+    'htmx:breadcrumb': (breadcrumb, 15),
+    'modal:add_prompt': (add_prompt, 5),
+    'modal:rename_prompt': (rename_prompt, 5),
+}
+
+
+class Client:
+    """One simulated user, with a kept-alive connection and cookies."""
+
+    def __init__(self, base_url: str, timeout: float = 30):
+        url = urlsplit(base_url)
+        connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        self.connection = connection_class(url.netloc, timeout=timeout)
+        self.origin = f'{url.scheme}://{url.netloc}/'
+        self.cookies = SimpleCookie()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: dict | None = None,
+        headers: dict | None = None,
+    ) -> int:
+        """Send a request, read the whole response and return its status."""
+        headers = {
+            'Accept-Encoding': 'gzip',
+            'Referer': self.origin,
+            **(headers or {}),
+        }
+        if path == '/graphql/':
+            headers['Content-Type'] = 'application/json'
+            headers['Accept'] = 'application/json'
+            body = json.dumps(body)
+        elif body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            body = urlencode(body)
+        if method == 'POST' and 'csrftoken' in self.cookies:
+            headers['X-CSRFToken'] = self.cookies['csrftoken'].value
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                f'{name}={morsel.value}' for name, morsel in self.cookies.items()
+            )
+
+        for attempt in range(2):
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed a kept-alive connection; reconnect once
+                self.connection.close()
+                if attempt:
+                    raise
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(cookie)
+        return response.status
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+@dataclass
+class Samples:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+
+def run(
+    base_url: str,
+    data: Dataset,
+    clients: int = 10,
+    duration: float = 30,
+    seed: int = 0,
+    mix: dict = MIX,
+) -> dict:
+    """
+    Run concurrent clients against a server for a while and report on it.
+
+    Args:
+        base_url: The server's address, such as http://localhost:8000
+        data: The rows requests refer to
+        clients: The number of simultaneous clients
+        duration: Seconds to send requests for
+        seed: Seeds each client's choice of requests, so runs are repeatable
+        mix: Request builders and weights by endpoint name
+
+    Returns:
+        dict: The report, as made by summarise()
+    """
+    names = list(mix)
+    weights = [weight for _, weight in mix.values()]
+    samples = {name: Samples() for name in names}
+    lock = threading.Lock()
+    started_at = datetime.now(UTC)
+    deadline = time.monotonic() + duration
+
+    def simulate(number: int) -> None:
+        rng = random.Random(seed * 1000 + number)
+        client = Client(base_url)
+        mine = {name: Samples() for name in names}
+        try:
+            # Loading the page sets the CSRF cookie the modals need
+            client.request('GET', '/')
+            while time.monotonic() < deadline:
+                (name,) = rng.choices(names, weights)
+                request = mix[name][0](data, rng)
+                start = time.perf_counter()
+                try:
+                    ok = client.request(*request) < 400
+                except OSError:
+                    ok = False
+                mine[name].latencies.append(time.perf_counter() - start)
+                mine[name].errors += not ok
+        finally:
+            client.close()
+            with lock:
+                for name, sample in mine.items():
+                    samples[name].latencies += sample.latencies
+                    samples[name].errors += sample.errors
+
+    threads = [
+        threading.Thread(target=simulate, args=(number,)) for number in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - deadline + duration
+
+    report = summarise(samples, elapsed)
+    return {
+        'format': REPORT_FORMAT,
+        'started_at': started_at.isoformat(),
+        'base_url': base_url,
+        'clients': clients,
+        'duration': round(elapsed, 3),
+        'seed': seed,
+        **report,
+    }
+
+
+def percentile(ordered: list[float], percent: float) -> float:
+    """The nearest-rank percentile of some already sorted values."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarise(samples: dict[str, Samples], elapsed: float) -> dict:
+    """Throughput and latency percentiles in milliseconds, per endpoint."""
+    endpoints = {}
+    for name, sample in samples.items():
+        ordered = sorted(sample.latencies)
+        endpoints[name] = {
+            'requests': len(ordered),
+            'errors': sample.errors,
+            'throughput': round(len(ordered) / elapsed, 2),
+            **{
+                f'p{percent}': round(percentile(ordered, percent) * 1000, 2)
+                for percent in PERCENTILES
+            },
+            'max': round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        }
+    everything = sorted(
+        latency for sample in samples.values() for latency in sample.latencies
+    )
+    return {
+        'requests': len(everything),
+        'errors': sum(sample.errors for sample in samples.values()),
+        'throughput': round(len(everything) / elapsed, 2),
+        **{
+            f'p{percent}': round(percentile(everything, percent) * 1000, 2)
+            for percent in PERCENTILES
+        },
+        'endpoints': endpoints,
+    }
+
+
+def compare(baseline: dict, report: dict) -> list[dict]:
+    """
+    Percentage changes from a baseline report, overall and per endpoint.
+
+    Positive latency changes are slowdowns; positive throughput changes are
+    speed-ups.
+    """
+    rows = []
+    pairs = [('all', baseline, report)] + [
+        (name, baseline['endpoints'][name], stats)
+        for name, stats in report['endpoints'].items()
+        if name in baseline['endpoints']
+    ]
+    for name, before, after in pairs:
+        row = {'endpoint': name}
+        for metric in ('throughput', *(f'p{percent}' for percent in PERCENTILES)):
+            row[metric] = (
+                round((after[metric] - before[metric]) / before[metric] * 100, 1)
+                if before[metric]
+                else None
+            )
+        rows.append(row)
+    return rows
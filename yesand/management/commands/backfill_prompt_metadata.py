@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from yesand.models import Prompt
+
+
+class Command(BaseCommand):
+    help = 'Recompute the length and token count of prompts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Maximum number of prompts updated per statement',
+        )
+        parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            help='Only fill in prompts with no recorded length',
+        )
+
+    def handle(self, *args, **options):
+        prompts = (
+            Prompt.objects.select_related('blob')
+            .only('id', 'blob', 'blob__text')
+            .order_by('id')
+        )
+        if options['missing_only']:
+            prompts = prompts.filter(length=0)
+
+        updated = last_id = 0
+        # Walk by primary key so each batch is an index range scan
+        while batch := list(prompts.filter(id__gt=last_id)[: options['batch_size']]):
+            for prompt in batch:
+                prompt.update_metadata()
+            Prompt.objects.bulk_update(batch, Prompt.METADATA_FIELDS)
+            updated += len(batch)
+            last_id = batch[-1].id
+
+        self.stdout.write(f'Updated metadata for {updated} prompts')
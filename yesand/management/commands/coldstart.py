@@ -0,0 +1,137 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# The first requests timed in each new process, as (name, method, path, body)
+FIRST_REQUESTS = [
+    ('ready', 'GET', '/ready/', b''),
+    ('page', 'GET', '/', b''),
+    (
+        'graphql',
+        'POST',
+        '/graphql/',
+        b'{"query": "{ allPrompts(first: 20) { edges { node { display } } } }"}',
+    ),
+]
+
+# What each mode times, as (WARM_UP, whether to fork after loading):
+# cold: a gunicorn worker loading the app itself, as without --preload
+# master: the master loading and warming the app once, with --preload
+# forked: a worker forked from that master
+MODES = {
+    'cold': ('false', False),
+    'master': ('true', False),
+    'forked': ('true', True),
+}
+
+
+class Command(BaseCommand):
+    # Checks would import the URLconf before the timed load
+    requires_system_checks = []
+    help = (
+        'Time how long new processes take to load the app and answer their first '
+        'requests, with and without warming up.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs', type=int, default=5, help='Processes started per mode'
+        )
+        parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self.serve_first_requests(options['child'])))
+            return
+
+        self.stdout.write(
+            f'{"mode":<8}{"load s":>10}'
+            + ''.join(f'{name + " ms":>12}' for name, *_ in FIRST_REQUESTS)
+            + f'{"total s":>10}'
+        )
+        for mode in MODES:
+            runs = [self.start(mode) for _ in range(options['runs'])]
+            loaded = statistics.median(run['loaded'] for run in runs)
+            latencies = {
+                name: statistics.median(run['requests'][name] for run in runs)
+                for name, *_ in FIRST_REQUESTS
+            }
+            total = statistics.median(
+                run['loaded'] + sum(run['requests'].values()) / 1000 for run in runs
+            )
+            self.stdout.write(
+                f'{mode:<8}{loaded:>10.2f}'
+                + ''.join(f'{latency:>12.1f}' for latency in latencies.values())
+                + f'{total:>10.2f}'
+            )
+
+    def start(self, mode: str) -> dict:
+        """Start a fresh interpreter and time it loading and answering."""
+        started = time.time()
+        process = subprocess.run(
+            [
+                sys.executable,
+                settings.BASE_DIR / 'manage.py',
+                'coldstart',
+                '--child',
+                mode,
+            ],
+            env={**os.environ, 'WARM_UP': MODES[mode][0]},
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode:
+            raise CommandError(process.stderr)
+        result = json.loads(process.stdout.splitlines()[-1])
+        result['loaded'] = result.pop('loaded_at') - result.pop('started_at', started)
+        return result
+
+    def serve_first_requests(self, mode: str) -> dict:
+        """Load the WSGI app as a server would, then time its first requests."""
+        from config.wsgi import application
+
+        result = {'loaded_at': time.time(), 'requests': {}}
+        if MODES[mode][1]:
+            read, write = os.pipe()
+            result['started_at'] = time.time()
+            if pid := os.fork():
+                os.close(write)
+                with os.fdopen(read) as pipe:
+                    forked = json.load(pipe)
+                os.waitpid(pid, 0)
+                return forked
+            os.close(read)
+            result['loaded_at'] = time.time()
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(status)
+
+        for name, method, path, body in FIRST_REQUESTS:
+            environ = {
+                'REQUEST_METHOD': method,
+                'PATH_INFO': path,
+                'CONTENT_TYPE': 'application/json',
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': io.BytesIO(body),
+            }
+            setup_testing_defaults(environ)
+            start = time.perf_counter()
+            b''.join(application(environ, start_response))
+            result['requests'][name] = (time.perf_counter() - start) * 1000
+            if not statuses[-1].startswith('200'):
+                raise CommandError(f'{path} returned {statuses[-1]}')
+        if MODES[mode][1]:
+            with os.fdopen(write, 'w') as pipe:
+                json.dump(result, pipe)
+            os._exit(0)
+        return result
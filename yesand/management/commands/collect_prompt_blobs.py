@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from yesand.models import PromptBlob
+
+
+class Command(BaseCommand):
+    help = 'Delete stored prompt text that no prompt refers to any more.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Maximum number of blobs removed per statement',
+        )
+
+    def handle(self, *args, **options):
+        collected = PromptBlob.collect_garbage(batch_size=options['batch_size'])
+        self.stdout.write(f'Collected {collected} unreferenced prompt blobs')
@@ -0,0 +1,175 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from yesand import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive mixed concurrent traffic at a server and report throughput and '
+        'p50/p95/p99 latency per endpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000',
+            help='The server to load, or where to start it with --serve',
+        )
+        parser.add_argument(
+            '--serve',
+            action='store_true',
+            help='Start gunicorn at --url for the run, and stop it afterwards',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=int(os.getenv('GUNICORN_WORKERS', '3')),
+            help='Gunicorn workers to start with --serve',
+        )
+        parser.add_argument(
+            '--worker-class',
+            default=os.getenv('GUNICORN_WORKER_CLASS', 'gthread'),
+            help='Gunicorn worker class to start with --serve',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=int(os.getenv('GUNICORN_THREADS', '16')),
+            help='Threads per gunicorn worker to start with --serve',
+        )
+        parser.add_argument(
+            '--clients', type=int, default=10, help='Simultaneous clients'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=30, help='Seconds to send requests for'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0, help='Seeds the choice of requests'
+        )
+        parser.add_argument(
+            '--output',
+            default='loadtest.json',
+            help='Where to write the JSON report',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='A previous report to compare this run with',
+        )
+        parser.add_argument(
+            '--max-regression',
+            type=float,
+            help='Fail if any p95 latency is this many percent above the baseline',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            baseline = json.loads(Path(options['baseline']).read_text())
+
+        data = loadtest.Dataset.sample()
+        with self.serve(options) if options['serve'] else nullcontext():
+            report = loadtest.run(
+                options['url'],
+                data,
+                clients=options['clients'],
+                duration=options['duration'],
+                seed=options['seed'],
+            )
+        if options['serve']:
+            report['server'] = {
+                'workers': options['workers'],
+                'worker_class': options['worker_class'],
+                'threads': options['threads'],
+            }
+
+        Path(options['output']).write_text(json.dumps(report, indent=2) + '\n')
+        self.write_report(report)
+        self.stdout.write(f'Report written to {options["output"]}')
+
+        if baseline is not None:
+            rows = loadtest.compare(baseline, report)
+            self.write_comparison(rows)
+            limit = options['max_regression']
+            regressed = [
+                row['endpoint']
+                for row in rows
+                if limit is not None and row['p95'] is not None and row['p95'] > limit
+            ]
+            if regressed:
+                raise CommandError(
+                    f'p95 latency regressed by more than {limit}%: '
+                    + ', '.join(regressed)
+                )
+
+    @contextmanager
+    def serve(self, options):
+        """Run gunicorn at the URL until the block exits."""
+        address = options['url'].split('://', 1)[-1].rstrip('/')
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                '-m',
+                'gunicorn',
+                'config.wsgi:application',
+                '--bind',
+                address,
+                '--workers',
+                str(options['workers']),
+                '--worker-class',
+                options['worker_class'],
+                '--threads',
+                str(options['threads']),
+                '--log-level',
+                'warning',
+            ]
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    urllib.request.urlopen(f'{options["url"]}/health/', timeout=1)
+                    break
+                except OSError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise CommandError('The server did not start') from None
+                    time.sleep(0.2)
+            yield
+        finally:
+            server.terminate()
+            server.wait()
+
+    def write_report(self, report):
+        self.stdout.write(
+            f'{"endpoint":<24}{"requests":>10}{"errors":>8}{"req/s":>10}'
+            f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+        )
+        for name, stats in [*report['endpoints'].items(), ('all', report)]:
+            self.stdout.write(
+                f'{name:<24}{stats["requests"]:>10}{stats["errors"]:>8}'
+                f'{stats["throughput"]:>10}{stats["p50"]:>10}{stats["p95"]:>10}'
+                f'{stats["p99"]:>10}'
+            )
+
+    def write_comparison(self, rows):
+        def change(value):
+            return 'n/a' if value is None else f'{value:+.1f}%'
+
+        self.stdout.write('Change from baseline:')
+        self.stdout.write(
+            f'{"endpoint":<24}{"req/s":>10}{"p50":>10}{"p95":>10}{"p99":>10}'
+        )
+        for row in rows:
+            self.stdout.write(
+                f'{row["endpoint"]:<24}{change(row["throughput"]):>10}'
+                f'{change(row["p50"]):>10}{change(row["p95"]):>10}'
+                f'{change(row["p99"]):>10}'
+            )
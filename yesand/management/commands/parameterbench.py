@@ -0,0 +1,93 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from yesand.models import AIModel, AIModelQuerySet, DirNode
+
+
+class Command(BaseCommand):
+    help = (
+        'Time searching AI models by their parameters on a large table, '
+        'against downloading every model and filtering them client-side.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--models', type=int, default=100_000, help='AI models to create'
+        )
+        parser.add_argument(
+            '--runs', type=int, default=5, help='Times each search is run'
+        )
+
+    def handle(self, *args, **options):
+        # The models made to search are rolled back
+        with transaction.atomic():
+            self.stdout.write(f'Creating {options["models"]} AI models...')
+            aimodels = self.create(options['models'])
+            self.compare(aimodels, options['runs'])
+            transaction.set_rollback(True)
+
+    def create(self, count: int) -> AIModelQuerySet:
+        directory = DirNode.add_root(display='parameterbench')
+        rng = random.Random(0)
+        batch = []
+        for i in range(count):
+            parameters = {
+                'model_name': f'model-{rng.randrange(100)}',
+                'temperature': rng.randrange(100) / 100,
+            }
+            if rng.random() < 0.2:
+                parameters['options'] = {'top_p': rng.randrange(10) / 10}
+            if rng.random() < 0.01:
+                parameters['seed'] = i
+            batch.append(
+                AIModel(display=f'model {i}', parameters=parameters, dirnode=directory)
+            )
+            if len(batch) == 1000:
+                AIModel.objects.bulk_create(batch)
+                batch = []
+        AIModel.objects.bulk_create(batch)
+        return AIModel.objects.filter(dirnode=directory).order_by()
+
+    def compare(self, aimodels: AIModelQuerySet, runs: int) -> None:
+        searches = [
+            ('model_name =', aimodels.parameters_equal({'model_name': 'model-7'})),
+            ('temperature =', aimodels.parameters_equal({'temperature': 0.5})),
+            ('options.top_p =', aimodels.parameters_equal({'options.top_p': 0.9})),
+            (
+                'contains',
+                aimodels.parameters_contain(
+                    {'model_name': 'model-7', 'options': {'top_p': 0.9}}
+                ),
+            ),
+            ('has key seed', aimodels.parameters_have_key('seed')),
+        ]
+
+        self.stdout.write(f'{"search":<18}{"rows":>8}{"ms":>10}  plan')
+        for name, queryset in searches:
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                rows = len(queryset.values_list('id', flat=True))
+                timings.append((time.perf_counter() - start) * 1000)
+            plan = queryset.values_list('id').explain().splitlines()[0]
+            self.stdout.write(
+                f'{name:<18}{rows:>8}{statistics.median(timings):>10.1f}  {plan}'
+            )
+
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            rows = sum(
+                1
+                for parameters in aimodels.values_list('parameters', flat=True)
+                if parameters.get('model_name') == 'model-7'
+            )
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f'{"client-side":<18}{rows:>8}{statistics.median(timings):>10.1f}  '
+            'every model downloaded'
+        )
@@ -0,0 +1,45 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from yesand.models import DirNode
+
+
+class Command(BaseCommand):
+    help = 'Permanently remove deleted directories once their grace period is over.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Maximum number of rows removed per statement',
+        )
+        parser.add_argument(
+            '--grace-period',
+            type=int,
+            default=settings.DELETION_GRACE_PERIOD,
+            help='Seconds a deleted directory stays restorable before purging',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running, purging every this many seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            before = timezone.now() - timedelta(seconds=options['grace_period'])
+            purged = DirNode.purge_deleted(
+                before=before, batch_size=options['batch_size']
+            )
+            if purged:
+                self.stdout.write(f'Purged {purged} rows from deleted directories')
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,86 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+
+from yesand.models import APIKey, DirNode
+
+QUERY = '{ allPrompts(first: 20) { edges { node { display text } } } }'
+
+
+class Command(BaseCommand):
+    help = (
+        'Count the database queries a GraphQL request makes, by how the client '
+        'authenticates, with the response cache empty and then warm.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', default=QUERY, help='The query to send')
+        parser.add_argument(
+            '--verbose-sql', action='store_true', help='Print each query made'
+        )
+
+    def handle(self, *args, **options):
+        root = DirNode.get_root_nodes().alive().first()
+        if root is None:
+            raise CommandError('There are no directories; run `manage.py seed` first')
+
+        setup_test_environment()
+        try:
+            # The key and user made to send requests as are rolled back
+            with transaction.atomic():
+                self.compare(root, options)
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+    def compare(self, root: DirNode, options: dict) -> None:
+        _, key = APIKey.generate('querycount', root)
+        user = User.objects.create_user('querycount')
+        signed_in = Client()
+        signed_in.force_login(user)
+        clients = [
+            ('anonymous', Client(), {}),
+            ('signed-in user', signed_in, {}),
+            ('API key', Client(), {'HTTP_AUTHORIZATION': f'Bearer {key}'}),
+            (
+                'API key with a session',
+                signed_in,
+                {'HTTP_AUTHORIZATION': f'Bearer {key}'},
+            ),
+        ]
+
+        self.stdout.write(f'{"client":<26}{"uncached":>10}{"cached":>10}')
+        for name, client, headers in clients:
+            cache.clear()
+            APIKey._cache.clear()
+            # The first request checks the key; later ones find it cached
+            client.post(
+                reverse('api'),
+                {'query': '{ __typename }'},
+                content_type='application/json',
+                **headers,
+            )
+            counts = []
+            for _ in range(2):
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.post(
+                        reverse('api'),
+                        {'query': options['query']},
+                        content_type='application/json',
+                        **headers,
+                    )
+                if response.status_code != 200:
+                    raise CommandError(f'{name} got a {response.status_code}')
+                counts.append(len(queries))
+                if options['verbose_sql']:
+                    for query in queries.captured_queries:
+                        self.stdout.write(f'  {query["sql"]}')
+            self.stdout.write(f'{name:<26}{counts[0]:>10}{counts[1]:>10}')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from yesand.models import DirNode, EffectivePrompt
+
+
+class Command(BaseCommand):
+    help = 'Recompute the prompts every directory inherits.'
+
+    def handle(self, *args, **options):
+        # Project by project, to bound what's held in memory at once
+        roots = DirNode.get_root_nodes().values_list('path', flat=True)
+        for path in roots:
+            EffectivePrompt.refresh([path])
+        self.stdout.write(
+            f'{EffectivePrompt.objects.count()} effective prompts in '
+            f'{len(roots)} projects'
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from yesand.models import DirNode
+
+
+class Command(BaseCommand):
+    help = "Recompute directories' item counts and AI models' prompt counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Maximum number of directories updated per statement',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            repaired = DirNode.recount(batch_size=options['batch_size'])
+        self.stdout.write(f'Repaired the counts of {repaired} directories')
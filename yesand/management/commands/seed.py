@@ -0,0 +1,87 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from yesand.models import AIModel, DataVersion, DirNode, EffectivePrompt, Prompt
+
+WORDS = (
+    'you are a helpful assistant answer the question using only the context '
+    'below cite your sources be concise and if you do not know say so summarise '
+    'the document in plain english for a general audience'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with generated projects, for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--projects', type=int, default=3, help='Number of root directories'
+        )
+        parser.add_argument(
+            '--depth', type=int, default=3, help='Levels of directories per project'
+        )
+        parser.add_argument(
+            '--fanout', type=int, default=3, help='Subdirectories per directory'
+        )
+        parser.add_argument(
+            '--prompts', type=int, default=10, help='Prompts per directory'
+        )
+        parser.add_argument(
+            '--models', type=int, default=2, help='AI models per directory'
+        )
+        parser.add_argument(
+            '--words', type=int, default=80, help='Average words per prompt'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0, help='Seeds the generated content'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        created = {'directories': 0, 'models': 0, 'prompts': 0}
+
+        def fill(directory: DirNode, depth: int) -> None:
+            models = AIModel.objects.bulk_create(
+                AIModel(
+                    display=f'model-{i}',
+                    endpoint=f'https://api.example.com/v1/model-{i}',
+                    parameters={'temperature': round(rng.random(), 2)},
+                    dirnode=directory,
+                )
+                for i in range(options['models'])
+            )
+            prompts = Prompt.objects.bulk_create(
+                Prompt(
+                    display=['system', 'question'][i] if i < 2 else f'prompt-{i}',
+                    text=' '.join(
+                        rng.choices(WORDS, k=rng.randint(1, 2 * options['words']))
+                    ),
+                    dirnode=directory,
+                )
+                for i in range(options['prompts'])
+            )
+            Prompt.aimodels.through.objects.bulk_create(
+                Prompt.aimodels.through(prompt_id=prompt.id, aimodel_id=model.id)
+                for prompt in prompts
+                for model in models
+            )
+            created['directories'] += 1
+            created['models'] += len(models)
+            created['prompts'] += len(prompts)
+
+            if depth < options['depth']:
+                for i in range(options['fanout']):
+                    fill(directory.add_child(display=f'dir-{depth}-{i}'), depth + 1)
+
+        for i in range(options['projects']):
+            project = DirNode.add_root(display=f'project-{i}')
+            fill(project, 1)
+            # Links were inserted directly, without refreshing what they change
+            EffectivePrompt.refresh([project.path])
+        DataVersion.bump()
+
+        self.stdout.write(
+            'Created {directories} directories, {models} AI models and '
+            '{prompts} prompts'.format(**created)
+        )
@@ -0,0 +1,52 @@
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from yesand import jobs
+from yesand.models import ChangeEvent
+
+# Seconds between deletions of change events older than CHANGE_EVENT_RETENTION
+PRUNE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Run queued jobs, such as copying and purging large directories.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait before polling again when no job is due',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit as soon as no job is due instead of waiting for more',
+        )
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        pruned_at = 0.0
+        while True:
+            close_old_connections()
+            jobs.requeue_stale()
+            if time.monotonic() - pruned_at >= PRUNE_INTERVAL:
+                retention = timedelta(seconds=settings.CHANGE_EVENT_RETENTION)
+                ChangeEvent.prune(timezone.now() - retention)
+                pruned_at = time.monotonic()
+            if job := jobs.claim(worker):
+                self.stdout.write(f'Running job {job.id}: {job}')
+                jobs.run(job)
+                self.stdout.write(f'Job {job.id} {job.status}')
+                continue
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
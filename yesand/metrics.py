@@ -0,0 +1,47 @@
+"""
+Counters shared by every worker, kept in the Django cache.
+
+Counters are declared once at import time and exposed in the Prometheus text
+format by the /metrics/ endpoint. With a per-process cache, such as the
+default memory cache, each worker only reports its own counts.
+"""
+
+from django.core.cache import cache
+
+CACHE_PREFIX = 'metrics:'
+
+REGISTRY: dict[str, 'Counter'] = {}
+
+
+class Counter:
+    """A monotonically increasing count."""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.key = f'{CACHE_PREFIX}{name}'
+        REGISTRY[name] = self
+
+    def increment(self, amount: int = 1) -> None:
+        cache.add(self.key, 0, timeout=None)
+        try:
+            cache.incr(self.key, amount)
+        except ValueError:
+            # Evicted between the add and the incr
+            cache.set(self.key, amount, timeout=None)
+
+    def value(self) -> int:
+        return cache.get(self.key, 0)
+
+
+def render() -> str:
+    """Every registered counter in the Prometheus text exposition format."""
+    values = cache.get_many([counter.key for counter in REGISTRY.values()])
+    lines = []
+    for name, counter in sorted(REGISTRY.items()):
+        lines += [
+            f'# HELP {name} {counter.description}',
+            f'# TYPE {name} counter',
+            f'{name} {values.get(counter.key, 0)}',
+        ]
+    return '\n'.join(lines) + '\n'
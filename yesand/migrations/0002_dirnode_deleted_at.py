@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dirnode',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
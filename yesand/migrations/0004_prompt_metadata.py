@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0003_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prompt',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='The SHA-256 hex digest of the text', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='prompt',
+            name='length',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, help_text='The number of characters in the text'),
+        ),
+        migrations.AddField(
+            model_name='prompt',
+            name='token_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, help_text='The number of tokens in the text, per PROMPT_TOKENIZER'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_text_to_blobs(apps, schema_editor):
+    Prompt = apps.get_model('yesand', 'Prompt')
+    PromptBlob = apps.get_model('yesand', 'PromptBlob')
+
+    last_id = 0
+    while batch := list(
+        Prompt.objects.filter(id__gt=last_id).order_by('id').only('id', 'text')[:500]
+    ):
+        blobs = {}
+        for prompt in batch:
+            prompt.blob_id = hashlib.sha256(prompt.text.encode()).hexdigest()
+            blobs[prompt.blob_id] = PromptBlob(hash=prompt.blob_id, text=prompt.text)
+        PromptBlob.objects.bulk_create(blobs.values(), ignore_conflicts=True)
+        Prompt.objects.bulk_update(batch, ['blob'])
+        last_id = batch[-1].id
+
+
+def move_blobs_to_text(apps, schema_editor):
+    Prompt = apps.get_model('yesand', 'Prompt')
+
+    prompts = list(Prompt.objects.select_related('blob'))
+    for prompt in prompts:
+        prompt.text = prompt.blob.text
+    Prompt.objects.bulk_update(prompts, ['text'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0004_prompt_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromptBlob',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('text', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'prompt blob',
+                'verbose_name_plural': 'prompt blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='prompt',
+            name='blob',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='prompts', to='yesand.promptblob'),
+        ),
+        migrations.RunPython(move_text_to_blobs, move_blobs_to_text),
+        migrations.AlterField(
+            model_name='prompt',
+            name='blob',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='prompts', to='yesand.promptblob'),
+        ),
+        migrations.RemoveField(
+            model_name='prompt',
+            name='content_hash',
+        ),
+        migrations.RemoveField(
+            model_name='prompt',
+            name='text',
+        ),
+    ]
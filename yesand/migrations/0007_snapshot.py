@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0006_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Snapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('display', models.CharField(max_length=255)),
+                ('version', models.PositiveIntegerField()),
+                ('filename', models.CharField(editable=False, max_length=255, unique=True)),
+                ('sha256', models.CharField(editable=False, max_length=64)),
+                ('size', models.PositiveBigIntegerField(editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('dirnode', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='snapshots', to='yesand.dirnode')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'constraints': [models.UniqueConstraint(fields=('dirnode', 'version'), name='unique_snapshot_version')],
+            },
+        ),
+    ]
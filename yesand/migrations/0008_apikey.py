@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-19 12:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0007_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APIKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('display', models.CharField(max_length=255)),
+                ('prefix', models.CharField(editable=False, max_length=16)),
+                ('hashed_key', models.CharField(editable=False, max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('revoked_at', models.DateTimeField(blank=True, null=True)),
+                ('dirnode', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_keys', to='yesand.dirnode')),
+            ],
+            options={
+                'verbose_name': 'API key',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+import yesand.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0009_changeevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='aimodel',
+            index=yesand.models.PostgreSQLGinIndex(fields=['parameters'], name='yesand_aimodel_parameters_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='aimodel',
+            index=yesand.models.SQLiteIndex(yesand.models.JSONPath('parameters', ['model_name']), name='aimodel_params_model_name'),
+        ),
+        migrations.AddIndex(
+            model_name='aimodel',
+            index=yesand.models.SQLiteIndex(yesand.models.JSONPath('parameters', ['temperature']), name='aimodel_params_temperature'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-19 12:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0010_aimodel_parameter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePrompt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('dirnode', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='effective_prompts', to='yesand.dirnode')),
+                ('prompt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective', to='yesand.prompt')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dirnode', 'model_name', 'name'), name='unique_effective_prompt')],
+            },
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.1.1 on 2026-10-19 12:44
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+STEPLEN = 4
+
+
+def count_items(apps, schema_editor):
+    """Fill in the counts, as DirNode.recount() does for the current models."""
+    DirNode = apps.get_model('yesand', 'DirNode')
+    AIModel = apps.get_model('yesand', 'AIModel')
+    Prompt = apps.get_model('yesand', 'Prompt')
+
+    direct = {
+        name: dict(
+            model.objects.order_by()
+            .values('dirnode')
+            .annotate(count=Count('pk'))
+            .values_list('dirnode', 'count')
+        )
+        for name, model in [('prompt', Prompt), ('aimodel', AIModel)]
+    }
+    nodes = list(DirNode.objects.only('path', 'deleted_at'))
+    deleted_at = {node.path: node.deleted_at for node in nodes}
+    below = {}
+    for node in sorted(nodes, key=lambda node: node.path, reverse=True):
+        totals = below.pop(node.path, Counter())
+        for name in ('prompt', 'aimodel'):
+            count = direct[name].get(node.id, 0)
+            setattr(node, f'{name}_count', count)
+            setattr(node, f'subtree_{name}_count', count + totals[name])
+        # Tombstoned subtrees only count in the directories tombstoned with them
+        parent = node.path[:-STEPLEN]
+        if parent and deleted_at.get(parent) == node.deleted_at:
+            below.setdefault(parent, Counter()).update(
+                prompt=node.subtree_prompt_count, aimodel=node.subtree_aimodel_count
+            )
+    DirNode.objects.bulk_update(
+        nodes,
+        ['prompt_count', 'aimodel_count', 'subtree_prompt_count', 'subtree_aimodel_count'],
+        batch_size=500,
+    )
+
+    links = (
+        Prompt.aimodels.through.objects.filter(aimodel=OuterRef('pk'))
+        .order_by()
+        .values('aimodel')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    AIModel.objects.update(prompt_count=Coalesce(Subquery(links), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0011_effectiveprompt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimodel',
+            name='prompt_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of prompts linked to the model'),
+        ),
+        migrations.AddField(
+            model_name='dirnode',
+            name='aimodel_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of AI models in the directory itself'),
+        ),
+        migrations.AddField(
+            model_name='dirnode',
+            name='prompt_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of prompts in the directory itself'),
+        ),
+        migrations.AddField(
+            model_name='dirnode',
+            name='subtree_aimodel_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of AI models in the directory and those beneath it'),
+        ),
+        migrations.AddField(
+            model_name='dirnode',
+            name='subtree_prompt_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of prompts in the directory and those beneath it'),
+        ),
+        migrations.RunPython(count_items, migrations.RunPython.noop),
+    ]
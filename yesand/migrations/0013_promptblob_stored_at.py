@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-19 12:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0012_item_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promptblob',
+            name='stored_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text='When the text was last stored, which keeps it from being collected for PROMPT_BLOB_GRACE_PERIOD seconds'),
+        ),
+    ]
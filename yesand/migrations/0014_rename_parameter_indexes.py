@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# What 0010 named the SQLite indexes before they were declared on the model
+LEGACY_NAMES = {
+    'aimodel_params_model_name': 'yesand_aimodel_parameters_model_name',
+    'aimodel_params_temperature': 'yesand_aimodel_parameters_temperature',
+}
+
+
+def rename_indexes(apps, schema_editor):
+    """Replace the indexes of databases that 0010 created by raw SQL."""
+    AIModel = apps.get_model('yesand', 'AIModel')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(
+            cursor, AIModel._meta.db_table
+        )
+    for index in AIModel._meta.indexes:
+        legacy = LEGACY_NAMES.get(index.name)
+        if legacy in existing:
+            schema_editor.execute(f'DROP INDEX {schema_editor.quote_name(legacy)}')
+        if index.name not in existing:
+            schema_editor.add_index(AIModel, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0013_promptblob_stored_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_indexes, migrations.RunPython.noop),
+    ]
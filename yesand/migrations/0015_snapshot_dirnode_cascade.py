@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-19 15:24
+
+from pathlib import Path
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+
+def delete_orphaned_snapshots(apps, schema_editor):
+    """Delete the snapshots left without a directory, and their files."""
+    Snapshot = apps.get_model('yesand', 'Snapshot')
+    orphaned = Snapshot.objects.filter(dirnode__isnull=True)
+    paths = [
+        Path(settings.SNAPSHOT_ROOT) / filename
+        for filename in orphaned.values_list('filename', flat=True)
+    ]
+    orphaned.delete()
+
+    def delete_files():
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    transaction.on_commit(delete_files, using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yesand', '0014_rename_parameter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_orphaned_snapshots, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='snapshot',
+            name='dirnode',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='yesand.dirnode'),
+        ),
+    ]
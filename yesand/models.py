@@ -1,11 +1,179 @@
+import hashlib
 import os
-from typing import List, Union
+import random
+import re
+import secrets
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Union
 
 from cryptography.fernet import Fernet
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.core.cache import cache
 from django.core.validators import URLValidator
-from django.db import models
-from django.db.models import JSONField, QuerySet
-from treebeard.mp_tree import MP_Node
+from django.db import IntegrityError, connection, connections, models, transaction
+from django.db.backends.ddl_references import Statement
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    Func,
+    JSONField,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    QuerySet,
+    Subquery,
+    TextField,
+    When,
+)
+from django.db.models.fields.json import KeyTransform
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import Exact, In
+from django.dispatch import Signal
+from django.utils import timezone
+from treebeard.mp_tree import MP_Node, MP_NodeManager, MP_NodeQuerySet
+
+from . import snapshots
+from .tokenizers import count_tokens
+
+
+class DataVersion(models.Model):
+    """
+    A single-row counter bumped whenever the tree or its items change.
+
+    Responses derived from the tree carry the counter in their ETag, so a
+    client revalidating an unchanged fragment costs one primary-key lookup.
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f'Data version {self.version}'
+
+    @classmethod
+    def current(cls) -> int:
+        """Return the current data version."""
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls) -> None:
+        """Record that the data changed, invalidating every derived ETag."""
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+# Sent when a transaction that published change events commits
+change_published = Signal()
+
+
+class ChangeEvent(models.Model):
+    """
+    A write to a directory, AI model or prompt, for streaming to clients.
+
+    Events are rows, so every process can stream the events written by any
+    other. Each records the path of the directory it happened in, so streams
+    can be limited to a subtree. A write to many rows is one event, in the
+    deepest directory holding all of them.
+    """
+
+    class Action(models.TextChoices):
+        CREATED = 'created'
+        UPDATED = 'updated'
+        DELETED = 'deleted'
+        MOVED = 'moved'
+        RESTORED = 'restored'
+
+    node_type = models.CharField(max_length=20)
+    # None when more than one row was written
+    node_id = models.BigIntegerField(null=True, blank=True)
+    action = models.CharField(max_length=20, choices=Action.choices)
+    # The path of the directory, or of the items' directory; '' for the roots
+    path = models.CharField(max_length=255, blank=True)
+    # Where a moved directory was before
+    from_path = models.CharField(max_length=255, blank=True)
+    # The data version once the write was made
+    version = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self) -> str:
+        return f'{self.node_type} {self.node_id or "*"} {self.action}'
+
+    @classmethod
+    def for_node(cls, node: 'ItemMixin', action: str) -> 'ChangeEvent':
+        """An unpublished event for a write to a single node."""
+        if isinstance(node, DirNode):
+            path = node.path
+        else:
+            path = (
+                DirNode.objects.filter(id=node.dirnode_id)
+                .values_list('path', flat=True)
+                .first()
+            )
+        return cls(
+            node_type=node._meta.model_name,
+            node_id=node.pk,
+            action=action,
+            path=path or '',
+        )
+
+    @classmethod
+    def for_rows(cls, rows: QuerySet, action: str) -> 'ChangeEvent | None':
+        """
+        An unpublished event for a write to every row of a queryset.
+
+        Returns:
+            ChangeEvent | None: None if the queryset is empty
+        """
+        field = 'path' if issubclass(rows.model, DirNode) else 'dirnode__path'
+        # The paths between the first and last share the prefix they share
+        found = rows.order_by().aggregate(
+            first_id=Min('pk'),
+            last_id=Max('pk'),
+            first_path=Min(field),
+            last_path=Max(field),
+        )
+        if found['first_id'] is None:
+            return None
+        path = os.path.commonprefix([found['first_path'], found['last_path']])
+        return cls(
+            node_type=rows.model._meta.model_name,
+            node_id=found['first_id']
+            if found['first_id'] == found['last_id']
+            else None,
+            action=action,
+            path=path[: len(path) - len(path) % DirNode.steplen],
+        )
+
+    def publish(self) -> None:
+        """Save the event once its write is made and the data version bumped."""
+        self.version = DataVersion.current()
+        self.save()
+        transaction.on_commit(partial(change_published.send, sender=ChangeEvent))
+
+    @classmethod
+    def prune(cls, before: datetime, batch_size: int = 1000) -> int:
+        """
+        Delete events older than a time, in bounded batches.
+
+        Returns:
+            int: The number of events deleted
+        """
+        old = cls.objects.filter(created_at__lt=before)
+        pruned = 0
+        while ids := list(old.values_list('id', flat=True)[:batch_size]):
+            pruned += cls.objects.filter(id__in=ids).delete()[0]
+        return pruned
 
 
 class ItemMixin(models.Model):
@@ -22,10 +190,409 @@ class ItemMixin(models.Model):
         return self.display
 
     def save(self, *args, **kwargs):
-        """Ensure proper ordering after save."""
+        """Save the item, bump the data version and publish the change."""
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        if hasattr(self, 'dirnode'):
-            self.dirnode.fix_tree()
+        DataVersion.bump()
+        action = ChangeEvent.Action.CREATED if adding else ChangeEvent.Action.UPDATED
+        ChangeEvent.for_node(self, action).publish()
+
+    def delete(self, *args, **kwargs):
+        """Delete the item, bump the data version and publish the change."""
+        event = ChangeEvent.for_node(self, ChangeEvent.Action.DELETED)
+        result = super().delete(*args, **kwargs)
+        DataVersion.bump()
+        event.publish()
+        return result
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Update what's derived from this item's place in the tree, once written."""
+        if self._state.adding or self.pk is None:
+            yield
+            DirNode.count_items(type(self), Counter({self.dirnode_id: 1}))
+        else:
+            with type(self).objects.filter(pk=self.pk).writing():
+                yield
+
+
+class ItemQuerySet(QuerySet):
+    """A queryset for items that live inside a DirNode."""
+
+    # Fields whose writes change an item's place in the tree
+    TREE_FIELDS = {'display', 'dirnode', 'dirnode_id'}
+
+    def alive(self) -> 'ItemQuerySet':
+        """Exclude items whose directory is waiting to be purged."""
+        return self.filter(dirnode__deleted_at__isnull=True)
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """
+        Update what's derived from these items' place in the tree, once written.
+
+        Renaming, moving or deleting items can change which prompts
+        directories inherit, and moving or deleting them how many items
+        directories hold. Finding the items that changed costs two queries.
+        """
+        fields = ('pk', 'dirnode_id', 'dirnode__path', 'display')
+        before = set(self.order_by().values_list(*fields))
+        yield
+        if not before:
+            return
+        ids = [pk for pk, *_ in before]
+        after = set(self.model.objects.filter(pk__in=ids).values_list(*fields))
+        if not (changed := before ^ after):
+            return
+        EffectivePrompt.refresh(
+            {path for _, _, path, _ in changed},
+            {name for *_, name in changed} if self.model is Prompt else None,
+        )
+        counts = Counter(dirnode_id for _, dirnode_id, *_ in after)
+        counts.subtract(dirnode_id for _, dirnode_id, *_ in before)
+        DirNode.count_items(self.model, counts)
+
+    def delete(self) -> tuple[int, dict[str, int]]:
+        event = ChangeEvent.for_rows(self, ChangeEvent.Action.DELETED)
+        with self.writing():
+            result = super().delete()
+        DataVersion.bump()
+        if event:
+            event.publish()
+        return result
+
+    def update(self, **kwargs) -> int:
+        event = ChangeEvent.for_rows(self, ChangeEvent.Action.UPDATED)
+        with self.writing() if self.TREE_FIELDS & kwargs.keys() else nullcontext():
+            result = super().update(**kwargs)
+        DataVersion.bump()
+        if event:
+            if {'dirnode', 'dirnode_id'} & kwargs.keys():
+                # Moved to directories the event doesn't know
+                event.node_id, event.path = None, ''
+            event.publish()
+        return result
+
+    def bulk_create(self, objs, *args, **kwargs) -> list:
+        result = super().bulk_create(objs, *args, **kwargs)
+        DirNode.count_items(self.model, Counter(obj.dirnode_id for obj in result))
+        DataVersion.bump()
+        self._publish_rows(result, ChangeEvent.Action.CREATED)
+        return result
+
+    def bulk_update(self, objs, fields, *args, **kwargs) -> int:
+        objs = list(objs)
+        with (
+            self.model.objects.filter(pk__in=[obj.pk for obj in objs]).writing()
+            if self.TREE_FIELDS & set(fields)
+            else nullcontext()
+        ):
+            result = super().bulk_update(objs, fields, *args, **kwargs)
+        DataVersion.bump()
+        self._publish_rows(objs, ChangeEvent.Action.UPDATED)
+        return result
+
+    def _publish_rows(self, objs: list, action: str) -> None:
+        ids = [obj.pk for obj in objs if obj.pk is not None]
+        if event := ChangeEvent.for_rows(self.model.objects.filter(pk__in=ids), action):
+            event.publish()
+
+
+class PromptQuerySet(ItemQuerySet):
+    """An item queryset that stores text as blobs and keeps its metadata."""
+
+    def delete(self) -> tuple[int, dict[str, int]]:
+        # The prompts' links go with them, without an m2m_changed
+        linked = list(
+            Prompt.aimodels.through.objects.filter(prompt__in=self)
+            .values_list('aimodel_id', flat=True)
+            .distinct()
+        )
+        result = super().delete()
+        AIModel.objects.filter(id__in=linked).recount_prompts()
+        return result
+
+    def update(self, **kwargs) -> int:
+        if 'text' not in kwargs:
+            return super().update(**kwargs)
+        text = kwargs.pop('text')
+        if not isinstance(text, str):
+            # The text is hashed into a blob here, so it can't be an expression
+            raise TypeError(
+                f'Prompt text must be updated to a str, not {type(text).__name__}'
+            )
+        with transaction.atomic():
+            kwargs['blob'] = PromptBlob.store(text)
+            kwargs.update(Prompt.get_metadata(text))
+            return super().update(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs) -> list['Prompt']:
+        objs = list(objs)
+        with transaction.atomic():
+            PromptBlob.store_all(obj._sync_blob() for obj in objs)
+            return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs) -> int:
+        if 'text' not in fields:
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        objs = list(objs)
+        fields = [
+            *(field for field in fields if field != 'text'),
+            'blob',
+            *Prompt.METADATA_FIELDS,
+        ]
+        with transaction.atomic():
+            PromptBlob.store_all(obj._sync_blob() for obj in objs)
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+
+# A key in a parameter path; keys are written into SQL on SQLite
+PARAMETER_KEY = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def parse_parameter_path(path: str) -> list[str]:
+    """Split a dotted parameter path, such as options.top_p, into its keys."""
+    keys = path.split('.')
+    if not all(PARAMETER_KEY.fullmatch(key) for key in keys):
+        raise ValueError(
+            f'Invalid parameter path {path!r}: keys may only contain letters, '
+            'digits, underscores and hyphens'
+        )
+    return keys
+
+
+# The parameters given an expression index on SQLite
+INDEXED_PARAMETERS = ['model_name', 'temperature']
+
+
+class JSONPath(Func):
+    """
+    A value in a JSON column at a key path written into the SQL, on SQLite.
+
+    SQLite only uses an expression index for a query that repeats the
+    index's path as the same literal, and Django's key transforms send the
+    path as a query parameter.
+    """
+
+    function = 'JSON_EXTRACT'
+
+    def __init__(self, expression, keys: list[str], **extra):
+        path = '$' + ''.join(f'."{key}"' for key in keys)
+        super().__init__(
+            expression, template=f"%(function)s(%(expressions)s, '{path}')", **extra
+        )
+
+
+class VendorIndexMixin:
+    """
+    Creates an index on one database vendor only, as its SQL is theirs.
+
+    Elsewhere a comment stands in for the statement, so the index can still
+    be declared in the model's Meta, where migrations keep track of it.
+    """
+
+    vendor: str
+
+    def create_sql(self, model, schema_editor, *args, **kwargs) -> Statement:
+        if schema_editor.connection.vendor != self.vendor:
+            return Statement('-- %(name)s is only on %(vendor)s', **self._parts())
+        return super().create_sql(model, schema_editor, *args, **kwargs)
+
+    def remove_sql(self, model, schema_editor, *args, **kwargs) -> Statement:
+        if schema_editor.connection.vendor != self.vendor:
+            return Statement('-- %(name)s is only on %(vendor)s', **self._parts())
+        return super().remove_sql(model, schema_editor, *args, **kwargs)
+
+    def _parts(self) -> dict[str, str]:
+        return {'name': self.name, 'vendor': self.vendor}
+
+
+class SQLiteIndex(VendorIndexMixin, models.Index):
+    """An index created on SQLite only."""
+
+    vendor = 'sqlite'
+
+
+class PostgreSQLGinIndex(VendorIndexMixin, GinIndex):
+    """A GIN index, created on PostgreSQL only."""
+
+    vendor = 'postgresql'
+
+
+class AIModelQuerySet(ItemQuerySet):
+    """An item queryset that can search AI models by their parameters."""
+
+    def bulk_create(self, objs, *args, **kwargs) -> list['AIModel']:
+        objs = list(objs)
+        for obj in objs:
+            # Copies start with no prompts
+            obj.prompt_count = 0
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def recount_prompts(self) -> int:
+        """
+        Count the prompts linked to each of these AI models again.
+
+        Returns:
+            int: The number of AI models recounted
+        """
+        links = (
+            Prompt.aimodels.through.objects.filter(aimodel=OuterRef('pk'))
+            .order_by()
+            .values('aimodel')
+            .annotate(count=Count('pk'))
+            .values('count')
+        )
+        # Not a change to publish, so not through ItemQuerySet.update
+        return QuerySet.update(self, prompt_count=Coalesce(Subquery(links), 0))
+
+    def parameters_equal(self, values: dict[str, Any]) -> 'AIModelQuerySet':
+        """
+        AI models with each value at its dotted key path in their parameters.
+
+        Raises:
+            ValueError: If a path has a key that isn't allowed
+        """
+        return self._parameters_at(
+            [(parse_parameter_path(path), value) for path, value in values.items()]
+        )
+
+    def parameters_contain(self, value: dict) -> 'AIModelQuerySet':
+        """
+        AI models whose parameters contain a JSON object.
+
+        PostgreSQL and MySQL test containment directly. Elsewhere each value
+        in the object is looked for at its key path instead, so arrays have to
+        match whole rather than contain the array given.
+
+        Raises:
+            ValueError: If the object has a key that isn't allowed
+        """
+        if connections[self.db].features.supports_json_field_contains:
+            return self.filter(parameters__contains=value)
+        pairs = []
+
+        def flatten(keys: list[str], value: dict) -> None:
+            for key, item in value.items():
+                path = [*keys, *parse_parameter_path(key)]
+                if isinstance(item, dict) and item:
+                    flatten(path, item)
+                else:
+                    pairs.append((path, item))
+
+        flatten([], value)
+        return self._parameters_at(pairs)
+
+    def parameters_have_key(self, path: str) -> 'AIModelQuerySet':
+        """
+        AI models whose parameters have a dotted key path, even if it's null.
+
+        Raises:
+            ValueError: If the path has a key that isn't allowed
+        """
+        *parents, key = parse_parameter_path(path)
+        if not parents:
+            return self.filter(parameters__has_key=key)
+        return self.alias(_parameter=self._key_transform(parents)).filter(
+            _parameter__has_key=key
+        )
+
+    def _parameters_at(self, pairs: list[tuple[list[str], Any]]) -> 'AIModelQuerySet':
+        """
+        Filter by the value at each key path.
+
+        PostgreSQL also tests each value by containment, which its GIN index
+        on parameters can answer. SQLite reads strings and numbers the way
+        its expression indexes do, so paths with an index are looked up in it.
+        """
+        vendor = connections[self.db].vendor
+        queryset, q = self, Q()
+        for i, (keys, value) in enumerate(pairs):
+            if vendor == 'sqlite' and isinstance(value, str):
+                q &= Exact(
+                    JSONPath('parameters', keys, output_field=TextField()), value
+                )
+                continue
+            if (
+                vendor == 'sqlite'
+                and isinstance(value, (int, float))
+                and not isinstance(value, bool)
+            ):
+                # JSON true and false read as 1 and 0
+                q &= Exact(
+                    JSONPath('parameters', keys, output_field=FloatField()), value
+                )
+                q &= In(
+                    JSONPath(
+                        'parameters',
+                        keys,
+                        function='JSON_TYPE',
+                        output_field=TextField(),
+                    ),
+                    ['integer', 'real'],
+                )
+                continue
+            if vendor == 'postgresql':
+                nested = value
+                for key in reversed(keys):
+                    nested = {key: nested}
+                q &= Q(parameters__contains=nested)
+            # Aliased, as keys in a lookup string could be read as lookups
+            queryset = queryset.alias(**{f'_parameter_{i}': self._key_transform(keys)})
+            q &= Q(**{f'_parameter_{i}': value})
+        return queryset.filter(q)
+
+    @staticmethod
+    def _key_transform(keys: list[str]) -> KeyTransform:
+        expression = 'parameters'
+        for key in keys:
+            expression = KeyTransform(key, expression)
+        return expression
+
+
+class DirNodeQuerySet(MP_NodeQuerySet):
+    """A treebeard queryset that understands tombstoned subtrees."""
+
+    def alive(self) -> 'DirNodeQuerySet':
+        """Exclude directories that are waiting to be purged."""
+        return self.filter(deleted_at__isnull=True)
+
+    def tombstoned(self) -> 'DirNodeQuerySet':
+        """Only directories that are waiting to be purged."""
+        return self.filter(deleted_at__isnull=False)
+
+    def delete(self, *args, **kwargs) -> tuple[int, dict[str, int]]:
+        event = ChangeEvent.for_rows(self, ChangeEvent.Action.DELETED)
+        # The subtrees deleted, which treebeard deletes whole
+        tops = []
+        for node in self.order_by('path').values(
+            'path', 'deleted_at', 'subtree_prompt_count', 'subtree_aimodel_count'
+        ):
+            if not tops or not node['path'].startswith(tops[-1]['path']):
+                tops.append(node)
+        result = super().delete(*args, **kwargs)
+        above = set()
+        for node in tops:
+            ancestors = DirNode(path=node['path']).get_ancestor_paths()
+            above.update(ancestors)
+            # Tombstoned subtrees were taken out of the counts above them already
+            if node['deleted_at'] is None:
+                DirNode._add_subtree_counts(
+                    DirNode.objects.filter(path__in=ancestors),
+                    -node['subtree_prompt_count'],
+                    -node['subtree_aimodel_count'],
+                )
+        # The deleted prompts' links went with them
+        AIModel.objects.filter(dirnode__path__in=above).recount_prompts()
+        DataVersion.bump()
+        if event:
+            event.publish()
+        return result
+
+
+class DirNodeManager(MP_NodeManager.from_queryset(DirNodeQuerySet)):
+    def get_queryset(self) -> DirNodeQuerySet:
+        return DirNodeQuerySet(self.model).order_by('path')
 
 
 class DirNode(MP_Node, ItemMixin):
@@ -34,16 +601,461 @@ class DirNode(MP_Node, ItemMixin):
     node_order_by = ['type_order', 'display']
 
     type_order = models.IntegerField(default=1, editable=False)
+    deleted_at = models.DateTimeField(
+        null=True, blank=True, editable=False, db_index=True
+    )
+    # Kept up to date as items and directories are written, and recomputed
+    # by recount()
+    prompt_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='The number of prompts in the directory itself',
+    )
+    aimodel_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='The number of AI models in the directory itself',
+    )
+    subtree_prompt_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='The number of prompts in the directory and those beneath it',
+    )
+    subtree_aimodel_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='The number of AI models in the directory and those beneath it',
+    )
+
+    objects = DirNodeManager()
 
     class Meta:
         verbose_name = 'directory'
         verbose_name_plural = 'directories'
         ordering = ['type_order', 'display']
 
-    def save(self, *args, **kwargs):
-        """Ensure tree is fixed after save."""
-        super().save(*args, **kwargs)
-        self.fix_tree()
+    # Times a tree write is attempted before a path conflict is raised
+    WRITE_ATTEMPTS = 5
+
+    # First half of the PostgreSQL advisory lock keys taken by tree writes
+    LOCK_NAMESPACE = 0x7965
+
+    @staticmethod
+    def _lock_children(*parent_ids: int | None) -> None:
+        """
+        Serialise writes to these directories' children until the transaction ends.
+
+        Treebeard numbers a new or moved node by reading its siblings' paths,
+        so two writers under one parent would otherwise pick the same path.
+        PostgreSQL takes an advisory lock per parent, with 0 standing for the
+        roots; other databases lock the parents' rows.
+        """
+        keys = sorted({parent_id or 0 for parent_id in parent_ids})
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for key in keys:
+                    cursor.execute(
+                        'SELECT pg_advisory_xact_lock(%s, %s)',
+                        [DirNode.LOCK_NAMESPACE, key],
+                    )
+        else:
+            list(
+                DirNode.objects.filter(id__in=keys)
+                .order_by('id')
+                .select_for_update()
+                .values_list('id')
+            )
+
+    @classmethod
+    def _write_tree(
+        cls,
+        parent_ids: Iterable[int | None] | Callable[[], Iterable[int | None]],
+        write: Callable[[], 'DirNode | None'],
+        stale: Iterable['DirNode'] = (),
+    ) -> 'DirNode | None':
+        """
+        Run a tree write under its parents' locks, retrying path conflicts.
+
+        Args:
+            parent_ids: The directories whose children are written, None for
+                the roots, or a function finding them from the stale nodes,
+                which is called again once the locks are held
+            write: Performs the write
+            stale: Nodes whose tree fields are re-read once the locks are held
+        """
+        if not callable(parent_ids):
+            parent_ids = partial(list, parent_ids)
+        stale = list(stale)
+        attempt = 1
+        while True:
+            locked = set(parent_ids())
+            try:
+                with transaction.atomic():
+                    cls._lock_children(*locked)
+                    for node in stale:
+                        node.refresh_from_db(fields=['path', 'depth', 'numchild'])
+                    # Unless another write moved them before the locks were
+                    # taken, in which case other parents are locked instead
+                    if set(parent_ids()) == locked:
+                        return write()
+            except IntegrityError:
+                if attempt == cls.WRITE_ATTEMPTS:
+                    raise
+                time.sleep(random.uniform(0, 0.005 * 2**attempt))
+                attempt += 1
+
+    def _get_parent_id(self) -> int | None:
+        if self.is_root():
+            return None
+        return (
+            DirNode.objects.filter(path=self._get_basepath(self.path, self.depth - 1))
+            .values_list('id', flat=True)
+            .first()
+        )
+
+    @classmethod
+    def add_root(cls, **kwargs) -> 'DirNode':
+        """Add a root directory, serialised with other root writes."""
+        return cls._write_tree([None], partial(super().add_root, **kwargs))
+
+    def add_child(self, **kwargs) -> 'DirNode':
+        """Add a child directory, serialised with its siblings' writes."""
+        child = self._write_tree(
+            [self.id], partial(super().add_child, **kwargs), stale=[self]
+        )
+        EffectivePrompt.refresh([child.path])
+        return child
+
+    def move(self, target: 'DirNode | None', pos: str | None = None) -> None:
+        """Move this directory, serialised with both parents' writes."""
+
+        def parent_ids() -> list[int | None]:
+            ids = [self._get_parent_id()]
+            if target is not None:
+                ids += [target.id, target._get_parent_id()]
+            return ids
+
+        move = partial(super().move, target, pos)
+
+        def write() -> None:
+            # The subtree is counted in different directories once moved
+            before = DirNode.objects.filter(path__in=self.get_ancestor_paths())
+            before = set(before.values_list('id', flat=True))
+            move()
+            moved = DirNode.objects.get(id=self.id)
+            after = DirNode.objects.filter(path__in=moved.get_ancestor_paths())
+            after = set(after.values_list('id', flat=True))
+            counts = moved.subtree_prompt_count, moved.subtree_aimodel_count
+            self._add_subtree_counts(
+                DirNode.objects.filter(id__in=before - after), *(-n for n in counts)
+            )
+            self._add_subtree_counts(
+                DirNode.objects.filter(id__in=after - before), *counts
+            )
+
+        self._write_tree(
+            parent_ids, write, stale=[self] if target is None else [self, target]
+        )
+        DataVersion.bump()
+        # Treebeard leaves this instance's path as it was before the move
+        event = ChangeEvent.for_node(self, ChangeEvent.Action.MOVED)
+        event.from_path = self.path
+        event.path = DirNode.objects.values_list('path', flat=True).get(id=self.id)
+        event.publish()
+        # The subtree inherits from its new ancestors
+        EffectivePrompt.refresh([event.path])
+
+    def get_ancestor_paths(self) -> List[str]:
+        """Return the materialised paths of this directory's ancestors."""
+        return [
+            self.path[:end] for end in range(self.steplen, len(self.path), self.steplen)
+        ]
+
+    @staticmethod
+    def _add_subtree_counts(
+        directories: DirNodeQuerySet, prompts: int, aimodels: int
+    ) -> None:
+        directories.update(
+            subtree_prompt_count=F('subtree_prompt_count') + prompts,
+            subtree_aimodel_count=F('subtree_aimodel_count') + aimodels,
+        )
+
+    def _count_in_ancestors(self, sign: int) -> None:
+        """Add this directory's subtree counts to its ancestors', or take them."""
+        prompts, aimodels = DirNode.objects.values_list(
+            'subtree_prompt_count', 'subtree_aimodel_count'
+        ).get(id=self.id)
+        self._add_subtree_counts(
+            DirNode.objects.filter(path__in=self.get_ancestor_paths()),
+            sign * prompts,
+            sign * aimodels,
+        )
+
+    @classmethod
+    def count_items(cls, model: type[models.Model], counts: Counter) -> None:
+        """
+        Add to some directories' counts of an item type, and their ancestors'.
+
+        Every directory is changed in one UPDATE. A tombstoned subtree's items
+        only count in the directories tombstoned with it.
+
+        Args:
+            model: AIModel or Prompt
+            counts: How many items each directory gained, by id, negative
+                for items it lost
+        """
+        field = f'{model._meta.model_name}_count'
+        counts = {dirnode_id: count for dirnode_id, count in counts.items() if count}
+        if not counts:
+            return
+        subtree = Counter()
+        for dirnode_id, path, deleted_at in cls.objects.filter(
+            id__in=counts
+        ).values_list('id', 'path', 'deleted_at'):
+            for end in range(cls.steplen, len(path) + 1, cls.steplen):
+                subtree[path[:end], deleted_at] += counts[dirnode_id]
+        cls.objects.filter(path__in={path for path, _ in subtree}).update(
+            **{
+                field: F(field)
+                + Case(
+                    *(When(id=i, then=count) for i, count in counts.items()),
+                    default=0,
+                ),
+                f'subtree_{field}': F(f'subtree_{field}')
+                + Case(
+                    *(
+                        When(path=path, deleted_at=deleted_at, then=count)
+                        for (path, deleted_at), count in subtree.items()
+                        if count
+                    ),
+                    default=0,
+                ),
+            }
+        )
+
+    @classmethod
+    def recount(cls, batch_size: int = 500) -> int:
+        """
+        Count every directory's items again, and every AI model's prompts.
+
+        Returns:
+            int: The number of directories whose counts were wrong
+        """
+        fields = [
+            'prompt_count',
+            'aimodel_count',
+            'subtree_prompt_count',
+            'subtree_aimodel_count',
+        ]
+        direct = {
+            model._meta.model_name: dict(
+                model.objects.order_by()
+                .values('dirnode')
+                .annotate(count=Count('pk'))
+                .values_list('dirnode', 'count')
+            )
+            for model in (Prompt, AIModel)
+        }
+        nodes = list(cls.objects.only('path', 'deleted_at', *fields))
+        deleted_at = {node.path: node.deleted_at for node in nodes}
+        # Children's totals, collected before their parents are reached
+        below: dict[str, Counter] = {}
+        wrong = []
+        for node in sorted(nodes, key=lambda node: node.path, reverse=True):
+            totals = below.pop(node.path, Counter())
+            counts = {}
+            for name in ('prompt', 'aimodel'):
+                count = direct[name].get(node.id, 0)
+                counts[f'{name}_count'] = count
+                counts[f'subtree_{name}_count'] = count + totals[name]
+            parent = node.path[: -cls.steplen]
+            if parent and deleted_at.get(parent) == node.deleted_at:
+                below.setdefault(parent, Counter()).update(
+                    prompt=counts['subtree_prompt_count'],
+                    aimodel=counts['subtree_aimodel_count'],
+                )
+            if any(getattr(node, name) != count for name, count in counts.items()):
+                for name, count in counts.items():
+                    setattr(node, name, count)
+                wrong.append(node)
+        cls.objects.bulk_update(wrong, fields, batch_size=batch_size)
+        AIModel.objects.recount_prompts()
+        return len(wrong)
+
+    def get_alive_children(self) -> DirNodeQuerySet:
+        """Return the children of this directory that haven't been deleted."""
+        return self.get_children().alive()
+
+    def tombstone(self) -> int:
+        """
+        Hide this directory and everything beneath it until it's purged.
+
+        Rows are only flagged here, with a single UPDATE over the path prefix,
+        so deleting a large project returns immediately. The subtree can be
+        brought back with restore() until purge_deleted() removes it.
+
+        Returns:
+            int: The number of directories tombstoned
+        """
+        self.deleted_at = timezone.now()
+        with transaction.atomic():
+            tombstoned = DirNode.objects.filter(
+                path__startswith=self.path, deleted_at__isnull=True
+            ).update(deleted_at=self.deleted_at)
+            self._count_in_ancestors(-1)
+        EffectivePrompt.refresh([self.path])
+        DataVersion.bump()
+        ChangeEvent.for_node(self, ChangeEvent.Action.DELETED).publish()
+        return tombstoned
+
+    def restore(self) -> int:
+        """
+        Bring back a tombstoned directory and the subtree deleted with it.
+
+        Returns:
+            int: The number of directories restored
+        """
+        if self.deleted_at is None:
+            return 0
+        parent = self.get_parent()
+        if parent is not None and parent.deleted_at is not None:
+            raise ValueError(f'Restore the parent directory "{parent.display}" first.')
+        with transaction.atomic():
+            restored = DirNode.objects.filter(
+                path__startswith=self.path, deleted_at=self.deleted_at
+            ).update(deleted_at=None)
+            self._count_in_ancestors(1)
+        self.deleted_at = None
+        EffectivePrompt.refresh([self.path])
+        DataVersion.bump()
+        ChangeEvent.for_node(self, ChangeEvent.Action.RESTORED).publish()
+        return restored
+
+    def copy_to(
+        self,
+        target: 'DirNode | None',
+        progress: Callable[[int, int], None] | None = None,
+    ) -> 'DirNode':
+        """
+        Copy this directory and everything in it beneath another directory.
+
+        Directories are created one by one, in path order, so treebeard can
+        number them, but each directory's items are inserted in bulk. Copied
+        prompts share their text blobs with the originals. If the copy fails
+        or is cancelled part way, what was copied is tombstoned.
+
+        Args:
+            target (DirNode, optional): The new parent, or None for a root
+            progress (Callable, optional): Called with the number of rows
+                copied so far and the total
+
+        Returns:
+            DirNode: The new copy of this directory
+        """
+        sources = list(
+            DirNode.objects.alive().filter(path__startswith=self.path).order_by('path')
+        )
+        source_ids = [source.id for source in sources]
+        total = (
+            len(sources)
+            + AIModel.objects.filter(dirnode_id__in=source_ids).count()
+            + Prompt.objects.filter(dirnode_id__in=source_ids).count()
+        )
+
+        copies = {}
+        copied = 0
+        try:
+            for source in sources:
+                parent_path = source._get_basepath(source.path, source.depth - 1)
+                parent = copies.get(parent_path, target)
+                if parent is None:
+                    copy = DirNode.add_root(display=source.display)
+                else:
+                    copy = parent.add_child(display=source.display)
+                copies[source.path] = copy
+                copied += 1
+
+                for model in (AIModel, Prompt):
+                    items = list(model.objects.filter(dirnode=source).order_by('id'))
+                    for item in items:
+                        item.pk = None
+                        item._state.adding = True
+                        item.dirnode = copy
+                    model.objects.bulk_create(items)
+                    copied += len(items)
+
+                if progress:
+                    progress(copied, total)
+        except BaseException:
+            if copies:
+                copies[self.path].tombstone()
+            raise
+
+        return copies[self.path]
+
+    @classmethod
+    def purge_deleted(
+        cls,
+        before: datetime | None = None,
+        batch_size: int = 500,
+        progress: Callable[[int], None] | None = None,
+    ) -> int:
+        """
+        Permanently remove tombstoned subtrees in bounded batches.
+
+        Each batch is its own short transaction, so no single statement holds
+        locks for the length of a large delete. Prompts, AI models and
+        snapshots go first, then directories deepest first, which keeps every
+        cascade trivial. Snapshot files are deleted once their rows are.
+
+        Args:
+            before (datetime, optional): Only purge subtrees deleted before this
+            batch_size (int): The maximum number of rows removed per statement
+            progress (Callable, optional): Called with the running row count
+
+        Returns:
+            int: The number of rows deleted
+        """
+        tombstoned = cls.objects.tombstoned()
+        if before is not None:
+            tombstoned = tombstoned.filter(deleted_at__lte=before)
+
+        purged = 0
+        # The shallowest tombstoned node can't have a tombstoned parent in the
+        # purge set, so it is always the top of a subtree we can remove whole
+        while root := tombstoned.order_by('depth', 'path').first():
+            for queryset in (
+                Prompt.objects.filter(dirnode__path__startswith=root.path).order_by(),
+                AIModel.objects.filter(dirnode__path__startswith=root.path).order_by(),
+                Snapshot.objects.filter(dirnode__path__startswith=root.path).order_by(),
+                cls.objects.filter(path__startswith=root.path).order_by('-depth'),
+            ):
+                while ids := list(queryset.values_list('id', flat=True)[:batch_size]):
+                    # Restoring stops the purge of whatever is left
+                    if not cls.objects.filter(
+                        id=root.id, deleted_at__isnull=False
+                    ).exists():
+                        return purged
+                    with transaction.atomic():
+                        # Children go before their parents, so treebeard's
+                        # subtree-aware delete isn't needed for directories
+                        deleted, _ = QuerySet.delete(
+                            queryset.model.objects.filter(id__in=ids)
+                        )
+                    purged += deleted
+                    if progress:
+                        progress(purged)
+
+            parent_path = root._get_basepath(root.path, root.depth - 1)
+            if parent_path:
+                cls.objects.filter(path=parent_path).update(numchild=F('numchild') - 1)
+            # The purged prompts' links went with them
+            AIModel.objects.filter(
+                dirnode__path__in=root.get_ancestor_paths()
+            ).recount_prompts()
+            DataVersion.bump()
+
+        return purged
 
     def get_descendants_by_type(
         self, model_class: type
@@ -97,11 +1109,46 @@ class AIModel(ItemMixin):
         blank=True,
         help_text='Arbitrary key-value pairs for model parameters',
     )
+    prompt_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='The number of prompts linked to the model',
+    )
+
+    objects = AIModelQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'AI model'
         verbose_name_plural = 'AI models'
         ordering = ['type_order', 'display']
+        indexes = [
+            # PostgreSQL's GIN index answers containment for every key
+            PostgreSQLGinIndex(
+                fields=['parameters'], name='yesand_aimodel_parameters_gin'
+            ),
+            # SQLite has no such index, so common keys get an expression index,
+            # written as _parameters_at() queries them
+            *(
+                SQLiteIndex(
+                    JSONPath('parameters', [key]),
+                    name=f'aimodel_params_{key}',
+                )
+                for key in INDEXED_PARAMETERS
+            ),
+        ]
+
+    def save(self, *args, **kwargs) -> None:
+        """Saves the model and what's derived from its place in the tree."""
+        if self._state.adding or self.pk is None:
+            # Copies start with no prompts
+            self.prompt_count = 0
+        with self.writing():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Deletes the model and what's derived from its place in the tree."""
+        with self.writing():
+            return super().delete(*args, **kwargs)
 
     @property
     def key(self) -> str:
@@ -119,6 +1166,100 @@ class AIModel(ItemMixin):
             self.encrypted_api_key = None
 
 
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation has been requested."""
+
+
+class Job(models.Model):
+    """
+    A long-running task, queued in the database and run by `manage.py worker`.
+
+    Task functions are registered by name in yesand.jobs and receive the job
+    as their first argument, so they can report progress as they go.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        SUCCEEDED = 'succeeded', 'Succeeded'
+        FAILED = 'failed', 'Failed'
+        CANCELLED = 'cancelled', 'Cancelled'
+
+    name = models.CharField(max_length=100, help_text='The registered task to run')
+    arguments = JSONField(default=dict, blank=True)
+    description = models.CharField(max_length=255, blank=True)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.QUEUED
+    )
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    result = JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=255, blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    FINISHED = (Status.SUCCEEDED, Status.FAILED, Status.CANCELLED)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self) -> str:
+        return self.description or self.name
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in self.FINISHED
+
+    @property
+    def percent(self) -> int:
+        """Progress as a whole percentage, or 0 while the total is unknown."""
+        if not self.total:
+            return 100 if self.status == self.Status.SUCCEEDED else 0
+        return min(100, self.progress * 100 // self.total)
+
+    def report(
+        self, progress: int, total: int | None = None, message: str | None = None
+    ) -> None:
+        """
+        Record progress, which also shows the worker is still alive.
+
+        Raises:
+            JobCancelled: If cancellation has been requested
+        """
+        self.progress = progress
+        self.heartbeat_at = timezone.now()
+        changes = {'progress': progress, 'heartbeat_at': self.heartbeat_at}
+        if total is not None:
+            self.total = changes['total'] = total
+        if message is not None:
+            self.message = changes['message'] = message[:255]
+        Job.objects.filter(id=self.id).update(**changes)
+
+        if Job.objects.filter(id=self.id, cancel_requested=True).exists():
+            raise JobCancelled(f'Job {self.id} was cancelled')
+
+    def cancel(self) -> None:
+        """Cancel the job now if it hasn't started, or ask its worker to stop."""
+        if not Job.objects.filter(id=self.id, status=self.Status.QUEUED).update(
+            status=self.Status.CANCELLED,
+            cancel_requested=True,
+            finished_at=timezone.now(),
+        ):
+            Job.objects.filter(id=self.id, status=self.Status.RUNNING).update(
+                cancel_requested=True
+            )
+        self.refresh_from_db()
+
+
 class Field(models.Model):
     """A field in the prompt template."""
 
@@ -128,6 +1269,111 @@ class Field(models.Model):
         return f'Field {self.template}'
 
 
+class PromptBlob(models.Model):
+    """
+    Prompt text stored once, keyed by the SHA-256 digest of its contents.
+
+    Blobs are immutable, so copying a prompt only copies the key, and reads
+    can be served from the shared cache without ever being invalidated.
+    Blobs no longer referenced by any prompt are removed by collect_garbage().
+    """
+
+    hash = models.CharField(max_length=64, primary_key=True)
+    text = models.TextField(blank=True)
+    stored_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        help_text='When the text was last stored, which keeps it from being '
+        'collected for PROMPT_BLOB_GRACE_PERIOD seconds',
+    )
+
+    CACHE_PREFIX = 'prompt-blob:'
+
+    class Meta:
+        verbose_name = 'prompt blob'
+        verbose_name_plural = 'prompt blobs'
+
+    def __str__(self) -> str:
+        return self.hash
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """Returns the key a blob of this text is stored under."""
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @classmethod
+    def store(cls, text: str) -> 'PromptBlob':
+        """Stores some text if it isn't already, returning its blob."""
+        blob = cls(hash=cls.hash_text(text), text=text)
+        cls.store_all([blob])
+        return blob
+
+    @classmethod
+    def store_all(cls, blobs: Iterable['PromptBlob | None']) -> None:
+        """
+        Stores new blobs with one INSERT, only touching any that already exist.
+
+        Existing blobs have their stored_at renewed, so collect_garbage() leaves
+        them for the prompts about to use them. The text is written through to
+        the cache too, as it's usually read straight back to render the prompt
+        that was just saved.
+        """
+        blobs = {blob.hash: blob for blob in blobs if blob is not None}
+        if blobs:
+            stored_at = timezone.now()
+            for blob in blobs.values():
+                blob.stored_at = stored_at
+            cls.objects.bulk_create(
+                blobs.values(),
+                update_conflicts=True,
+                unique_fields=['hash'],
+                update_fields=['stored_at'],
+            )
+            cache.set_many(
+                {f'{cls.CACHE_PREFIX}{key}': blob.text for key, blob in blobs.items()},
+                timeout=None,
+            )
+
+    @classmethod
+    def get_text(cls, content_hash: str) -> str:
+        """Returns the text stored under a hash, reading through the cache."""
+        key = f'{cls.CACHE_PREFIX}{content_hash}'
+        text = cache.get(key)
+        if text is None:
+            text = cls.objects.values_list('text', flat=True).get(hash=content_hash)
+            cache.set(key, text, timeout=None)
+        return text
+
+    @classmethod
+    def collect_garbage(cls, batch_size: int = 500) -> int:
+        """
+        Deletes blobs that no prompt refers to, in bounded batches.
+
+        Prompts of tombstoned directories still hold their blobs, so text is
+        only collected once purge_deleted has removed them. Text stored in the
+        last PROMPT_BLOB_GRACE_PERIOD seconds is kept, as the prompt it was
+        stored for may not be written yet.
+
+        Returns:
+            int: The number of blobs deleted
+        """
+        stored_before = timezone.now() - timedelta(
+            seconds=settings.PROMPT_BLOB_GRACE_PERIOD
+        )
+        unreferenced = cls.objects.filter(
+            prompts__isnull=True, stored_at__lt=stored_before
+        )
+        collected = 0
+        while hashes := list(unreferenced.values_list('hash', flat=True)[:batch_size]):
+            # Evicted first, so text stored again meanwhile is cached again
+            # rather than evicted after it's written through
+            cache.delete_many([f'{cls.CACHE_PREFIX}{key}' for key in hashes])
+            # Check again while deleting, in case a prompt picked one up
+            deleted, _ = unreferenced.filter(hash__in=hashes).delete()
+            collected += deleted
+        return collected
+
+
 class Prompt(ItemMixin):
     """A prompt for a text generation model."""
 
@@ -135,23 +1381,123 @@ class Prompt(ItemMixin):
     dirnode = models.ForeignKey(
         DirNode, on_delete=models.CASCADE, related_name='prompts'
     )
-    text = models.TextField(blank=True)
+    blob = models.ForeignKey(
+        PromptBlob, on_delete=models.PROTECT, related_name='prompts', editable=False
+    )
+    length = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        help_text='The number of characters in the text',
+    )
+    token_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        help_text='The number of tokens in the text, per PROMPT_TOKENIZER',
+    )
     aimodels = models.ManyToManyField(AIModel, blank=True, related_name='prompts')
     fields = models.ManyToManyField(Field, blank=True, related_name='prompts')
 
+    objects = PromptQuerySet.as_manager()
+
+    METADATA_FIELDS = ('length', 'token_count')
+
+    # Text assigned or read through the text property, None until either
+    _text = None
+
     class Meta:
         verbose_name = 'prompt'
         verbose_name_plural = 'prompts'
         ordering = ['type_order', 'display']
 
-    def __str__(self) -> str:
-        return f'{self.display}: {self.text[:50]}...'
-
     def save(self, *args, **kwargs) -> None:
         """Saves the model and updates the AI models."""
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = {
+                *(field for field in update_fields if field != 'text'),
+                'blob',
+                *self.METADATA_FIELDS,
+            }
+        # The blob and the prompt pointing at it are written together
+        with transaction.atomic():
+            PromptBlob.store_all([self._sync_blob()])
+            with self.writing():
+                super().save(*args, **kwargs)
         self._update_aimodels()
 
+    def delete(self, *args, **kwargs):
+        """Deletes the model and what's derived from its place in the tree."""
+        linked = list(self.aimodels.values_list('id', flat=True))
+        with self.writing():
+            result = super().delete(*args, **kwargs)
+        # Its links go with it, without an m2m_changed
+        AIModel.objects.filter(id__in=linked).recount_prompts()
+        return result
+
+    def refresh_from_db(self, *args, **kwargs) -> None:
+        """Reloads the model, reading the text again if the blob was reloaded."""
+        super().refresh_from_db(*args, **kwargs)
+        fields = kwargs.get('fields')
+        if fields is None or 'blob' in fields or 'blob_id' in fields:
+            self._text = None
+
+    @property
+    def text(self) -> str:
+        """The prompt text, read from its blob on first access."""
+        if self._text is None:
+            if Prompt.blob.is_cached(self):
+                self._text = self.blob.text
+            elif self.blob_id is not None:
+                self._text = PromptBlob.get_text(self.blob_id)
+            else:
+                self._text = ''
+        return self._text
+
+    @text.setter
+    def text(self, value: str) -> None:
+        self._text = value
+
+    @property
+    def content_hash(self) -> str:
+        """The SHA-256 hex digest of the text, which is also its blob's key."""
+        if self._text is not None:
+            return PromptBlob.hash_text(self._text)
+        return self.blob_id or PromptBlob.hash_text('')
+
+    def _sync_blob(self) -> PromptBlob | None:
+        """
+        Points the prompt at the blob for its text.
+
+        Copies keep the blob they were loaded with, so nothing is hashed or
+        stored for them.
+
+        Returns:
+            PromptBlob | None: A blob that may still need storing, if the text
+            changed
+        """
+        if self._text is None:
+            if self.blob_id is not None:
+                return None
+            self._text = ''
+        content_hash = PromptBlob.hash_text(self._text)
+        if content_hash == self.blob_id:
+            return None
+        self.blob_id = content_hash
+        self.update_metadata()
+        return PromptBlob(hash=content_hash, text=self._text)
+
+    @staticmethod
+    def get_metadata(text: str) -> dict:
+        """Returns the values of the columns derived from some prompt text."""
+        return {'length': len(text), 'token_count': count_tokens(text)}
+
+    def update_metadata(self) -> None:
+        """Recomputes the length and token count from the text."""
+        for name, value in self.get_metadata(self.text).items():
+            setattr(self, name, value)
+
     def get_ancestor_aimodels(self) -> QuerySet[AIModel]:
         """Returns all AIModels in the ancestor directories."""
         return self.get_ancestor_aimodels_for_dirnode(self.dirnode_id)
@@ -175,3 +1521,404 @@ class Prompt(ItemMixin):
         )
         aimodels_to_remove = self.aimodels.exclude(id__in=valid_aimodel_ids)
         self.aimodels.remove(*aimodels_to_remove)
+
+
+class EffectivePrompt(models.Model):
+    """
+    The prompt a directory inherits for an AI model and prompt name.
+
+    A prompt applies to its directory and everything beneath it, for each AI
+    model it's linked to, until a deeper directory has a prompt of the same
+    name for an AI model of the same name. Rows hold the result for every
+    directory, so resolving one is a single lookup instead of a walk up the
+    tree. Writes to prompts, AI models and directories refresh only the
+    subtrees and prompt names they can change.
+    """
+
+    # Indexed as the first column of the unique constraint
+    dirnode = models.ForeignKey(
+        DirNode,
+        on_delete=models.CASCADE,
+        related_name='effective_prompts',
+        db_index=False,
+    )
+    model_name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    prompt = models.ForeignKey(
+        Prompt, on_delete=models.CASCADE, related_name='effective'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dirnode', 'model_name', 'name'],
+                name='unique_effective_prompt',
+            )
+        ]
+
+    # Rows written or deleted per statement
+    BATCH_SIZE = 500
+
+    def __str__(self) -> str:
+        return f'{self.model_name} {self.name} in {self.dirnode_id}'
+
+    @staticmethod
+    def scope(rows: QuerySet) -> tuple[set[str], set[str] | None]:
+        """
+        The subtrees and prompt names a write to some items can change.
+
+        Returns:
+            tuple: The items' directory paths, and the prompts' names, or
+            None for an AI model's, which can change every name
+        """
+        found = set(rows.order_by().values_list('dirnode__path', 'display'))
+        names = {name for _, name in found} if rows.model is Prompt else None
+        return {path for path, _ in found}, names
+
+    @classmethod
+    def refresh(cls, paths: Iterable[str], names: Iterable[str] | None = None) -> None:
+        """
+        Recompute the effective prompts at and beneath some directories.
+
+        Args:
+            paths: The paths of the directories whose subtrees may have changed
+            names: Only recompute prompts with these names, or None for all
+        """
+        names = None if names is None else set(names)
+        roots = []
+        # A path sorts straight after the paths it's beneath
+        for path in sorted(set(paths)):
+            if not roots or not path.startswith(roots[-1]):
+                roots.append(path)
+        with transaction.atomic():
+            for path in roots:
+                cls._refresh_subtree(path, names)
+
+    @classmethod
+    def _refresh_subtree(cls, path: str, names: set[str] | None) -> None:
+        ancestors = DirNode(path=path).get_ancestor_paths()
+        rows = cls.objects.filter(dirnode__path__startswith=path)
+        links = Prompt.aimodels.through.objects.filter(
+            Q(prompt__dirnode__path__startswith=path)
+            | Q(prompt__dirnode__path__in=ancestors),
+            prompt__dirnode__deleted_at__isnull=True,
+        )
+        if names is not None:
+            rows = rows.filter(name__in=names)
+            links = links.filter(prompt__display__in=names)
+
+        directories = list(
+            DirNode.objects.alive()
+            .filter(path__startswith=path)
+            .order_by('path')
+            .values_list('id', 'path')
+        )
+        if not directories:
+            # Tombstoned, so nothing is effective in it
+            rows.delete()
+            return
+
+        # The prompts in each directory by (AI model name, prompt name),
+        # keeping the oldest of any with the same names
+        found: dict[str, dict[tuple[str, str], int]] = {}
+        for directory, model_name, name, prompt_id in links.order_by(
+            '-prompt_id'
+        ).values_list(
+            'prompt__dirnode__path', 'aimodel__display', 'prompt__display', 'prompt_id'
+        ):
+            found.setdefault(directory, {})[model_name, name] = prompt_id
+
+        inherited: dict[tuple[str, str], int] = {}
+        for ancestor in ancestors:
+            inherited.update(found.get(ancestor, {}))
+        # Each directory's prompts override its parent's
+        effective: dict[str, dict[tuple[str, str], int]] = {}
+        wanted = {}
+        for dirnode_id, directory in directories:
+            prompts = effective.get(directory[: -DirNode.steplen], inherited)
+            if own := found.get(directory):
+                prompts = {**prompts, **own}
+            effective[directory] = prompts
+            for (model_name, name), prompt_id in prompts.items():
+                wanted[dirnode_id, model_name, name] = prompt_id
+
+        stale = []
+        for row_id, *key, prompt_id in rows.values_list(
+            'id', 'dirnode_id', 'model_name', 'name', 'prompt_id'
+        ):
+            key = tuple(key)
+            if key not in wanted:
+                stale.append(row_id)
+            elif wanted[key] == prompt_id:
+                del wanted[key]
+        for start in range(0, len(stale), cls.BATCH_SIZE):
+            cls.objects.filter(id__in=stale[start : start + cls.BATCH_SIZE]).delete()
+        # Rows whose prompt changed are updated in place
+        cls.objects.bulk_create(
+            [
+                cls(
+                    dirnode_id=dirnode_id,
+                    model_name=model_name,
+                    name=name,
+                    prompt_id=prompt_id,
+                )
+                for (dirnode_id, model_name, name), prompt_id in wanted.items()
+            ],
+            batch_size=cls.BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['dirnode', 'model_name', 'name'],
+            update_fields=['prompt'],
+        )
+
+
+class Snapshot(models.Model):
+    """
+    An immutable, published copy of a directory and everything beneath it.
+
+    The copy is a file in SNAPSHOT_ROOT in the format read by
+    yesand.snapshots, so services can pin a version and read it offline.
+    Snapshots are deleted with their directory, files and all.
+    """
+
+    dirnode = models.ForeignKey(
+        DirNode, on_delete=models.CASCADE, related_name='snapshots'
+    )
+    display = models.CharField(max_length=255)
+    version = models.PositiveIntegerField()
+    filename = models.CharField(max_length=255, unique=True, editable=False)
+    sha256 = models.CharField(max_length=64, editable=False)
+    size = models.PositiveBigIntegerField(editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dirnode', 'version'], name='unique_snapshot_version'
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.display} v{self.version}'
+
+    @property
+    def path(self) -> Path:
+        return Path(settings.SNAPSHOT_ROOT) / self.filename
+
+    @classmethod
+    def publish(
+        cls,
+        dirnode: DirNode,
+        progress: Callable[[int, int], None] | None = None,
+    ) -> 'Snapshot':
+        """
+        Freeze a directory's subtree into a new snapshot version.
+
+        AI models are published without their API keys. A version that's
+        already taken, in the database or by a file, is skipped for the next
+        one, so a published file is never overwritten.
+
+        Args:
+            dirnode (DirNode): The directory to publish
+            progress (Callable, optional): Called with the steps done and total
+
+        Returns:
+            Snapshot: The new snapshot
+        """
+        nodes = DirNode.objects.alive().filter(path__startswith=dirnode.path)
+        # Directories are named by display path, relative to the one published
+        directories = {dirnode.path: ''}
+        descendants = nodes.exclude(id=dirnode.id).order_by('path')
+        for node in descendants.only('path', 'depth', 'display'):
+            parent = directories[node._get_basepath(node.path, node.depth - 1)]
+            directories[node.path] = (
+                f'{parent}/{node.display}' if parent else node.display
+            )
+
+        aimodels = [
+            (directories[path], display, {'endpoint': endpoint, 'parameters': params})
+            for path, display, endpoint, params in AIModel.objects.filter(
+                dirnode__in=nodes
+            )
+            .order_by('dirnode__path', 'display')
+            .values_list('dirnode__path', 'display', 'endpoint', 'parameters')
+        ]
+        prompts = [
+            (
+                directories[prompt.dirnode.path],
+                prompt.display,
+                prompt.text,
+                [aimodel.display for aimodel in prompt.aimodels.all()],
+            )
+            for prompt in Prompt.objects.filter(dirnode__in=nodes)
+            .select_related('dirnode', 'blob')
+            .prefetch_related(
+                models.Prefetch('aimodels', AIModel.objects.only('display'))
+            )
+            .order_by('dirnode__path', 'display')
+        ]
+        if progress:
+            progress(1, 2)
+
+        published_at = timezone.now().isoformat()
+        version = (
+            cls.objects.filter(dirnode=dirnode).aggregate(Max('version'))[
+                'version__max'
+            ]
+            or 0
+        ) + 1
+        while True:
+            filename = f'{dirnode.id}-{version}.snap'
+            try:
+                with transaction.atomic():
+                    # The row is reserved before the file is written, so a
+                    # concurrent publish of the same version fails here
+                    snapshot = cls.objects.create(
+                        dirnode=dirnode,
+                        display=dirnode.display,
+                        version=version,
+                        filename=filename,
+                        sha256='',
+                        size=0,
+                    )
+                    snapshot.sha256, snapshot.size = snapshots.write(
+                        snapshot.path,
+                        metadata={
+                            'directory': dirnode.display,
+                            'version': version,
+                            'published_at': published_at,
+                        },
+                        models=aimodels,
+                        prompts=prompts,
+                    )
+                    try:
+                        snapshot.save(update_fields=['sha256', 'size'])
+                    except BaseException:
+                        snapshot.path.unlink()
+                        raise
+            except (IntegrityError, FileExistsError):
+                # Taken by a concurrent publish, or a file left by a deleted
+                # directory that had the same id
+                version += 1
+            else:
+                break
+        if progress:
+            progress(2, 2)
+        return snapshot
+
+
+class KeyScope(NamedTuple):
+    """
+    The directory an API key grants access to, and beneath it.
+
+    Only ids are cached. Adding a sibling before a directory renumbers its
+    path, so the path is read in the query that uses it.
+    """
+
+    key_id: int
+    dirnode_id: int
+
+    def path(self) -> Subquery:
+        """The directory's current path, or NULL, matching nothing, if deleted."""
+        return Subquery(
+            DirNode.objects.alive().filter(pk=self.dirnode_id).values('path')[:1]
+        )
+
+    def filter(self, queryset: QuerySet, field_name: str = 'path') -> QuerySet:
+        """Restrict a queryset to the directory and beneath it."""
+        return queryset.filter(**{f'{field_name}__startswith': self.path()})
+
+
+class APIKey(models.Model):
+    """
+    A secret granting API access to a directory and everything beneath it.
+
+    Only a SHA-256 hash of the key is stored, so the key itself is shown once,
+    when it's created. Keys are random and long, so a fast hash is enough.
+    Checked keys are cached in each process for API_KEY_CACHE_TIMEOUT
+    seconds, so authenticating a request normally costs no queries.
+    """
+
+    PREFIX = 'yesand_'
+
+    display = models.CharField(max_length=255)
+    dirnode = models.ForeignKey(
+        DirNode, on_delete=models.CASCADE, related_name='api_keys'
+    )
+    # The start of the key, to tell keys apart without revealing them
+    prefix = models.CharField(max_length=16, editable=False)
+    hashed_key = models.CharField(max_length=64, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+
+    # Hashed keys to (expiry, scope or None if revoked), in this process
+    _cache: dict[str, tuple[float, KeyScope | None]] = {}
+
+    class Meta:
+        verbose_name = 'API key'
+        ordering = ['-created_at']
+
+    def __str__(self) -> str:
+        return f'{self.display} ({self.prefix}…)'
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._cache.clear()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self._cache.clear()
+        return result
+
+    @staticmethod
+    def hash(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def set_key(self) -> str:
+        """Give this key a new random secret, and return it."""
+        key = f'{self.PREFIX}{secrets.token_urlsafe(32)}'
+        self.prefix = key[: len(self.PREFIX) + 6]
+        self.hashed_key = self.hash(key)
+        return key
+
+    @classmethod
+    def generate(cls, display: str, dirnode: DirNode) -> tuple['APIKey', str]:
+        """
+        Create a key for a directory.
+
+        Returns:
+            tuple[APIKey, str]: The saved key and the secret, which isn't stored
+        """
+        api_key = cls(display=display, dirnode=dirnode)
+        key = api_key.set_key()
+        api_key.save()
+        return api_key, key
+
+    @classmethod
+    def authenticate(cls, key: str) -> KeyScope | None:
+        """
+        The directory a key is scoped to.
+
+        Returns:
+            KeyScope | None: None if the key is unknown or revoked
+        """
+        hashed_key = cls.hash(key)
+        cached = cls._cache.get(hashed_key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        found = (
+            cls.objects.filter(hashed_key=hashed_key)
+            .values_list('id', 'dirnode_id', 'revoked_at')
+            .first()
+        )
+        if found is None:
+            # Unknown keys aren't cached, so guessing can't fill the cache
+            return None
+        *scope, revoked_at = found
+        scope = None if revoked_at else KeyScope(*scope)
+        cls._cache[hashed_key] = (
+            time.monotonic() + settings.API_KEY_CACHE_TIMEOUT,
+            scope,
+        )
+        return scope
@@ -0,0 +1,72 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    AIModel,
+    ChangeEvent,
+    DataVersion,
+    EffectivePrompt,
+    Prompt,
+    Snapshot,
+)
+
+
+@receiver(m2m_changed, sender=Prompt.aimodels.through)
+@receiver(m2m_changed, sender=Prompt.fields.through)
+def bump_data_version(sender, instance, action, reverse, pk_set, **kwargs) -> None:
+    """Prompt relations are saved after the prompt itself, so bump again."""
+    if not action.startswith('post_'):
+        return
+    DataVersion.bump()
+    if not reverse:
+        event = ChangeEvent.for_node(instance, ChangeEvent.Action.UPDATED)
+    elif pk_set is None:
+        # Cleared from an AI model or field, so any prompt may have changed
+        event = ChangeEvent(node_type='prompt', action=ChangeEvent.Action.UPDATED)
+    else:
+        event = ChangeEvent.for_rows(
+            Prompt.objects.filter(id__in=pk_set), ChangeEvent.Action.UPDATED
+        )
+    if event:
+        event.publish()
+
+
+@receiver(m2m_changed, sender=Prompt.aimodels.through)
+def refresh_effective_prompts(
+    sender, instance, action, reverse, pk_set, **kwargs
+) -> None:
+    """Linking or unlinking AI models changes what the prompts' subtrees inherit."""
+    if not action.startswith('post_'):
+        return
+    if reverse and pk_set is not None:
+        rows = Prompt.objects.filter(id__in=pk_set)
+    else:
+        # A prompt, or an AI model cleared of its prompts, all beneath it
+        rows = type(instance).objects.filter(pk=instance.pk)
+    EffectivePrompt.refresh(*EffectivePrompt.scope(rows))
+
+
+@receiver(m2m_changed, sender=Prompt.aimodels.through)
+def recount_prompts(sender, instance, action, reverse, pk_set, **kwargs) -> None:
+    """Count the prompts of the AI models linked or unlinked again."""
+    if action == 'pre_clear' and not reverse:
+        # Which AI models were cleared can't be told afterwards
+        instance._cleared_aimodel_ids = list(
+            instance.aimodels.values_list('id', flat=True)
+        )
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        ids = [instance.pk]
+    elif action == 'post_clear':
+        ids = instance._cleared_aimodel_ids
+    else:
+        ids = pk_set
+    AIModel.objects.filter(id__in=ids).recount_prompts()
+
+
+@receiver(post_delete, sender=Snapshot)
+def delete_snapshot_file(sender, instance, **kwargs) -> None:
+    """Delete a snapshot's file once the deletion of its row commits."""
+    transaction.on_commit(lambda: instance.path.unlink(missing_ok=True))
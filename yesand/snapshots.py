@@ -0,0 +1,173 @@
+"""
+Reads and writes published snapshots of a directory tree.
+
+A snapshot is a single immutable file: a fixed header, a JSON index and a
+data section holding every prompt's text and every AI model's settings. The
+reader memory-maps the file and only parses the index, so a lookup is a
+dictionary hit and a slice of the mapping, with no database involved.
+
+This module deliberately imports nothing from Django, so services can read
+snapshots with only the standard library:
+
+    with Snapshot('redbox-3.snap') as snapshot:
+        text = snapshot.get_prompt('claude3', 'rag', 'system')
+
+Directories are named by their display path relative to the published
+directory, which is itself ''. Where siblings share a display name, the
+first in tree order wins.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Iterable
+
+MAGIC = b'YESNAP'
+FORMAT_VERSION = 1
+
+# Magic, format version and the length of the JSON index in bytes
+HEADER = struct.Struct('<6sHI')
+
+
+class SnapshotError(ValueError):
+    """Raised when a file isn't a snapshot this module can read."""
+
+
+def write(
+    path: str | os.PathLike,
+    *,
+    metadata: dict,
+    models: Iterable[tuple[str, str, dict]],
+    prompts: Iterable[tuple[str, str, str, list[str]]],
+) -> tuple[str, int]:
+    """
+    Write a snapshot file, which appears atomically once it's complete.
+
+    Published snapshots are immutable, so an existing file is never replaced.
+
+    Args:
+        path: Where to write the snapshot
+        metadata: JSON-serialisable details stored in the index, such as the
+            version and the name of the published directory
+        models: (directory, name, settings) for every AI model
+        prompts: (directory, name, text, model names) for every prompt
+
+    Returns:
+        tuple[str, int]: The SHA-256 hex digest and size of the file
+
+    Raises:
+        FileExistsError: If there's already a file at the path
+    """
+    data = bytearray()
+
+    def append(body: bytes) -> list[int]:
+        start = len(data)
+        data.extend(body)
+        return [start, len(body)]
+
+    index = {
+        **metadata,
+        'models': [
+            [directory, name, *append(json.dumps(settings).encode())]
+            for directory, name, settings in models
+        ],
+        'prompts': [
+            [directory, name, *append(text.encode()), sorted(model_names)]
+            for directory, name, text, model_names in prompts
+        ],
+    }
+    index_bytes = json.dumps(index, separators=(',', ':')).encode()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(index_bytes))
+
+    digest = hashlib.sha256()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+        try:
+            for chunk in (header, index_bytes, data):
+                file.write(chunk)
+                digest.update(chunk)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    try:
+        # Unlike a rename, linking fails rather than replace an existing file
+        os.link(file.name, path)
+    finally:
+        os.unlink(file.name)
+
+    return digest.hexdigest(), len(header) + len(index_bytes) + len(data)
+
+
+class Snapshot:
+    """A memory-mapped, read-only snapshot answering lookups in memory."""
+
+    def __init__(self, path: str | os.PathLike):
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER.size:
+            raise SnapshotError(f'{path} is too short to be a snapshot')
+        magic, format_version, index_length = HEADER.unpack_from(self._map)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise SnapshotError(f'{path} is not a version {FORMAT_VERSION} snapshot')
+
+        start = HEADER.size + index_length
+        index = json.loads(self._map[HEADER.size : start])
+        self._models = {}
+        self._prompts = {}
+        self._lookup = {}
+        for directory, name, offset, length in index.pop('models'):
+            self._models.setdefault((directory, name), (start + offset, length))
+        for directory, name, offset, length, model_names in index.pop('prompts'):
+            location = (start + offset, length)
+            self._prompts.setdefault((directory, name), location)
+            for model in model_names:
+                self._lookup.setdefault((model, directory, name), location)
+        self.metadata = index
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def _read(self, location: tuple[int, int]) -> bytes:
+        offset, length = location
+        return self._map[offset : offset + length]
+
+    def get_prompt(self, model: str, directory: str, prompt: str) -> str:
+        """
+        Return the text of a prompt in a directory that's linked to a model.
+
+        Raises:
+            KeyError: If there's no such prompt, or it isn't linked to the model
+        """
+        return self._read(self._lookup[model, directory, prompt]).decode()
+
+    def get_text(self, directory: str, prompt: str) -> str:
+        """Return the text of a prompt in a directory, whatever it's linked to."""
+        return self._read(self._prompts[directory, prompt]).decode()
+
+    def get_model(self, model: str, directory: str = '') -> dict:
+        """
+        Return the settings of the nearest AI model of this name.
+
+        The directory is searched first, then each of its ancestors, just as
+        prompts can use any AI model above them in the tree.
+
+        Raises:
+            KeyError: If no directory on the way up has the model
+        """
+        parts = directory.split('/') if directory else []
+        for depth in range(len(parts), -1, -1):
+            if location := self._models.get(('/'.join(parts[:depth]), model)):
+                return json.loads(self._read(location))
+        raise KeyError(model)
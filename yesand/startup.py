@@ -0,0 +1,162 @@
+"""
+Gets a process ready to serve before it takes traffic.
+
+Left alone, Django defers most of its start-up work to the first requests a
+worker handles: the URLconf, and with it the GraphQL schema, is imported on
+the first request, and templates are compiled the first time each is
+rendered. warm_up() does all of that up front. Run from the WSGI module
+under gunicorn's --preload it happens once, in the master, and the forked
+workers share the result.
+
+Readiness is separate from liveness: /health/ only says the process is up,
+while /ready/ waits until it's warmed up and the database is migrated.
+"""
+
+import io
+import json
+import logging
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.template import engines
+from django.urls import get_resolver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Requests sent through the app while warming up, to open the first database
+# connection and fill the caches behind the page every session starts on
+WARM_UP_REQUESTS = [
+    ('GET', '/', None),
+    (
+        'POST',
+        '/graphql/',
+        {'query': '{ allPrompts(first: 1) { edges { node { id } } } }'},
+    ),
+]
+
+state = {'warmed': False, 'migrated': False}
+
+
+def warm_up() -> dict[str, float]:
+    """
+    Import, compile and render what the first requests would otherwise wait on.
+
+    Returns:
+        dict[str, float]: Seconds taken by each step
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    # Imports every view, and fills the reverse() lookups
+    get_resolver()._populate()
+    timings['urls'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Graphene's view imports the schema on its first request
+    import_string(settings.GRAPHENE['SCHEMA'])
+    timings['schema'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiled = compile_templates()
+    timings['templates'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    send_warm_up_requests()
+    timings['requests'] = time.perf_counter() - start
+
+    state['warmed'] = True
+    logger.info(
+        'Warmed up in %.2fs (%s templates): %s',
+        sum(timings.values()),
+        compiled,
+        ', '.join(f'{step} {seconds:.2f}s' for step, seconds in timings.items()),
+    )
+    return timings
+
+
+def compile_templates() -> int:
+    """Compile this project's templates into the cached template loader."""
+    compiled = 0
+    for engine in engines.all():
+        for directory in map(Path, engine.template_dirs):
+            if not directory.is_relative_to(settings.BASE_DIR):
+                continue
+            for path in directory.rglob('*.html'):
+                engine.get_template(path.relative_to(directory).as_posix())
+                compiled += 1
+    return compiled
+
+
+def send_warm_up_requests() -> None:
+    """
+    Render the first pages through the app, then drop the connections used.
+
+    A database that isn't there yet only means a colder first request, so
+    failures are logged rather than stopping the server from starting.
+    """
+    host = next(
+        (host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'),
+        'localhost',
+    )
+    handler = WSGIHandler()
+    try:
+        for method, path, data in WARM_UP_REQUESTS:
+            body = json.dumps(data).encode() if data is not None else b''
+            # Sent straight to the handler's middleware and views. Unlike a
+            # server, this sends no request_started or request_finished, and
+            # so doesn't close the database connection between requests
+            request = WSGIRequest(
+                {
+                    'REQUEST_METHOD': method,
+                    'PATH_INFO': path,
+                    'SCRIPT_NAME': '',
+                    'QUERY_STRING': '',
+                    'SERVER_NAME': host,
+                    'SERVER_PORT': '80',
+                    'SERVER_PROTOCOL': 'HTTP/1.1',
+                    'HTTP_HOST': host,
+                    'CONTENT_TYPE': 'application/json',
+                    'CONTENT_LENGTH': str(len(body)),
+                    'wsgi.input': io.BytesIO(body),
+                    'wsgi.url_scheme': 'http',
+                }
+            )
+            response = handler.get_response(request)
+            if response.status_code >= 400:
+                logger.warning(
+                    'Warm-up request to %s returned %s', path, response.status_code
+                )
+        # Remembered by the forked workers, so /ready/ needn't load migrations
+        is_migrated()
+    except Exception:
+        logger.warning('Warm-up requests failed', exc_info=True)
+    finally:
+        # Forked workers mustn't share the master's database sockets
+        connections.close_all()
+
+
+def is_migrated(using: str = DEFAULT_DB_ALIAS) -> bool:
+    """Whether every migration has been applied to the database."""
+    if not state['migrated']:
+        executor = MigrationExecutor(connections[using])
+        targets = executor.loader.graph.leaf_nodes()
+        state['migrated'] = not executor.migration_plan(targets)
+    return state['migrated']
+
+
+def check_readiness() -> str | None:
+    """Why this process can't serve traffic yet, or None when it can."""
+    if settings.WARM_UP and not state['warmed']:
+        return 'warming up'
+    try:
+        connections[DEFAULT_DB_ALIAS].ensure_connection()
+        if not is_migrated():
+            return 'migrations pending'
+    except Exception as e:
+        return f'database unavailable: {e}'
+    return None
@@ -0,0 +1,88 @@
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import BaseFinder, get_finders
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+
+
+class BundleFinder(BaseFinder):
+    """
+    Serve the bundles in STATIC_BUNDLES as if they were ordinary static files.
+
+    Each bundle is its source files, found with the other finders, joined in
+    order. Because it's a finder, runserver and collectstatic both see the
+    bundle, and the static storage fingerprints and compresses it like any
+    other file. A bundle is only rebuilt when one of its sources has changed
+    since it was written, or it was last built from other sources.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.location = Path(tempfile.gettempdir()) / 'yesand-bundles'
+        self.storage = FileSystemStorage(location=self.location)
+        # The sources each bundle was built from by this process
+        self.built: dict[str, tuple[Path, ...]] = {}
+
+    def check(self, **kwargs) -> list:
+        return []
+
+    def find(
+        self,
+        path: str,
+        all: bool = False,  # noqa: A002 (matches BaseFinder)
+        **kwargs,
+    ) -> str | list[str] | None:
+        """Return the bundle at path, built if it's stale, if there is one."""
+        if path not in settings.STATIC_BUNDLES:
+            return [] if all else None
+        bundle = str(self._build(path))
+        return [bundle] if all else bundle
+
+    def list(self, ignore_patterns):
+        """Build every bundle for collectstatic."""
+        for path in settings.STATIC_BUNDLES:
+            self._build(path)
+            yield path, self.storage
+
+    def _build(self, path: str) -> Path:
+        """Join a bundle's sources into a file beneath self.location, if stale."""
+        sources = self._find_sources(path)
+        bundle = self.location / path
+        if self.built.get(path) == sources and bundle.exists():
+            built_at = bundle.stat().st_mtime
+            if all(source.stat().st_mtime <= built_at for source in sources):
+                return bundle
+
+        # Separate scripts with a semicolon in case one omits its last one
+        separator = b';\n' if path.endswith('.js') else b'\n'
+        contents = [source.read_bytes().rstrip() for source in sources]
+        bundle.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and moved into place, so it's never read half written
+        partial = bundle.with_name(f'.{bundle.name}.{os.getpid()}')
+        partial.write_bytes(separator.join(contents) + b'\n')
+        partial.replace(bundle)
+        self.built[path] = sources
+        return bundle
+
+    def _find_sources(self, path: str) -> tuple[Path, ...]:
+        """A bundle's source files, found with the other finders."""
+        sources = []
+        for source in settings.STATIC_BUNDLES[path]:
+            found = next(
+                (
+                    found
+                    for finder in get_finders()
+                    if not isinstance(finder, BundleFinder)
+                    and (found := finder.find(source))
+                ),
+                None,
+            )
+            if found is None:
+                raise ImproperlyConfigured(
+                    f'Static bundle {path} includes {source}, which was not found'
+                )
+            sources.append(Path(found))
+        return tuple(sources)
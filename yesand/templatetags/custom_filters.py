@@ -1,4 +1,10 @@
+import re
+from functools import lru_cache
+
 from django import template
+from django.conf import settings
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
 
 register = template.Library()
 
@@ -19,3 +25,40 @@ def model_verbose_name(form):
 def model_name(form):
     """Return the model name from a form."""
     return form._meta.model._meta.model_name
+
+
+@lru_cache
+def _icon_body(name: str) -> str:
+    """The shapes inside a vendored Bootstrap icon's <svg> element."""
+    svg = (settings.BS_ICONS_BASE_PATH / 'icons' / f'{name}.svg').read_text()
+    return re.search(r'<svg[^>]*>(.*)</svg>', svg, re.DOTALL)[1].strip()
+
+
+@register.simple_tag
+def icon_symbols(*names: str) -> str:
+    """Define Bootstrap icons once per page, for the icon tag to reference."""
+    return format_html(
+        '<svg xmlns="http://www.w3.org/2000/svg" class="d-none">{}</svg>',
+        format_html_join(
+            '',
+            '<symbol id="bi-{}" viewBox="0 0 16 16">{}</symbol>',
+            ((name, mark_safe(_icon_body(name))) for name in names),
+        ),
+    )
+
+
+@register.simple_tag
+def icon(name: str, extra_classes: str = '') -> str:
+    """
+    Reference an icon defined by icon_symbols.
+
+    A fraction of the size of bs_icon's inline copy, for markup repeated on
+    every row of the sidebar.
+    """
+    return format_html(
+        '<svg class="bi bi-{} {}" width="16" height="16" fill="currentColor">'
+        '<use href="#bi-{}"></use></svg>',
+        name,
+        extra_classes,
+        name,
+    )
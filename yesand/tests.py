@@ -1,7 +1,33 @@
+import io
+import json
+import tempfile
+from datetime import timedelta
 from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
 
-from django.test import Client, TestCase
+from django.test import (
+    Client,
+    LiveServerTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
 from django.urls import reverse
+from django.utils import timezone
+
+from . import events, startup
+from .models import (
+    AIModel,
+    APIKey,
+    ChangeEvent,
+    DirNode,
+    EffectivePrompt,
+    Job,
+    Prompt,
+    Snapshot,
+)
 
 
 class HealthCheckTests(TestCase):
@@ -33,3 +59,2080 @@ class HealthCheckTests(TestCase):
         """Test that Django admin interface is accessible."""
         response = self.client.get('/admin/login/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+@override_settings(WARM_UP=True)
+class StartupTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(startup.state, {'warmed': False, 'migrated': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ready_once_warmed_up(self):
+        """Test /ready/ refuses traffic until the process has warmed up."""
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()['reason'], 'warming up')
+
+        # Closing connections would end the test's transaction
+        with (
+            mock.patch.object(startup.connections, 'close_all') as close_all,
+            self.assertNoLogs('yesand.startup', 'WARNING'),
+        ):
+            timings = startup.warm_up()
+        close_all.assert_called_once()
+        self.assertEqual(set(timings), {'urls', 'schema', 'templates', 'requests'})
+
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json(), {'status': 'ready'})
+
+    def test_not_ready_with_pending_migrations(self):
+        """Test /ready/ refuses traffic until the database is migrated."""
+        startup.state['warmed'] = True
+        with mock.patch(
+            'yesand.startup.MigrationExecutor.migration_plan',
+            return_value=[('migration', False)],
+        ):
+            response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()['reason'], 'migrations pending')
+
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class MoveDirNodeTests(TestCase):
+    def test_locks_the_parent_it_moves_from(self):
+        """Test that a move locks the parent again if it changed meanwhile."""
+        first = DirNode.add_root(display='first')
+        second = DirNode.add_root(display='second')
+        target = DirNode.add_root(display='target')
+        node = first.add_child(display='rag')
+        lock_children = DirNode._lock_children
+        locked = []
+
+        def lock_and_move_away(*parent_ids):
+            locked.append(set(parent_ids))
+            if len(locked) == 1:
+                # Another write moves the node before these locks are held
+                DirNode.objects.get(id=node.id).move(second, 'sorted-child')
+            lock_children(*parent_ids)
+
+        with mock.patch.object(DirNode, '_lock_children', lock_and_move_away):
+            node.move(target, 'sorted-child')
+
+        self.assertIn(first.id, locked[0])
+        self.assertIn(second.id, locked[-1])
+        self.assertNotIn(first.id, locked[-1])
+        self.assertEqual(DirNode.objects.get(id=node.id).get_parent().id, target.id)
+
+
+class DeleteDirNodeTests(TestCase):
+    def setUp(self):
+        """Set up a small project with a nested directory."""
+        self.root = DirNode.add_root(display='redbox')
+        self.child = self.root.add_child(display='rag')
+        self.aimodel = AIModel.objects.create(display='claude3', dirnode=self.root)
+        self.prompt = Prompt.objects.create(
+            display='system', text='Be helpful.', dirnode=self.child
+        )
+        self.prompt.aimodels.add(self.aimodel)
+
+    def test_delete_tombstones_subtree(self):
+        """Test that deleting a directory hides it without removing rows."""
+        response = self.client.post(
+            reverse('modal_with_node', args=['dirnode', 'delete', self.root.id])
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(DirNode.objects.alive().exists())
+        self.assertFalse(Prompt.objects.alive().exists())
+        self.assertEqual(Prompt.objects.count(), 1)
+
+        response = self.client.get(
+            reverse('get_content', args=['prompt', self.prompt.id])
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_restore(self):
+        """Test that a tombstoned subtree comes back whole."""
+        self.root.tombstone()
+
+        with self.assertRaises(ValueError):
+            DirNode.objects.get(id=self.child.id).restore()
+
+        self.assertEqual(self.root.restore(), 2)
+        self.assertEqual(DirNode.objects.alive().count(), 2)
+        self.assertEqual(Prompt.objects.alive().count(), 1)
+
+    def test_purge_in_batches(self):
+        """Test that purging removes the subtree and fixes the parent."""
+        self.child.tombstone()
+
+        purged = DirNode.purge_deleted(batch_size=1)
+
+        self.assertEqual(purged, 3)
+        self.assertFalse(DirNode.objects.filter(id=self.child.id).exists())
+        self.assertFalse(Prompt.objects.exists())
+        self.assertEqual(DirNode.objects.get(id=self.root.id).numchild, 0)
+        self.assertEqual(DirNode.purge_deleted(), 0)
+
+
+class TargetSearchTests(TestCase):
+    def setUp(self):
+        """Set up two projects with a nested directory each."""
+        self.redbox = DirNode.add_root(display='redbox')
+        self.rag = self.redbox.add_child(display='rag')
+        self.other = DirNode.add_root(display='other')
+        self.other.add_child(display='rag')
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_targets'), params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [node.id for node in response.context['targets']]
+
+    def test_search_by_name_excludes_own_subtree(self):
+        """Test that a directory can't be moved beneath itself."""
+        results = self.search(q='r', node_type='dirnode', node_id=self.redbox.id)
+
+        self.assertNotIn(self.redbox.id, results)
+        self.assertNotIn(self.rag.id, results)
+        self.assertEqual(len(results), 2)
+
+    def test_search_by_path_prefix(self):
+        """Test that a slash-separated search resolves display paths."""
+        self.assertEqual(self.search(q='redbox/ra'), [self.rag.id])
+        self.assertEqual(self.search(q='redbox/'), [self.rag.id])
+
+    def test_invalid_node_id(self):
+        """Test that a node id that isn't a number is not found."""
+        response = self.client.get(reverse('search_targets'), {'node_id': 'abc'})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_move_rejects_excluded_target(self):
+        """Test that posting a target from the node's own subtree fails."""
+        response = self.client.post(
+            reverse('modal_with_node', args=['dirnode', 'move', self.redbox.id]),
+            {'target_id': self.rag.id},
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.UNPROCESSABLE_ENTITY)
+        rag = DirNode.objects.get(id=self.rag.id)
+        self.assertEqual(rag.get_parent().id, self.redbox.id)
+
+
+class ContentBreadcrumbTests(TestCase):
+    def setUp(self):
+        """Set up a prompt two directories deep."""
+        self.root = DirNode.add_root(display='redbox')
+        self.child = self.root.add_child(display='rag')
+        self.prompt = Prompt.objects.create(
+            display='system', text='Be helpful.', dirnode=self.child
+        )
+
+    def test_content_includes_breadcrumb(self):
+        """Test that content responses carry the breadcrumb out of band."""
+        # The data version, the prompt, its AI models and the breadcrumb
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                reverse('get_content', args=['prompt', self.prompt.id])
+            )
+
+        self.assertContains(response, 'hx-swap-oob')
+        breadcrumb = response.content.decode().split('id="breadcrumb"')[1]
+        self.assertLess(breadcrumb.index('redbox'), breadcrumb.index('rag'))
+        self.assertIn('system', breadcrumb)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        """Set up a directory with enough contents to be worth compressing."""
+        self.root = DirNode.add_root(display='redbox')
+        for i in range(20):
+            self.root.add_child(display=f'project {i}')
+
+    def test_unchanged_fragment_is_not_modified(self):
+        """Test that a matching ETag returns 304 without rendering."""
+        url = reverse('get_filesystem')
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+        self.root.add_child(display='new')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'new')
+
+    def test_large_fragment_is_compressed(self):
+        """Test that the filesystem is gzipped when the client accepts it."""
+        response = self.client.get(
+            reverse('get_filesystem'), HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_graphql_get_is_conditional(self):
+        """Test that GraphQL queries sent by GET are revalidated by ETag."""
+        url = reverse('api') + '?query={allDirnodes{edges{node{display}}}}'
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+        response = self.client.get(
+            url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_etag_is_per_client(self):
+        """Test that users' and keys' responses have their own private ETags."""
+        from django.contrib.auth.models import User
+
+        url = reverse('api') + '?query={allDirnodes{edges{node{display}}}}'
+        anonymous = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertNotIn('private', anonymous['Cache-Control'])
+
+        _, key = APIKey.generate('rag service', self.root)
+        scoped = self.client.get(
+            url, HTTP_ACCEPT='application/json', HTTP_AUTHORIZATION=f'Bearer {key}'
+        )
+        self.assertNotEqual(scoped['ETag'], anonymous['ETag'])
+        self.assertIn('private', scoped['Cache-Control'])
+        response = self.client.get(
+            url,
+            HTTP_ACCEPT='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {key}',
+            HTTP_IF_NONE_MATCH=anonymous['ETag'],
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+        self.client.force_login(User.objects.create_user('service'))
+        response = self.client.get(reverse('get_filesystem'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get(
+            url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=scoped['ETag']
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_modal_forms_have_no_etag(self):
+        """Test that modal forms, which hold a CSRF token, aren't revalidated."""
+        response = self.client.get(
+            reverse('get_content', args=['dirnode', self.root.id]),
+            {'action': 'rename'},
+        )
+
+        self.assertFalse(response.has_header('ETag'))
+
+
+class SidebarTests(TestCase):
+    def setUp(self):
+        """Set up two projects, one with a directory, an AI model and a prompt."""
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        self.other = DirNode.add_root(display='zephyr')
+        AIModel.objects.create(display='claude3', dirnode=self.rag)
+        self.prompt = Prompt.objects.create(
+            display='system', text='Be helpful.', dirnode=self.rag
+        )
+
+    def post(self, node_type, action, node_id=None, **data):
+        if node_id is None:
+            url = reverse('modal_no_node', args=[node_type, action])
+        else:
+            url = reverse('modal_with_node', args=[node_type, action, node_id])
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(response.has_header('HX-Trigger'))
+        self.assertNotContains(response, 'dirnode-children-root')
+        return response
+
+    def test_filesystem_queries(self):
+        """Test that the whole tree is rendered in the same few queries."""
+        for i in range(5):
+            child = self.rag.add_child(display=f'child {i}')
+            Prompt.objects.create(display=f'prompt {i}', text='Hi.', dirnode=child)
+
+        # The data version, the directories and their items
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('get_filesystem'))
+        self.assertContains(response, 'prompt 4')
+        self.assertContains(response, f'id="dirnode-children-{self.rag.id}"')
+        self.assertContains(response, '6 prompts and 1 AI model in this directory')
+
+    def test_rename_prompt(self):
+        """Test that renaming a prompt only swaps its directory's items."""
+        response = self.post('prompt', 'rename', self.prompt.id, display='user')
+
+        self.assertContains(
+            response, f'id="dirnode-items-{self.rag.id}"\n     hx-swap-oob="true"'
+        )
+        self.assertContains(response, 'claude3')
+        self.assertNotContains(response, f'id="dirnode-row-{self.rag.id}"')
+
+    def test_rename_directory(self):
+        """Test that renaming a directory only swaps its own row."""
+        response = self.post('dirnode', 'rename', self.rag.id, display='retrieval')
+
+        self.assertContains(response, f'id="dirnode-row-{self.rag.id}"')
+        self.assertNotContains(response, f'id="dirnode-items-{self.rag.id}"')
+
+    def test_add_directory(self):
+        """Test that a new directory goes before the sibling sorted after it."""
+        response = self.post('dirnode', 'add', display='alpha')
+        self.assertContains(
+            response, f'hx-swap-oob="beforebegin:#dirnode-{self.project.id}"'
+        )
+
+        response = self.post(
+            'dirnode', 'add', display='zulu', parent_id=self.project.id
+        )
+        self.assertContains(
+            response, f'hx-swap-oob="beforeend:#dirnode-children-{self.project.id}"'
+        )
+
+    def test_move_directory(self):
+        """Test that a moved directory leaves its parent and joins the target."""
+        response = self.post('dirnode', 'move', self.rag.id, target_id=self.other.id)
+
+        self.assertContains(
+            response, f'<div id="dirnode-{self.rag.id}" hx-swap-oob="delete">'
+        )
+        self.assertContains(
+            response, f'hx-swap-oob="beforeend:#dirnode-children-{self.other.id}"'
+        )
+        self.assertContains(response, 'system')
+
+    def test_move_prompt(self):
+        """Test that a moved prompt swaps both directories' items."""
+        response = self.post('prompt', 'move', self.prompt.id, target_id=self.other.id)
+
+        self.assertContains(response, f'id="dirnode-items-{self.rag.id}"')
+        self.assertContains(response, f'id="dirnode-items-{self.other.id}"')
+
+    def test_add_prompt_counts(self):
+        """Test that adding a prompt swaps the rows of its directory's ancestors."""
+        response = self.post(
+            'prompt', 'add', display='user', text='Hi.', parent_id=self.rag.id
+        )
+
+        self.assertContains(response, f'id="dirnode-row-{self.project.id}"')
+        self.assertContains(response, f'id="dirnode-row-{self.rag.id}"')
+        self.assertContains(response, '2 prompts and 1 AI model in this directory')
+        self.assertNotContains(response, f'id="dirnode-row-{self.other.id}"')
+
+    def test_edit_prompt(self):
+        """Test that editing a prompt's text leaves the sidebar alone."""
+        url = reverse('edit_node', args=['prompt', self.prompt.id])
+        response = self.client.post(url, {'display': 'system', 'text': 'Be brief.'})
+        self.assertNotContains(response, 'hx-swap-oob')
+
+        response = self.client.post(url, {'display': 'user', 'text': 'Be brief.'})
+        self.assertContains(response, f'id="dirnode-items-{self.rag.id}"')
+
+    def test_menu(self):
+        """Test that menus are fetched on their own, and only for sidebar nodes."""
+        response = self.client.get(reverse('get_menu', args=['prompt', 1]))
+        self.assertContains(response, 'Rename')
+        self.assertNotContains(response, 'dropdown-menu')
+
+        response = self.client.get(reverse('get_menu', args=['job', 1]))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        """Set up a superuser and a project with an AI model at each level."""
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        self.other = DirNode.add_root(display='zephyr')
+        self.shared = AIModel.objects.create(display='shared', dirnode=self.project)
+        self.local = AIModel.objects.create(display='local', dirnode=self.rag)
+
+    def add_prompts(self, count):
+        for i in range(count):
+            prompt = Prompt.objects.create(
+                display=f'prompt {i}', text='Hi.', dirnode=self.rag
+            )
+            prompt.aimodels.add(self.shared, self.local)
+
+    def count_queries(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return len(queries)
+
+    def test_changelist_queries(self):
+        """Test that list pages make the same queries however many rows."""
+        url = reverse('admin:yesand_prompt_changelist')
+        self.add_prompts(2)
+        self.count_queries(url)
+        few = self.count_queries(url)
+        self.add_prompts(10)
+        self.assertEqual(self.count_queries(url), few)
+
+        url = reverse('admin:yesand_dirnode_changelist')
+        few = self.count_queries(url)
+        for i in range(5):
+            self.rag.add_child(display=f'child {i}')
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_move_prompts(self):
+        """Test that moving prompts unlinks AI models the target can't see."""
+        self.add_prompts(3)
+        prompts = Prompt.objects.filter(dirnode=self.rag)
+        response = self.client.post(
+            reverse('admin:yesand_prompt_changelist'),
+            {
+                'action': 'move_prompts',
+                '_selected_action': list(prompts.values_list('id', flat=True)),
+                'directory': self.project.id,
+            },
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(Prompt.objects.filter(dirnode=self.project).count(), 3)
+        self.assertEqual(self.shared.prompts.count(), 3)
+        self.assertEqual(self.local.prompts.count(), 0)
+        self.local.refresh_from_db()
+        self.assertEqual(self.local.prompt_count, 0)
+        self.shared.refresh_from_db()
+        self.assertEqual(self.shared.prompt_count, 3)
+
+    def test_clear_aimodels(self):
+        """Test that unlinking AI models recounts their prompts."""
+        self.add_prompts(2)
+        prompt = Prompt.objects.first()
+        response = self.client.post(
+            reverse('admin:yesand_prompt_changelist'),
+            {'action': 'clear_aimodels', '_selected_action': [prompt.id]},
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertFalse(prompt.aimodels.exists())
+        for aimodel in (self.shared, self.local):
+            aimodel.refresh_from_db()
+            self.assertEqual(aimodel.prompt_count, 1)
+
+
+class PromptMetadataTests(TestCase):
+    def setUp(self):
+        """Set up a directory for prompts."""
+        self.root = DirNode.add_root(display='redbox')
+
+    def test_save_computes_metadata(self):
+        """Test that saving a prompt stores its length, tokens and hash."""
+        prompt = Prompt.objects.create(
+            display='system', text='Be helpful.', dirnode=self.root
+        )
+
+        self.assertEqual(prompt.length, 11)
+        self.assertEqual(prompt.token_count, 4)
+        self.assertEqual(len(prompt.content_hash), 64)
+
+        prompt.text = 'Be helpful and concise.'
+        prompt.save(update_fields=['text'])
+        prompt.refresh_from_db()
+        self.assertEqual(prompt.length, 23)
+
+    def test_bulk_paths_compute_metadata(self):
+        """Test that bulk creates and updates keep the metadata in step."""
+        Prompt.objects.bulk_create(
+            [Prompt(display='a', text='one', dirnode=self.root, type_order=3)]
+        )
+        self.assertEqual(Prompt.objects.get().length, 3)
+
+        Prompt.objects.update(text='three')
+        self.assertEqual(Prompt.objects.get().length, 5)
+
+    def test_backfill_command(self):
+        """Test that the backfill command fills in existing rows."""
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        prompt = Prompt.objects.create(display='a', text='text', dirnode=self.root)
+        Prompt.objects.filter(id=prompt.id).update(length=0)
+
+        call_command('backfill_prompt_metadata', missing_only=True, stdout=StringIO())
+
+        prompt.refresh_from_db()
+        self.assertEqual(prompt.length, 4)
+
+    def test_graphql_filters_and_orders_by_metadata(self):
+        """Test that allPrompts filters and sorts on the metadata columns."""
+        for display, text in [
+            ('short', 'Hi.'),
+            ('long', 'Hello ' * 10),
+            ('mid', 'Hi there'),
+        ]:
+            Prompt.objects.create(display=display, text=text, dirnode=self.root)
+
+        response = self.client.post(
+            reverse('api'),
+            {
+                'query': '{allPrompts(length_Gt: 3, orderBy: "-token_count")'
+                '{edges{node{display length tokenCount contentHash}}}}'
+            },
+            content_type='application/json',
+        )
+
+        nodes = [e['node'] for e in response.json()['data']['allPrompts']['edges']]
+        self.assertEqual([node['display'] for node in nodes], ['long', 'mid'])
+        self.assertEqual(nodes[0]['length'], 60)
+
+
+class PromptBlobTests(TestCase):
+    def setUp(self):
+        """Set up two prompts with the same text."""
+        self.root = DirNode.add_root(display='redbox')
+        self.first = Prompt.objects.create(
+            display='first', text='Be helpful.', dirnode=self.root
+        )
+        self.second = Prompt.objects.create(
+            display='second', text='Be helpful.', dirnode=self.root
+        )
+
+    def test_identical_text_is_stored_once(self):
+        """Test that prompts with the same text share one blob."""
+        from .models import PromptBlob
+
+        self.assertEqual(PromptBlob.objects.count(), 1)
+        self.assertEqual(self.first.blob_id, self.second.blob_id)
+        self.assertEqual(Prompt.objects.get(id=self.second.id).text, 'Be helpful.')
+
+    def test_copy_is_a_pointer_copy(self):
+        """Test that copying a prompt doesn't write its text again."""
+        target = DirNode.add_root(display='copy')
+
+        response = self.client.post(
+            reverse('modal_with_node', args=['prompt', 'copy', self.first.id]),
+            {'target_id': target.id},
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        copy = Prompt.objects.get(dirnode=target)
+        self.assertEqual(copy.blob_id, self.first.blob_id)
+        self.assertEqual(copy.text, 'Be helpful.')
+
+    def test_unreferenced_blobs_are_collected(self):
+        """Test that garbage collection only removes orphaned text."""
+        from .models import PromptBlob
+
+        self.first.text = 'Be brief.'
+        self.first.save()
+        self.second.delete()
+        # Just stored text is kept for a prompt that may be about to use it
+        self.assertEqual(PromptBlob.collect_garbage(), 0)
+
+        PromptBlob.objects.update(stored_at=timezone.now() - timedelta(days=1))
+        PromptBlob.store('Be helpful.')
+        self.assertEqual(PromptBlob.collect_garbage(), 0)
+
+        PromptBlob.objects.update(stored_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(PromptBlob.collect_garbage(), 1)
+        self.assertEqual(
+            list(PromptBlob.objects.values_list('text', flat=True)), ['Be brief.']
+        )
+
+    def test_update_text_must_be_str(self):
+        """Test that text can't be updated to an expression or other value."""
+        from django.db.models import F
+
+        for text in (F('display'), None, 1):
+            with self.assertRaisesMessage(TypeError, 'must be updated to a str'):
+                Prompt.objects.update(text=text)
+        self.assertEqual(Prompt.objects.filter(blob_id=self.first.blob_id).count(), 2)
+
+    def test_edit_form_checkboxes(self):
+        """Test that the edit form keeps its text and checkbox styling."""
+        from .forms import EditPromptForm
+
+        AIModel.objects.create(display='claude3', dirnode=self.root)
+        form = EditPromptForm(instance=self.first)
+
+        self.assertEqual(form.initial['text'], 'Be helpful.')
+        self.assertIn('class="form-check-input"', str(form['aimodels']))
+
+    def test_graphql_text_is_unchanged(self):
+        """Test that the API still reads and filters prompt text."""
+        response = self.client.post(
+            reverse('api'),
+            {'query': '{allPrompts(text_Icontains: "helpful"){edges{node{text}}}}'},
+            content_type='application/json',
+        )
+
+        edges = response.json()['data']['allPrompts']['edges']
+        self.assertEqual([e['node']['text'] for e in edges], ['Be helpful.'] * 2)
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        """Set up a project with a subdirectory and a prompt to copy."""
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        Prompt.objects.create(display='system', text='Be helpful.', dirnode=self.rag)
+        self.target = DirNode.add_root(display='archive')
+
+    def test_directory_copy_is_queued(self):
+        """Test that copying a directory returns at once and a worker does it."""
+        from . import jobs
+
+        response = self.client.post(
+            reverse('modal_with_node', args=['dirnode', 'copy', self.project.id]),
+            {'target_id': self.target.id},
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'hx-swap-oob="beforeend:#jobs"')
+        self.assertEqual(DirNode.objects.count(), 3)
+
+        job = jobs.claim('test')
+        jobs.run(job)
+
+        self.assertEqual(job.status, Job.Status.SUCCEEDED)
+        self.assertEqual((job.progress, job.total), (3, 3))
+        copy = DirNode.objects.get(id=job.result['dirnode_id'])
+        self.assertEqual(copy.get_parent().id, self.target.id)
+        self.assertEqual(
+            Prompt.objects.get(dirnode__path__startswith=copy.path).text, 'Be helpful.'
+        )
+
+        response = self.client.get(reverse('job_progress', args=[job.id]))
+        self.assertEqual(response['HX-Trigger'], 'filesystemChanged')
+        self.assertNotContains(response, 'hx-trigger="every')
+
+    def test_cancelled_copy_is_tombstoned(self):
+        """Test that cancelling a running copy hides what was copied."""
+        from . import jobs
+
+        job = jobs.enqueue('copy_directory', node_id=self.project.id)
+        job = jobs.claim('test')
+        job.cancel()
+        jobs.run(job)
+
+        self.assertEqual(job.status, Job.Status.CANCELLED)
+        self.assertEqual(DirNode.objects.alive().count(), 3)
+        # Purged once the grace period is over
+        purge = Job.objects.get(name='purge_deleted')
+        self.assertGreater(purge.run_after, timezone.now())
+
+        Job.objects.filter(id=purge.id).update(run_after=timezone.now())
+        with override_settings(DELETION_GRACE_PERIOD=0):
+            jobs.run(jobs.claim('test'))
+        self.assertEqual(DirNode.objects.count(), 3)
+
+    def test_failed_job_is_retried(self):
+        """Test that a failing job is queued again until out of attempts."""
+        from . import jobs
+
+        job = jobs.enqueue('copy_directory', node_id=0)
+        job.max_attempts = 2
+        job.save()
+
+        for status in (Job.Status.QUEUED, Job.Status.FAILED):
+            Job.objects.filter(id=job.id).update(run_after=job.created_at)
+            job = jobs.claim('test')
+            with self.assertLogs('yesand.jobs', 'ERROR'):
+                jobs.run(job)
+            self.assertEqual(job.status, status)
+        self.assertIn('DoesNotExist', job.error)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        """Set up a project with a keyed model, a prompt and a snapshot root."""
+        from cryptography.fernet import Fernet
+
+        key = Fernet.generate_key().decode()
+        self.enterContext(mock.patch.dict('os.environ', ENCRYPTION_KEY=key))
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        claude = AIModel(
+            display='claude3',
+            endpoint='https://example.com',
+            parameters={'temperature': 0},
+            dirnode=self.project,
+        )
+        claude.key = 'secret'
+        claude.save()
+        prompt = Prompt.objects.create(
+            display='system', text='Be helpful.', dirnode=self.rag
+        )
+        prompt.aimodels.add(claude)
+
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.enterContext(override_settings(SNAPSHOT_ROOT=root.name))
+
+    def test_publish_is_queued(self):
+        """Test that publishing from the modal runs as a job."""
+        from . import jobs
+
+        response = self.client.post(
+            reverse('modal_with_node', args=['dirnode', 'publish', self.project.id])
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'hx-swap-oob="beforeend:#jobs"')
+
+        job = jobs.claim('test')
+        jobs.run(job)
+
+        self.assertEqual(job.status, Job.Status.SUCCEEDED)
+        snapshot = Snapshot.objects.get(id=job.result['snapshot_id'])
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(job.result['url'], f'/snapshots/{self.project.id}/1/')
+
+    def test_snapshot_lookups(self):
+        """Test that a snapshot answers lookups without the database."""
+        from .snapshots import Snapshot as SnapshotFile
+
+        snapshot = Snapshot.publish(self.project)
+
+        with (
+            self.assertNumQueries(0),
+            SnapshotFile(snapshot.path) as snapshot_file,
+        ):
+            self.assertEqual(
+                snapshot_file.get_prompt('claude3', 'rag', 'system'), 'Be helpful.'
+            )
+            self.assertEqual(
+                snapshot_file.get_model('claude3', 'rag'),
+                {'endpoint': 'https://example.com', 'parameters': {'temperature': 0}},
+            )
+            self.assertEqual(snapshot_file.metadata['directory'], 'redbox')
+            with self.assertRaises(KeyError):
+                snapshot_file.get_prompt('gpt4', 'rag', 'system')
+        self.assertNotIn(b'secret', snapshot.path.read_bytes())
+
+    def test_snapshot_download_is_immutable(self):
+        """Test that versions are cached forever and latest redirects."""
+        Snapshot.publish(self.project)
+        snapshot = Snapshot.publish(self.project)
+        url = reverse('get_snapshot', args=[self.project.id, 2])
+
+        response = self.client.get(
+            reverse('get_latest_snapshot', args=[self.project.id])
+        )
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response.getvalue(), snapshot.path.read_bytes())
+
+        response = self.client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_published_files_are_never_replaced(self):
+        """Test that versions taken by files are skipped."""
+        from django.conf import settings
+
+        # Left by a deleted directory that had the same id
+        stray = Path(settings.SNAPSHOT_ROOT) / f'{self.project.id}-1.snap'
+        stray.write_bytes(b'published')
+
+        snapshot = Snapshot.publish(self.project)
+
+        self.assertEqual(snapshot.version, 2)
+        self.assertEqual(stray.read_bytes(), b'published')
+        self.assertEqual(Snapshot.objects.filter(dirnode=self.project).count(), 1)
+        self.assertEqual(len(list(stray.parent.iterdir())), 2)
+
+    def test_snapshots_are_purged_with_their_directory(self):
+        """Test that purging a directory deletes its snapshots and their files."""
+        kept = Snapshot.publish(self.project)
+        purged = Snapshot.publish(self.rag)
+        self.rag.tombstone()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DirNode.purge_deleted()
+
+        self.assertFalse(Snapshot.objects.filter(id=purged.id).exists())
+        self.assertFalse(purged.path.exists())
+        self.assertTrue(kept.path.exists())
+
+
+class GraphQLCacheTests(TestCase):
+    QUERY = '{allPrompts(directory: "redbox"){edges{node{display text}}}}'
+
+    def setUp(self):
+        """Set up a project with a prompt, and empty the shared cache."""
+        from django.core.cache import cache
+
+        cache.clear()
+        self.project = DirNode.add_root(display='redbox')
+        Prompt.objects.create(
+            display='system', text='Be helpful.', dirnode=self.project
+        )
+
+    def query(self, query=QUERY, **headers):
+        return self.client.post(
+            reverse('api'), {'query': query}, content_type='application/json', **headers
+        )
+
+    def test_repeated_query_is_cached(self):
+        """Test that a repeat of a query, however formatted, isn't executed."""
+        response = self.query()
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(1):
+            response = self.query(
+                '# Redbox prompts\n{ allPrompts(directory: "redbox") '
+                '{ edges { node { display text } } } }'
+            )
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(
+            response.json()['data']['allPrompts']['edges'][0]['node']['text'],
+            'Be helpful.',
+        )
+
+    def test_write_invalidates(self):
+        """Test that a write is visible to the next query."""
+        self.query()
+        Prompt.objects.create(display='question', text='Why?', dirnode=self.project)
+
+        response = self.query()
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['data']['allPrompts']['edges']), 2)
+
+    def test_opt_outs(self):
+        """Test that excluded operations and no-cache bypass the cache."""
+        self.assertEqual(self.query(HTTP_CACHE_CONTROL='no-cache')['X-Cache'], 'BYPASS')
+        with self.settings(GRAPHQL_CACHE_EXCLUDE=['Prompts']):
+            response = self.query('query Prompts ' + self.QUERY)
+        self.assertEqual(response['X-Cache'], 'BYPASS')
+
+    def test_scopes(self):
+        """Test that keys share by directory, and users only cache with opt-in."""
+        from django.contrib.auth.models import User
+
+        query = '{allAimodels{edges{node{display apiKey}}}}'
+        _, key = APIKey.generate('rag service', self.project)
+        _, other_key = APIKey.generate('chat service', self.project)
+        self.assertEqual(
+            self.query(query, HTTP_AUTHORIZATION=f'Bearer {key}')['X-Cache'], 'MISS'
+        )
+        self.assertEqual(
+            self.query(query, HTTP_AUTHORIZATION=f'Bearer {other_key}')['X-Cache'],
+            'HIT',
+        )
+        self.assertEqual(self.query(query)['X-Cache'], 'MISS')
+
+        user = User.objects.create_user('service')
+        self.client.force_login(user)
+        self.assertEqual(self.query(query)['X-Cache'], 'BYPASS')
+        with self.settings(GRAPHQL_CACHE_USERS=True):
+            self.assertEqual(self.query(query)['X-Cache'], 'MISS')
+            self.assertEqual(self.query(query)['X-Cache'], 'HIT')
+            self.client.force_login(User.objects.create_user('other'))
+            self.assertEqual(self.query(query)['X-Cache'], 'MISS')
+
+    def test_metrics(self):
+        """Test that hits, misses and bypasses are counted."""
+        self.query()
+        self.query()
+        self.query(HTTP_CACHE_CONTROL='no-cache')
+
+        with self.settings(METRICS_TOKEN='scrape'):
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape'
+            )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        for line in [
+            'graphql_cache_hits_total 1',
+            'graphql_cache_misses_total 1',
+            'graphql_cache_bypasses_total 1',
+        ]:
+            self.assertContains(response, line)
+
+    def test_metrics_are_private(self):
+        """Test that only staff and the metrics token can read the metrics."""
+        from django.contrib.auth.models import User
+
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(
+            self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code,
+            HTTPStatus.UNAUTHORIZED,
+        )
+        with self.settings(METRICS_TOKEN='scrape'):
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer guess')
+            self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+        self.client.force_login(User.objects.create_user('service'))
+        self.assertEqual(self.client.get(url).status_code, HTTPStatus.UNAUTHORIZED)
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, HTTPStatus.OK)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        """Set up a directory with prompts sharing display names."""
+        self.root = DirNode.add_root(display='root')
+        Prompt.objects.bulk_create(
+            Prompt(display=f'prompt {i % 5}', text=str(i), dirnode=self.root)
+            for i in range(12)
+        )
+
+    def query(self, arguments, fields='edges{node{text}cursor}'):
+        response = self.client.post(
+            reverse('api'),
+            {
+                'query': f'{{allPrompts({arguments}){{{fields} '
+                'pageInfo{hasNextPage hasPreviousPage endCursor startCursor}}}'
+            },
+            content_type='application/json',
+            HTTP_CACHE_CONTROL='no-cache',
+        )
+        return response.json()['data']['allPrompts']
+
+    def test_pages_follow_cursors(self):
+        """Test that paging forwards and back visits every node once, in order."""
+        prompts = Prompt.objects.order_by('display', 'id')
+        expected = list(prompts.values_list('blob__text', flat=True))
+
+        texts, after = [], ''
+        while True:
+            with self.assertNumQueries(1):
+                page = self.query(f'first: 5, after: "{after}"')
+            texts += [edge['node']['text'] for edge in page['edges']]
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = page['pageInfo']['endCursor']
+        self.assertEqual(texts, expected)
+
+        page = self.query(f'last: 3, before: "{after}"')
+        self.assertEqual(
+            [edge['node']['text'] for edge in page['edges']], expected[6:9]
+        )
+        self.assertTrue(page['pageInfo']['hasPreviousPage'])
+
+    def test_order_by_argument(self):
+        """Test that cursors follow descending orderBy fields too."""
+        first = self.query('first: 4, orderBy: "-display"')
+        second = self.query(
+            f'first: 4, orderBy: "-display", after: "{first["pageInfo"]["endCursor"]}"'
+        )
+
+        displays = [
+            Prompt.objects.get(blob__text=edge['node']['text']).display
+            for edge in first['edges'] + second['edges']
+        ]
+        self.assertEqual(displays, sorted(displays, reverse=True))
+        self.assertEqual(len(set(edge['cursor'] for edge in second['edges'])), 4)
+
+    def test_total_count_is_lazy(self):
+        """Test that totalCount is only counted when it's selected."""
+        with self.assertNumQueries(2):
+            page = self.query('first: 2', 'totalCount edges{node{text}}')
+        self.assertEqual(page['totalCount'], 12)
+
+        page = self.query('first: 2', 'totalCount(estimate: true)')
+        self.assertEqual(page['totalCount'], 12)
+
+
+class QueryOptimizerTests(TestCase):
+    def setUp(self):
+        """Set up a project with prompts and an AI model."""
+        self.project = DirNode.add_root(display='redbox')
+        for i in range(3):
+            Prompt.objects.create(
+                display=f'prompt {i}', text='Be helpful.', dirnode=self.project
+            )
+        AIModel.objects.create(
+            display='claude3', parameters={'temperature': 0}, dirnode=self.project
+        )
+
+    def query(self, query):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse('api'),
+                {'query': query},
+                content_type='application/json',
+                HTTP_CACHE_CONTROL='no-cache',
+            )
+        self.assertNotIn('errors', response.json())
+        return [query['sql'] for query in context.captured_queries]
+
+    def test_unselected_columns_are_not_loaded(self):
+        """Test that text and API keys are only read when they're selected."""
+        (sql,) = self.query('{allPrompts{edges{node{display}}}}')
+        self.assertNotIn('promptblob', sql)
+        self.assertNotIn('token_count', sql)
+
+        (sql,) = self.query('{allAimodels{edges{node{display}}}}')
+        self.assertNotIn('encrypted_api_key', sql)
+        self.assertNotIn('parameters', sql)
+
+    def test_relations_are_joined(self):
+        """Test that text and directories, even in fragments, cost no queries."""
+        (sql,) = self.query(
+            '{allPrompts{edges{node{...prompt dirnode{display}}}}}'
+            'fragment prompt on PromptType{text}'
+        )
+        self.assertIn('promptblob', sql)
+        self.assertIn('yesand_dirnode', sql)
+
+
+class ParameterFilterTests(TestCase):
+    def setUp(self):
+        """Set up AI models with different parameters."""
+        project = DirNode.add_root(display='redbox')
+        for display, parameters in [
+            ('gpt', {'model_name': 'gpt-4', 'temperature': 0.7}),
+            ('claude', {'model_name': 'claude-3', 'temperature': 1}),
+            ('flagged', {'temperature': True, 'options': {'top_p': 0.9}}),
+            ('tagged', {'options': {'stop': ['###']}, 'seed': None}),
+            ('empty', None),
+        ]:
+            AIModel.objects.create(
+                display=display, parameters=parameters, dirnode=project
+            )
+
+    def displays(self, **arguments):
+        args = ', '.join(
+            f'{name}: {json.dumps(value)}' for name, value in arguments.items()
+        )
+        response = self.client.post(
+            reverse('api'),
+            {'query': f'{{allAimodels({args}){{edges{{node{{display}}}}}}}}'},
+            content_type='application/json',
+        )
+        data = response.json()
+        if 'errors' in data:
+            return data['errors'][0]['message']
+        return sorted(
+            edge['node']['display'] for edge in data['data']['allAimodels']['edges']
+        )
+
+    def test_equal(self):
+        """Test matching values at key paths, telling numbers from booleans."""
+
+        def equal(values):
+            return self.displays(parametersEqual=json.dumps(values))
+
+        self.assertEqual(equal({'model_name': 'gpt-4'}), ['gpt'])
+        self.assertEqual(equal({'temperature': 1}), ['claude'])
+        self.assertEqual(equal({'temperature': True}), ['flagged'])
+        self.assertEqual(equal({'options.top_p': 0.9}), ['flagged'])
+        self.assertEqual(equal({'options.stop': ['###']}), ['tagged'])
+        self.assertEqual(equal({'seed': None}), ['tagged'])
+        self.assertEqual(equal({'model_name': 'gpt-4', 'temperature': 1}), [])
+
+    def test_contains_and_has_key(self):
+        """Test matching nested objects, and keys whatever their value."""
+        contains = {'options': {'top_p': 0.9}, 'temperature': True}
+        self.assertEqual(
+            self.displays(parametersContains=json.dumps(contains)), ['flagged']
+        )
+        self.assertEqual(
+            self.displays(parametersHasKey='model_name'), ['claude', 'gpt']
+        )
+        self.assertEqual(self.displays(parametersHasKey='seed'), ['tagged'])
+        self.assertEqual(self.displays(parametersHasKey='options.stop'), ['tagged'])
+
+    def test_invalid_arguments(self):
+        """Test that bad paths and non-objects are refused."""
+        self.assertIn('Invalid parameter path', self.displays(parametersHasKey="a'b"))
+        self.assertIn('JSON object', self.displays(parametersEqual='[1]'))
+
+    def test_uses_expression_index(self):
+        """Test that SQLite finds indexed parameters through their index."""
+        from django.db import connection
+
+        if connection.vendor != 'sqlite':
+            self.skipTest('Expression indexes are for SQLite')
+        plan = AIModel.objects.parameters_equal({'model_name': 'gpt-4'}).explain()
+        self.assertIn('aimodel_params_model_name', plan)
+
+
+class APIKeyTests(TestCase):
+    PROMPTS = '{allPrompts{edges{node{display}}}}'
+
+    def setUp(self):
+        """Set up two projects, a key for a directory in one, and empty caches."""
+        from django.core.cache import cache
+
+        cache.clear()
+        APIKey._cache.clear()
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        other = DirNode.add_root(display='other')
+        self.claude = AIModel.objects.create(
+            display='claude3', endpoint='https://example.com', dirnode=self.project
+        )
+        for display, dirnode in [
+            ('root', self.project),
+            ('rag', self.rag),
+            ('other', other),
+        ]:
+            prompt = Prompt.objects.create(
+                display=display, text='Be helpful.', dirnode=dirnode
+            )
+            prompt.aimodels.add(self.claude)
+        self.api_key, self.key = APIKey.generate('rag service', self.rag)
+
+    def query(self, query=PROMPTS, key=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {key}'} if key else {}
+        return self.client.post(
+            reverse('api'), {'query': query}, content_type='application/json', **headers
+        )
+
+    def displays(self, response, field='allPrompts'):
+        return sorted(
+            edge['node']['display'] for edge in response.json()['data'][field]['edges']
+        )
+
+    def test_key_is_hashed(self):
+        """Test that only a hash and a recognisable prefix are stored."""
+        self.assertTrue(self.key.startswith(self.api_key.prefix))
+        self.assertNotIn(self.key, self.api_key.hashed_key)
+        self.assertEqual(APIKey.authenticate(self.key).dirnode_id, self.rag.id)
+
+    def test_key_is_scoped(self):
+        """Test that a key only sees its directory and beneath it."""
+        self.assertEqual(self.displays(self.query()), ['other', 'rag', 'root'])
+        self.assertEqual(self.displays(self.query(key=self.key)), ['rag'])
+        self.assertEqual(
+            self.displays(
+                self.query('{allDirnodes{edges{node{display}}}}', key=self.key),
+                'allDirnodes',
+            ),
+            ['rag'],
+        )
+        self.assertEqual(
+            self.displays(
+                self.query('{allAimodels{edges{node{display}}}}', key=self.key),
+                'allAimodels',
+            ),
+            [],
+        )
+        response = self.query(
+            '{modelPrompts(modelName: "claude3"){display}}', key=self.key
+        )
+        self.assertEqual(
+            [prompt['display'] for prompt in response.json()['data']['modelPrompts']],
+            ['rag'],
+        )
+
+    def test_authentication_is_cached(self):
+        """Test that a checked key costs no queries."""
+        self.query(key=self.key)
+
+        # Only the data version, for the response cache
+        with self.assertNumQueries(1):
+            response = self.query(key=self.key)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_sessions_skipped(self):
+        """Test that key holders sending a session cookie don't load it."""
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_user('service'))
+        self.query(key=self.key)
+
+        # Only the data version, for the response cache
+        with self.assertNumQueries(1):
+            response = self.query(key=self.key)
+        self.assertEqual(self.displays(response), ['rag'])
+
+    def test_unauthorized(self):
+        """Test that unknown, revoked and, when required, missing keys fail."""
+        self.assertEqual(self.query(key='yesand_nope').status_code, 401)
+
+        with self.settings(API_KEY_REQUIRED=True):
+            self.assertEqual(self.query().status_code, 401)
+            self.assertEqual(self.query(key=self.key).status_code, 200)
+
+        self.api_key.revoked_at = timezone.now()
+        self.api_key.save()
+        self.assertEqual(self.query(key=self.key).status_code, 401)
+
+    def test_moved_directory(self):
+        """Test that a cached key follows its directory when its path changes."""
+        self.query(key=self.key)
+        self.rag.move(DirNode.objects.get(display='other'), 'sorted-child')
+        self.assertEqual(self.displays(self.query(key=self.key)), ['rag'])
+
+        # Sorted before rag, renumbering its path, without clearing any cache
+        self.project.refresh_from_db()
+        self.project.add_child(display='alpha')
+        self.rag.refresh_from_db()
+        self.rag.move(self.project, 'sorted-child')
+        DirNode.objects.get(id=self.project.id).add_child(display='aardvark')
+        response = self.client.post(
+            reverse('api'),
+            {'query': self.PROMPTS},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.key}',
+            HTTP_CACHE_CONTROL='no-cache',
+        )
+        self.assertEqual(self.displays(response), ['rag'])
+
+        self.rag.refresh_from_db()
+        self.rag.tombstone()
+        self.assertEqual(self.displays(self.query(key=self.key)), [])
+
+
+class EffectivePromptTests(TestCase):
+    def setUp(self):
+        """Set up prompts at two levels of a project, for two AI models."""
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        self.deep = self.rag.add_child(display='deep')
+        self.claude = AIModel.objects.create(display='claude3', dirnode=self.project)
+        self.gpt = AIModel.objects.create(display='gpt', dirnode=self.project)
+        for display, dirnode, aimodels in [
+            ('system', self.project, [self.claude, self.gpt]),
+            ('question', self.project, [self.claude]),
+            ('system', self.rag, [self.claude]),
+        ]:
+            prompt = Prompt.objects.create(
+                display=display, text=f'{display} for {dirnode}', dirnode=dirnode
+            )
+            prompt.aimodels.add(*aimodels)
+        self.rag_system = prompt
+
+    def effective(self, dirnode, model='claude3'):
+        """The directory each of a directory's prompt names is inherited from."""
+        return dict(
+            EffectivePrompt.objects.filter(
+                dirnode=dirnode, model_name=model
+            ).values_list('name', 'prompt__dirnode__display')
+        )
+
+    def assert_rebuilt(self):
+        """Assert rebuilding the table from scratch changes nothing."""
+        from django.core.management import call_command
+
+        fields = ('dirnode_id', 'model_name', 'name', 'prompt_id')
+        maintained = set(EffectivePrompt.objects.values_list(*fields))
+        EffectivePrompt.objects.all().delete()
+        call_command('rebuild_effective_prompts', stdout=io.StringIO())
+        self.assertEqual(set(EffectivePrompt.objects.values_list(*fields)), maintained)
+
+    def test_nearest_prompt_wins(self):
+        """Test that each name comes from the nearest directory with one."""
+        self.assertEqual(
+            self.effective(self.deep), {'system': 'rag', 'question': 'redbox'}
+        )
+        self.assertEqual(
+            self.effective(self.project), {'system': 'redbox', 'question': 'redbox'}
+        )
+        self.assertEqual(self.effective(self.deep, 'gpt'), {'system': 'redbox'})
+        self.assert_rebuilt()
+
+    def test_prompt_writes(self):
+        """Test that renaming, moving, unlinking and deleting prompts refresh."""
+        self.rag_system.display = 'retrieval'
+        self.rag_system.save()
+        self.assertEqual(self.effective(self.deep)['system'], 'redbox')
+        self.assertEqual(self.effective(self.deep)['retrieval'], 'rag')
+
+        self.rag_system.dirnode = self.deep
+        self.rag_system.save()
+        self.assertNotIn('retrieval', self.effective(self.rag))
+        self.assertEqual(self.effective(self.deep)['retrieval'], 'deep')
+        self.assert_rebuilt()
+
+        self.claude.prompts.remove(self.rag_system)
+        self.assertNotIn('retrieval', self.effective(self.deep))
+        self.rag_system.aimodels.add(self.claude)
+        Prompt.objects.filter(id=self.rag_system.id).update(dirnode=self.rag)
+        self.assertEqual(self.effective(self.deep)['retrieval'], 'rag')
+
+        Prompt.objects.filter(dirnode=self.project).delete()
+        self.assertEqual(self.effective(self.deep), {'retrieval': 'rag'})
+        self.assertEqual(self.effective(self.project), {})
+        self.assert_rebuilt()
+
+    def test_aimodel_writes(self):
+        """Test that renaming and deleting AI models refresh."""
+        self.claude.display = 'claude3.5'
+        self.claude.save()
+        self.assertEqual(self.effective(self.deep), {})
+        self.assertEqual(self.effective(self.deep, 'claude3.5')['system'], 'rag')
+
+        self.gpt.delete()
+        self.assertEqual(self.effective(self.deep, 'gpt'), {})
+        self.assert_rebuilt()
+
+    def test_directory_writes(self):
+        """Test that new, moved, deleted and restored directories refresh."""
+        child = self.deep.add_child(display='child')
+        self.assertEqual(self.effective(child), self.effective(self.deep))
+
+        other = DirNode.add_root(display='other')
+        self.deep.move(other, 'sorted-child')
+        self.assertEqual(self.effective(child), {})
+
+        # Renumbered with the other roots
+        self.rag.refresh_from_db()
+        self.rag.tombstone()
+        self.assertFalse(EffectivePrompt.objects.filter(dirnode=self.rag).exists())
+        self.rag.restore()
+        self.assertEqual(self.effective(self.rag)['system'], 'rag')
+        self.assert_rebuilt()
+
+    def test_query(self):
+        """Test that the query returns inherited prompts within a key's scope."""
+        from graphql_relay import to_global_id
+
+        directory = to_global_id('DirNodeType', self.deep.id)
+        query = (
+            f'{{effectivePrompts(directory: "{directory}", model: "claude3")'
+            '{display dirnode{display}}}'
+        )
+        response = self.client.post(
+            reverse('api'), {'query': query}, content_type='application/json'
+        )
+        self.assertEqual(
+            response.json()['data']['effectivePrompts'],
+            [
+                {'display': 'question', 'dirnode': {'display': 'redbox'}},
+                {'display': 'system', 'dirnode': {'display': 'rag'}},
+            ],
+        )
+
+        _, key = APIKey.generate('rag service', self.rag)
+        response = self.client.post(
+            reverse('api'),
+            {'query': query},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {key}',
+        )
+        self.assertEqual(
+            response.json()['data']['effectivePrompts'],
+            [{'display': 'system', 'dirnode': {'display': 'rag'}}],
+        )
+
+
+class CountTests(TestCase):
+    def setUp(self):
+        """Set up a project with a directory, a prompt and an AI model in it."""
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        self.claude = AIModel.objects.create(display='claude3', dirnode=self.rag)
+        self.prompt = Prompt.objects.create(
+            display='system', text='Be helpful.', dirnode=self.rag
+        )
+        self.prompt.aimodels.add(self.claude)
+
+    def counts(self, node):
+        """A directory's direct and subtree counts of prompts and AI models."""
+        node.refresh_from_db()
+        return (
+            node.prompt_count,
+            node.aimodel_count,
+            node.subtree_prompt_count,
+            node.subtree_aimodel_count,
+        )
+
+    def assert_repaired(self):
+        """Assert recounting everything from scratch changes nothing."""
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command('repair_counts', stdout=out)
+        self.assertIn('counts of 0 directories', out.getvalue())
+
+    def test_item_writes(self):
+        """Test that adding, moving, copying and deleting items count."""
+        self.assertEqual(self.counts(self.rag), (1, 1, 1, 1))
+        self.assertEqual(self.counts(self.project), (0, 0, 1, 1))
+
+        self.prompt.dirnode = self.project
+        self.prompt.save()
+        self.assertEqual(self.counts(self.rag), (0, 1, 0, 1))
+        self.assertEqual(self.counts(self.project), (1, 0, 1, 1))
+
+        self.claude.pk = None
+        self.claude.dirnode = self.project
+        self.claude.save()
+        self.assertEqual(self.counts(self.project), (1, 1, 1, 2))
+
+        Prompt.objects.filter(id=self.prompt.id).update(dirnode=self.rag)
+        AIModel.objects.filter(dirnode=self.rag).delete()
+        self.assertEqual(self.counts(self.rag), (1, 0, 1, 0))
+        self.assertEqual(self.counts(self.project), (0, 1, 1, 1))
+        self.assert_repaired()
+
+    def test_directory_writes(self):
+        """Test that moved, copied, deleted and restored subtrees count."""
+        other = DirNode.add_root(display='zephyr')
+        self.rag.move(other, 'sorted-child')
+        self.assertEqual(self.counts(self.project), (0, 0, 0, 0))
+        self.assertEqual(self.counts(other), (0, 0, 1, 1))
+
+        self.rag.refresh_from_db()
+        self.rag.copy_to(self.project)
+        self.assertEqual(self.counts(self.project), (0, 0, 1, 1))
+
+        self.rag.refresh_from_db()
+        self.rag.tombstone()
+        self.assertEqual(self.counts(other), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.rag), (1, 1, 1, 1))
+        self.assert_repaired()
+        self.rag.restore()
+        self.assertEqual(self.counts(other), (0, 0, 1, 1))
+
+        DirNode.objects.filter(id=self.rag.id).delete()
+        self.assertEqual(self.counts(other), (0, 0, 0, 0))
+        self.assert_repaired()
+
+    def test_prompt_counts(self):
+        """Test that linking, unlinking and deleting prompts count."""
+        self.claude.refresh_from_db()
+        self.assertEqual(self.claude.prompt_count, 1)
+
+        user = Prompt.objects.create(display='user', text='Hi.', dirnode=self.rag)
+        self.claude.prompts.add(user)
+        self.claude.refresh_from_db()
+        self.assertEqual(self.claude.prompt_count, 2)
+
+        self.prompt.aimodels.clear()
+        self.claude.refresh_from_db()
+        self.assertEqual(self.claude.prompt_count, 1)
+
+        user.delete()
+        self.claude.refresh_from_db()
+        self.assertEqual(self.claude.prompt_count, 0)
+
+    def test_repair(self):
+        """Test that counts changed behind the models' backs are repaired."""
+        from django.core.management import call_command
+
+        DirNode.objects.update(subtree_prompt_count=7)
+        AIModel.objects.update(prompt_count=7)
+
+        out = io.StringIO()
+        call_command('repair_counts', stdout=out)
+        self.assertIn('counts of 2 directories', out.getvalue())
+        self.assertEqual(self.counts(self.project), (0, 0, 1, 1))
+        self.claude.refresh_from_db()
+        self.assertEqual(self.claude.prompt_count, 1)
+
+    def test_query(self):
+        """Test that the counts are fields of the API's types."""
+        query = (
+            '{allDirnodes{edges{node{display promptCount subtreePromptCount '
+            'subtreeAimodelCount aimodels{promptCount}}}}}'
+        )
+        response = self.client.post(
+            reverse('api'), {'query': query}, content_type='application/json'
+        )
+        nodes = {
+            edge['node'].pop('display'): edge['node']
+            for edge in response.json()['data']['allDirnodes']['edges']
+        }
+        self.assertEqual(
+            nodes['redbox'],
+            {
+                'promptCount': 0,
+                'subtreePromptCount': 1,
+                'subtreeAimodelCount': 1,
+                'aimodels': [],
+            },
+        )
+        self.assertEqual(nodes['rag']['aimodels'], [{'promptCount': 1}])
+
+
+class StubEndpoint(BaseHTTPRequestHandler):
+    """An AI model endpoint that streams back the words of the prompt."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.received.append(
+            (self.client_address[1], self.headers['Authorization'], body)
+        )
+        if self.path == '/drop':
+            # Runs the prompt, then goes away before answering
+            self.close_connection = True
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for word in body['prompt'].split():
+            data = f'data: {word}\n\n'.encode()
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(GATEWAY_ENABLED=True, GATEWAY_QUEUE_TIMEOUT=0.1)
+class GatewayTests(TestCase):
+    def setUp(self):
+        """Set up a stub endpoint, an AI model using it and a key to call it."""
+        import threading
+
+        from cryptography.fernet import Fernet
+
+        from . import gateway
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubEndpoint)
+        server.received = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.received = server.received
+        self.enterContext(mock.patch.dict(gateway.pools, clear=True))
+
+        key = Fernet.generate_key().decode()
+        self.enterContext(mock.patch.dict('os.environ', ENCRYPTION_KEY=key))
+        APIKey._cache.clear()
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        self.claude = AIModel(
+            display='claude3',
+            endpoint=f'http://127.0.0.1:{server.server_port}/v1/complete',
+            parameters={'temperature': 0},
+            dirnode=self.project,
+        )
+        self.claude.key = 'sk-test'
+        self.claude.save()
+        self.prompt = Prompt.objects.create(
+            display='question', text='Answer: {question}', dirnode=self.rag
+        )
+        _, self.key = APIKey.generate('gateway', self.project)
+
+    def forward(self, model=None, prompt=None, key=None, **data):
+        data = {
+            'model': model or self.claude.id,
+            'prompt': prompt or self.prompt.id,
+            'variables': {'question': 'what is yes&?'},
+            **data,
+        }
+        return self.client.post(
+            reverse('gateway'),
+            data,
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {key or self.key}',
+        )
+
+    def test_forwards_over_one_connection(self):
+        """Test that prompts are rendered, sent with the key, and streamed back."""
+        for _ in range(2):
+            response = self.forward()
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            self.assertEqual(
+                b''.join(response.streaming_content),
+                b'data: Answer:\n\ndata: what\n\ndata: is\n\ndata: yes&?\n\n',
+            )
+
+        (port, authorization, body), (second_port, *_) = self.received
+        self.assertEqual(authorization, 'Bearer sk-test')
+        self.assertEqual(body, {'temperature': 0, 'prompt': 'Answer: what is yes&?'})
+        self.assertEqual(second_port, port)
+
+    def test_concurrency_limit(self):
+        """Test that requests over an endpoint's limit are refused, not queued."""
+        with override_settings(GATEWAY_MAX_CONNECTIONS=1):
+            streaming = self.forward()
+            response = self.forward()
+            self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+
+            # Reading the first response to the end frees its connection
+            b''.join(streaming.streaming_content)
+            response = self.forward()
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            b''.join(response.streaming_content)
+
+    def test_sent_requests_are_not_resent(self):
+        """Test that a prompt the endpoint received isn't sent to it again."""
+        b''.join(self.forward().streaming_content)
+        self.claude.endpoint = self.claude.endpoint.replace('/v1/complete', '/drop')
+        self.claude.save()
+
+        response = self.forward()
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_GATEWAY)
+        self.assertEqual(len(self.received), 2)
+
+    def test_invalid_endpoints(self):
+        """Test that endpoints without a host or port are refused."""
+        from urllib.parse import urlsplit
+
+        from . import gateway
+
+        for endpoint in ('http:///v1', 'http://127.0.0.1:99999/', 'ftp://host/'):
+            AIModel.objects.filter(id=self.claude.id).update(endpoint=endpoint)
+            response = self.forward()
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+            self.assertIn(
+                'endpoint is invalid', response.json()['errors'][0]['message']
+            )
+
+        # A connection that can't be made gives its slot back
+        with override_settings(GATEWAY_MAX_CONNECTIONS=1):
+            pool = gateway.ConnectionPool(urlsplit('http://127.0.0.1:1/'))
+        pool.connection_class = mock.Mock(side_effect=AttributeError)
+        for _ in range(2):
+            with self.assertRaises(AttributeError):
+                pool.acquire()
+
+    def test_refused_requests(self):
+        """Test that the gateway needs a key that can see both nodes."""
+        from graphql_relay import to_global_id
+
+        response = self.client.post(
+            reverse('gateway'), {}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+        _, rag_key = APIKey.generate('rag', self.rag)
+        response = self.forward(key=rag_key)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+        gpt = AIModel.objects.create(
+            display='gpt', endpoint='http://127.0.0.1:1/', dirnode=self.rag
+        )
+        prompt = Prompt.objects.create(display='root', text='Hi', dirnode=self.project)
+        response = self.forward(
+            model=to_global_id('AIModelType', gpt.id), prompt=prompt.id
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+        response = self.forward(model=to_global_id('PromptType', gpt.id))
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(self.received)
+
+        with override_settings(GATEWAY_ENABLED=False):
+            self.assertEqual(self.forward().status_code, HTTPStatus.NOT_FOUND)
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        """Set up a project, and empty the shared cache."""
+        from django.core.cache import cache
+
+        cache.clear()
+        DirNode.add_root(display='redbox')
+
+    def query(self, query='{allPrompts{edges{node{display}}}}', **extra):
+        return self.client.post(
+            reverse('api'),
+            {'query': query},
+            content_type='application/json',
+            HTTP_CACHE_CONTROL='no-cache',
+            **extra,
+        )
+
+    @override_settings(GRAPHQL_RATE_LIMITS={'allPrompts': '2/m'})
+    def test_rate_limit(self):
+        """Test that a client's bucket empties, refills and is its own."""
+        from api.throttle import rate_limited
+
+        now = 1_000_000
+        with mock.patch('api.throttle.time.time', return_value=now):
+            self.assertEqual(self.query().status_code, 200)
+            self.assertEqual(self.query().status_code, 200)
+            response = self.query()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '30')
+            self.assertEqual(rate_limited.value(), 1)
+
+            # Other fields, and other clients, have their own buckets
+            query = '{allDirnodes{edges{node{display}}}}'
+            self.assertEqual(self.query(query).status_code, 200)
+            self.assertEqual(self.query(REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+        with mock.patch('api.throttle.time.time', return_value=now + 30):
+            self.assertEqual(self.query().status_code, 200)
+            self.assertEqual(self.query().status_code, 429)
+
+    @override_settings(GRAPHQL_CONCURRENCY_LIMIT=1)
+    def test_concurrency_limit(self):
+        """Test that a client can only have so many requests in flight."""
+        from api import throttle
+
+        request = mock.Mock(api_key_scope=None, META={'REMOTE_ADDR': '127.0.0.1'})
+        with throttle.concurrency_slot(request) as admitted:
+            self.assertTrue(admitted)
+            response = self.query()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '1')
+
+        self.assertEqual(self.query().status_code, 200)
+
+    def test_parse_rate(self):
+        """Test that rates become bursts and the milliseconds per token."""
+        from django.core.exceptions import ImproperlyConfigured
+
+        from api.throttle import Rate, parse_rate
+
+        self.assertEqual(parse_rate('100/m'), Rate(burst=100, interval=600))
+        with self.assertRaises(ImproperlyConfigured):
+            parse_rate('100 a minute')
+
+
+@override_settings(CHANGE_EVENT_POLL_INTERVAL=0.01, CHANGE_EVENT_STREAM_TIMEOUT=1)
+class ChangeEventTests(TestCase):
+    def setUp(self):
+        """Set up a project with a subdirectory, and an idle broadcaster."""
+        self.project = DirNode.add_root(display='redbox')
+        self.rag = self.project.add_child(display='rag')
+        self.other = DirNode.add_root(display='other')
+        # Sorted before the project, which moved to make room
+        self.project.refresh_from_db()
+        self.rag.refresh_from_db()
+        patcher = mock.patch.object(events, 'broadcaster', events.Broadcaster())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def published(self, since=0):
+        return list(
+            ChangeEvent.objects.filter(id__gt=since).values_list(
+                'node_type', 'node_id', 'action', 'path'
+            )
+        )
+
+    def test_writes_publish(self):
+        """Test that saving, moving and deleting publish where they happened."""
+        since = ChangeEvent.objects.last().id
+        prompt = Prompt.objects.create(display='system', text='Hi.', dirnode=self.rag)
+        prompt.display = 'user'
+        prompt.save()
+        self.rag.move(self.other, 'sorted-child')
+        self.rag.refresh_from_db()
+        self.rag.tombstone()
+        self.rag.restore()
+        prompt_id = prompt.id
+        prompt.delete()
+
+        path = self.rag.path
+        self.assertEqual(
+            self.published(since),
+            [
+                ('prompt', prompt_id, 'created', self.project.path + '0001'),
+                ('prompt', prompt_id, 'updated', self.project.path + '0001'),
+                ('dirnode', self.rag.id, 'moved', path),
+                ('dirnode', self.rag.id, 'deleted', path),
+                ('dirnode', self.rag.id, 'restored', path),
+                ('prompt', prompt_id, 'deleted', path),
+            ],
+        )
+        moved = ChangeEvent.objects.get(action='moved')
+        self.assertEqual(moved.from_path, self.project.path + '0001')
+
+    def test_bulk_writes_publish_once(self):
+        """Test that a write to many rows is one event, where they all are."""
+        since = ChangeEvent.objects.last().id
+        Prompt.objects.bulk_create(
+            Prompt(display=display, text='Hi.', dirnode=self.rag)
+            for display in ('a', 'b')
+        )
+        Prompt.objects.filter(display='a').update(display='c')
+        updated = Prompt.objects.get(display='c').id
+        Prompt.objects.all().delete()
+
+        self.assertEqual(
+            self.published(since),
+            [
+                ('prompt', None, 'created', self.rag.path),
+                ('prompt', updated, 'updated', self.rag.path),
+                ('prompt', None, 'deleted', self.rag.path),
+            ],
+        )
+
+    def test_subscription(self):
+        """Test that subtrees see writes beneath and above them, within scope."""
+
+        def event(path, from_path=''):
+            return events.Event(1, 'prompt', 1, 'updated', 1, path, from_path)
+
+        rag = events.Subscription(self.rag.path)
+        self.assertTrue(rag.matches(event(self.rag.path + '0001')))
+        self.assertTrue(rag.matches(event(self.project.path)))
+        self.assertTrue(rag.matches(event('')))
+        self.assertFalse(rag.matches(event(self.other.path)))
+        self.assertTrue(rag.matches(event(self.other.path, self.rag.path)))
+
+        scoped = events.Subscription(self.rag.path, scope=self.rag.path)
+        self.assertFalse(scoped.matches(event(self.project.path)))
+        self.assertTrue(scoped.matches(event(self.rag.path)))
+
+    def test_stream(self):
+        """Test that a directory's stream is sent the changes beneath it."""
+        response = self.client.get(reverse('directory_events', args=[self.rag.id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = iter(response.streaming_content)
+        self.assertEqual(next(content), b'retry: 1000\n\n')
+
+        Prompt.objects.create(display='elsewhere', text='Hi.', dirnode=self.other)
+        prompt = Prompt.objects.create(display='system', text='Hi.', dirnode=self.rag)
+        event = ChangeEvent.objects.last()
+        self.assertEqual(
+            next(content).decode(),
+            f'id: {event.id}\nevent: change\ndata: '
+            f'{{"type": "prompt", "id": {prompt.id}, "action": "created", '
+            f'"version": {event.version}}}\n\n',
+        )
+        self.assertEqual(b''.join(content), b': keep-alive\n\n')
+        self.assertEqual(events.broadcaster.subscribers, 0)
+
+    def test_resume(self):
+        """Test that a reconnecting stream is sent the events it missed."""
+        since = ChangeEvent.objects.last().id
+        Prompt.objects.create(display='system', text='Hi.', dirnode=self.rag)
+        Prompt.objects.create(display='elsewhere', text='Hi.', dirnode=self.other)
+
+        with self.settings(CHANGE_EVENT_STREAM_TIMEOUT=0):
+            response = self.client.get(
+                reverse('directory_events', args=[self.rag.id]),
+                HTTP_LAST_EVENT_ID=str(since),
+            )
+            content = b''.join(response.streaming_content).decode()
+        self.assertIn(f'id: {since + 1}\n', content)
+        self.assertNotIn(f'id: {since + 2}\n', content)
+
+    def test_api_key_scope(self):
+        """Test that key holders can only follow their own subtree."""
+        _, key = APIKey.generate('rag service', self.rag)
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {key}'}
+
+        response = self.client.get(
+            reverse('directory_events', args=[self.other.id]), **headers
+        )
+        self.assertEqual(response.status_code, 404)
+        with self.settings(CHANGE_EVENT_STREAM_TIMEOUT=0):
+            response = self.client.get(reverse('events'), **headers)
+            self.assertEqual(response.status_code, 200)
+            b''.join(response.streaming_content)
+            response = self.client.get(
+                reverse('events'), HTTP_AUTHORIZATION='Bearer yesand_nope'
+            )
+            self.assertEqual(response.status_code, 401)
+
+    def test_stream_limit(self):
+        """Test that streams over a process's limit are refused, not queued."""
+        with self.settings(CHANGE_EVENT_MAX_STREAMS=1, CHANGE_EVENT_STREAM_TIMEOUT=0):
+            streaming = self.client.get(reverse('events'))
+            response = self.client.get(reverse('events'))
+            self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+
+            # The first stream ending frees its place
+            b''.join(streaming.streaming_content)
+            response = self.client.get(reverse('events'))
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            b''.join(response.streaming_content)
+        self.assertEqual(events.broadcaster.subscribers, 0)
+
+
+@override_settings(
+    CHANGE_EVENT_POLL_INTERVAL=0.01,
+    CHANGE_EVENT_STREAM_TIMEOUT=1,
+    CHANGE_EVENT_MAX_STREAMS=1,
+)
+class ChangeEventServerTests(LiveServerTestCase):
+    def setUp(self):
+        """Set up an idle broadcaster for the server's threads."""
+        patcher = mock.patch.object(events, 'broadcaster', events.Broadcaster())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, path):
+        import http.client
+
+        connection = http.client.HTTPConnection(
+            self.server_thread.host, self.server_thread.port, timeout=5
+        )
+        connection.request('GET', path)
+        return connection, connection.getresponse()
+
+    def test_requests_served_while_streaming(self):
+        """Test that an open stream leaves the server free for other requests."""
+        import time
+
+        connection, stream = self.get(reverse('events'))
+        self.assertEqual(stream.readline(), b'retry: 1000\n')
+
+        _, response = self.get(reverse('health'))
+        self.assertEqual(response.status, HTTPStatus.OK)
+        self.assertEqual(json.loads(response.read()), {'status': 'healthy'})
+        _, response = self.get(reverse('events'))
+        self.assertEqual(response.status, HTTPStatus.SERVICE_UNAVAILABLE)
+
+        connection.close()
+        # The stream ends on its own, and gives up its place
+        deadline = time.monotonic() + 5
+        while events.broadcaster.subscribers and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(events.broadcaster.subscribers, 0)
+
+
+class ConcurrentTreeWriteTests(TransactionTestCase):
+    WRITERS = 6
+    WRITES = 8
+
+    def test_concurrent_writers_keep_tree_valid(self):
+        """Test that writers adding and moving under one parent don't collide."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        from django.db import connection
+
+        project = DirNode.add_root(display='redbox')
+        archive = DirNode.add_root(display='archive')
+
+        def write(writer):
+            try:
+                for i in range(self.WRITES):
+                    parent = DirNode.objects.get(id=project.id)
+                    node = parent.add_child(display=f'{writer}-{i}')
+                    DirNode.add_root(display=f'root {writer}-{i}')
+                    if i % 4 == 0:
+                        node.move(DirNode.objects.get(id=archive.id), 'sorted-child')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.WRITERS) as executor:
+            list(executor.map(write, range(self.WRITERS)))
+
+        project.refresh_from_db()
+        archive.refresh_from_db()
+        moved = self.WRITERS * self.WRITES // 4
+        self.assertEqual(archive.numchild, moved)
+        self.assertEqual(project.numchild, self.WRITERS * self.WRITES - moved)
+        self.assertTrue(all(not problem for problem in DirNode.find_problems()))
+        children = [child.display for child in project.get_children()]
+        self.assertEqual(children, sorted(children))
+
+
+class LoadTestTests(LiveServerTestCase):
+    def test_seed_and_load(self):
+        """Test that a seeded server serves mixed traffic without errors."""
+        import json
+
+        from django.core.management import call_command
+
+        call_command(
+            'seed',
+            projects=1,
+            depth=2,
+            fanout=2,
+            prompts=3,
+            models=1,
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(DirNode.objects.count(), 3)
+        self.assertEqual(Prompt.objects.filter(aimodels__isnull=False).count(), 9)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'report.json'
+            call_command(
+                'loadtest',
+                url=self.live_server_url,
+                clients=2,
+                duration=1,
+                output=output,
+                stdout=io.StringIO(),
+            )
+            report = json.loads(output.read_text())
+
+        self.assertGreater(report['requests'], 0)
+        self.assertEqual(report['errors'], 0)
+        self.assertLessEqual(report['p50'], report['p95'])
+        self.assertLessEqual(report['p95'], report['p99'])
+        self.assertEqual(
+            sum(stats['requests'] for stats in report['endpoints'].values()),
+            report['requests'],
+        )
+
+    def test_compare(self):
+        """Test that comparisons are percentage changes from the baseline."""
+        from .loadtest import compare
+
+        stats = {'throughput': 100, 'p50': 10, 'p95': 20, 'p99': 0}
+        baseline = {**stats, 'endpoints': {'htmx:filesystem': stats}}
+        slower = {**stats, 'throughput': 50, 'p95': 30}
+        report = {**slower, 'endpoints': {'htmx:filesystem': slower}}
+
+        rows = compare(baseline, report)
+
+        self.assertEqual(
+            rows[1],
+            {
+                'endpoint': 'htmx:filesystem',
+                'throughput': -50.0,
+                'p50': 0.0,
+                'p95': 50.0,
+                'p99': None,
+            },
+        )
+
+
+class StaticAssetTests(TestCase):
+    def test_projects_page_uses_local_assets(self):
+        """Test that the page loads no scripts or styles from a CDN."""
+        response = self.client.get(reverse('projects'))
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotContains(response, 'https://')
+        self.assertContains(response, 'bundles/yesand.js')
+
+    def test_bundle_is_found(self):
+        """Test that the bundle joins its sources in order."""
+        from django.contrib.staticfiles import finders
+
+        bundle = Path(finders.find('bundles/yesand.js')).read_text()
+
+        self.assertLess(bundle.index('Popper'), bundle.index('htmx'))
+        self.assertIn('filesystemChanged', bundle)
+
+    def test_bundle_is_only_rebuilt_when_stale(self):
+        """Test that lookups reuse the bundle until a source changes."""
+        import os
+
+        from django.core.files.storage import FileSystemStorage
+
+        from .staticfiles import BundleFinder
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            finder = BundleFinder()
+            finder.location = directory / 'bundles'
+            finder.storage = FileSystemStorage(location=finder.location)
+            sources = (directory / 'a.js', directory / 'b.js')
+            for source in sources:
+                source.write_text(f'var {source.stem} = 1')
+                os.utime(source, (1, 1))
+
+            bundles = {'app.js': ['a.js', 'b.js']}
+            with (
+                self.settings(STATIC_BUNDLES=bundles),
+                mock.patch.object(finder, '_find_sources', return_value=sources),
+            ):
+                bundle = Path(finder.find('app.js'))
+                self.assertEqual(bundle.read_text(), 'var a = 1;\nvar b = 1\n')
+                os.utime(bundle, (2, 2))
+                finder.find('app.js')
+                self.assertEqual(bundle.stat().st_mtime, 2)
+
+                sources[1].write_text('var b = 2')
+                finder.find('app.js')
+                self.assertEqual(bundle.read_text(), 'var a = 1;\nvar b = 2\n')
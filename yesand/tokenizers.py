@@ -0,0 +1,30 @@
+import math
+import re
+from functools import lru_cache
+from typing import Callable
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+WORD_OR_SYMBOL = re.compile(r'\w+|[^\w\s]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the number of tokens a BPE tokenizer would produce.
+
+    Words count one token per four characters, rounded up, and every other
+    non-space character counts one token.
+    """
+    return sum(math.ceil(len(token) / 4) for token in WORD_OR_SYMBOL.findall(text))
+
+
+@lru_cache
+def get_tokenizer() -> Callable[[str], int]:
+    """Return the token counter named by the PROMPT_TOKENIZER setting."""
+    return import_string(settings.PROMPT_TOKENIZER)
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in some text with the configured tokenizer."""
+    return get_tokenizer()(text)
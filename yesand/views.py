@@ -1,12 +1,39 @@
+import http.client
+import json
 import logging
+import operator
 from collections import namedtuple
+from datetime import timedelta
+from functools import reduce, wraps
+from typing import Callable
 
+from django.conf import settings
+from django.db.models import CharField, F, Q, Value
 from django.forms import Form
-from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.html import format_html
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView
+from graphql_relay import from_global_id
 from treebeard.mp_tree import MP_NodeQuerySet
 
+from api.middleware import get_api_key, unauthorized
+
+from . import events, gateway, jobs, metrics, startup
 from .forms import (
     AddAIModelForm,
     AddDirNodeForm,
@@ -16,14 +43,74 @@ from .forms import (
     EditAIModelForm,
     EditPromptForm,
     MoveForm,
+    PublishForm,
     RenameAIModelForm,
     RenameDirNodeForm,
     RenamePromptForm,
 )
-from .models import AIModel, DirNode, Prompt
+from .models import (
+    AIModel,
+    DataVersion,
+    DirNode,
+    DirNodeQuerySet,
+    Job,
+    Prompt,
+    Snapshot,
+)
 
 NodeType = namedtuple('NodeType', ['model', 'display_name'])
 Action = namedtuple('Action', ['name', 'form'])
+# An AI model or prompt listed in the sidebar, with its directory's depth
+Item = namedtuple(
+    'Item', ['node_type', 'id', 'display', 'dirnode_id', 'depth', 'type_order']
+)
+
+
+def auth_scope(request: HttpRequest) -> str | None:
+    """Who a response is for: the API key or user it was sent with, if any."""
+    if request.api_key_scope:
+        return f'key{request.api_key_scope.key_id}'
+    if request.user.is_authenticated:
+        return f'user{request.user.pk}'
+    return None
+
+
+def data_etag(request: HttpRequest, *args, **kwargs) -> str | None:
+    """ETag for a response that only changes when the data version does."""
+    # Modal forms carry a CSRF token, so they're never revalidated
+    if request.GET.get('action'):
+        return None
+    return '-'.join(
+        filter(
+            None,
+            [settings.RELEASE, str(DataVersion.current()), auth_scope(request)],
+        )
+    )
+
+
+def conditional(
+    view: Callable[..., HttpResponse],
+    etag_func: Callable[..., str | None] = data_etag,
+) -> Callable[..., HttpResponse]:
+    """
+    Wrap a GET view so unchanged responses are revalidated, not re-rendered.
+
+    A matching If-None-Match returns 304 before the view runs. Everything else
+    must be revalidated before reuse and is gzipped when the client accepts it.
+    ETags differ per user and API key, and their responses are private, so no
+    shared cache hands them to anyone else.
+    """
+    view = condition(etag_func=etag_func)(view)
+
+    @wraps(view)
+    def revalidated(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        response = view(request, *args, **kwargs)
+        patch_cache_control(response, no_cache=True)
+        if auth_scope(request):
+            patch_cache_control(response, private=True)
+        return response
+
+    return gzip_page(revalidated)
 
 
 class ProjectsView(TemplateView):
@@ -31,65 +118,239 @@ class ProjectsView(TemplateView):
 
     def get_context_data(self, **kwargs) -> MP_NodeQuerySet:
         context = super().get_context_data(**kwargs)
-        context['root_nodes'] = DirNode.get_root_nodes()
+        context['root_nodes'] = DirNode.get_root_nodes().alive()
         return context
 
 
 class TreeView:
     """Handles tree structure display and navigation."""
 
-    @staticmethod
-    def get_filesystem(request: HttpRequest) -> HttpResponse:
+    @classmethod
+    def get_filesystem(cls: type['TreeView'], request: HttpRequest) -> HttpResponse:
         """Returns the complete filesystem as HTML"""
-        root_nodes = DirNode.get_root_nodes()
-        return render(
-            request, 'filesystem.html', {'filesystem': root_nodes, 'level': 0}
+        filesystem = cls._load_tree(DirNode.objects.alive())
+        return render(request, 'filesystem.html', {'filesystem': filesystem})
+
+    @staticmethod
+    def get_menu(request: HttpRequest, node_type: str, node_id: int) -> HttpResponse:
+        """Returns the actions menu of a sidebar row as HTML"""
+        folder = {'dirnode': 'dirnode', 'aimodel': 'ai', 'prompt': 'prompt'}.get(
+            node_type
+        )
+        if folder is None:
+            raise Http404('Unknown node type')
+        return render(request, f'{folder}/menu.html', {'node_id': node_id})
+
+    @staticmethod
+    def _load_items(directories: DirNodeQuerySet) -> dict[int, list[Item]]:
+        """The AI models then prompts in each directory, in one UNION query."""
+        fields = Item._fields
+        aimodels, prompts = (
+            model.objects.filter(dirnode__in=directories)
+            .annotate(
+                node_type=Value(model._meta.model_name, output_field=CharField()),
+                depth=F('dirnode__depth'),
+            )
+            .order_by()
+            .values_list(*fields)
+            for model in (AIModel, Prompt)
+        )
+        items = {}
+        for row in aimodels.union(prompts, all=True).order_by('type_order', 'display'):
+            item = Item(*row)
+            items.setdefault(item.dirnode_id, []).append(item)
+        return items
+
+    @classmethod
+    def _load_tree(
+        cls: type['TreeView'], directories: DirNodeQuerySet
+    ) -> list[DirNode]:
+        """
+        Load directories and their items for the sidebar, in two queries.
+
+        Each directory is given the lists of `items` and `children` the
+        sidebar templates render.
+
+        Returns:
+            list[DirNode]: The directories whose parents weren't loaded
+        """
+        nodes = list(directories.order_by('path'))
+        items = cls._load_items(directories)
+        by_path = {node.path: node for node in nodes}
+        top = []
+        for node in nodes:
+            node.items = items.get(node.id, [])
+            node.children = []
+            parent = by_path.get(node.path[: -node.steplen])
+            (parent.children if parent else top).append(node)
+        return top
+
+    @classmethod
+    def render_sidebar_items(
+        cls: type['TreeView'], request: HttpRequest, dirnode_id: int
+    ) -> str:
+        """Renders a directory's items as an out-of-band swap."""
+        items = cls._load_items(DirNode.objects.filter(id=dirnode_id))
+        return render_to_string(
+            'dirnode/items.html',
+            {'dirnode_id': dirnode_id, 'items': items.get(dirnode_id, []), 'oob': True},
+            request=request,
+        )
+
+    @staticmethod
+    def render_sidebar_row(request: HttpRequest, node: DirNode) -> str:
+        """Renders a directory's own row as an out-of-band swap."""
+        return render_to_string(
+            'dirnode/row.html', {'node': node, 'oob': True}, request=request
+        )
+
+    @classmethod
+    def render_sidebar_counts(
+        cls: type['TreeView'], request: HttpRequest, *dirnode_ids: int | None
+    ) -> str:
+        """Renders the rows of directories and their ancestors, whose counts changed."""
+        paths = DirNode.objects.filter(id__in=dirnode_ids).values_list(
+            'path', flat=True
+        )
+        chain = {
+            path[:end]
+            for path in paths
+            for end in range(DirNode.steplen, len(path) + 1, DirNode.steplen)
+        }
+        return ''.join(
+            cls.render_sidebar_row(request, node)
+            for node in DirNode.objects.alive().filter(path__in=chain)
+        )
+
+    @classmethod
+    def render_sidebar_insert(
+        cls: type['TreeView'], request: HttpRequest, node: DirNode
+    ) -> str:
+        """
+        Renders a directory and everything in it as an out-of-band swap.
+
+        Siblings are kept in path order, so it goes before the first sibling
+        after it, or last among its parent's children.
+        """
+        (tree,) = cls._load_tree(
+            DirNode.objects.alive().filter(path__startswith=node.path)
+        )
+        parent_path = node.path[: -node.steplen]
+        siblings = DirNode.objects.alive().filter(
+            depth=node.depth, path__startswith=parent_path
+        )
+        if next_id := (
+            siblings.filter(path__gt=node.path)
+            .order_by('path')
+            .values_list('id', flat=True)
+            .first()
+        ):
+            swap = f'beforebegin:#dirnode-{next_id}'
+        else:
+            parent_id = node._get_parent_id() or 'root'
+            swap = f'beforeend:#dirnode-children-{parent_id}'
+        return format_html(
+            '<div hx-swap-oob="{}">{}</div>',
+            swap,
+            render_to_string('dirnode/tree.html', {'node': tree}, request=request),
         )
 
     @staticmethod
+    def render_sidebar_remove(node: DirNode) -> str:
+        """Removes a directory and everything in it, as an out-of-band swap."""
+        return format_html('<div id="dirnode-{}" hx-swap-oob="delete"></div>', node.id)
+
+    @staticmethod
+    def _breadcrumb_context(node: DirNode | AIModel | Prompt | None) -> dict:
+        """
+        Breadcrumb context for a node, with ancestors read by materialised path.
+
+        Every ancestor path is a prefix of the node's own path, so the whole
+        trail is one indexed path__in query, and none at all for the root.
+        """
+        if node is None:
+            return {'ancestors': [], 'current_node': None}
+
+        dirnode = node if isinstance(node, DirNode) else node.dirnode
+        paths = dirnode.get_ancestor_paths()
+        if dirnode is not node:
+            paths.append(dirnode.path)
+
+        return {
+            'ancestors': DirNode.objects.filter(path__in=paths).order_by('depth'),
+            'current_node': node,
+        }
+
+    @classmethod
+    def render_content(
+        cls: type['TreeView'],
+        request: HttpRequest,
+        template: str,
+        context: dict,
+        node: DirNode | AIModel | Prompt | None = None,
+    ) -> HttpResponse:
+        """Render main content with the breadcrumb as an out-of-band swap."""
+        response = render(request, template, context)
+        response.write(
+            render_to_string(
+                'breadcrumb.html', {**cls._breadcrumb_context(node), 'oob': True}
+            )
+        )
+        return response
+
+    @classmethod
     def get_breadcrumb(
-        request: HttpRequest, node_type: str, node_id: int
+        cls: type['TreeView'], request: HttpRequest, node_type: str, node_id: int
     ) -> HttpResponse:
         """Returns breadcrumb HTML for any node type"""
         if node_type == 'dirnode':
-            node = get_object_or_404(DirNode, id=node_id)
-            ancestors = node.get_ancestors()
+            node = get_object_or_404(DirNode.objects.alive(), id=node_id)
         else:
             model = AIModel if node_type == 'aimodel' else Prompt
-            node = get_object_or_404(model, id=node_id)
-            ancestors = node.dirnode.get_ancestors() if node.dirnode else []
+            node = get_object_or_404(
+                model.objects.alive().select_related('dirnode'), id=node_id
+            )
 
-        return render(
-            request, 'breadcrumb.html', {'ancestors': ancestors, 'current_node': node}
-        )
+        return render(request, 'breadcrumb.html', cls._breadcrumb_context(node))
 
-    @staticmethod
-    def get_content(request: HttpRequest, node_type: str, node_id: int) -> HttpResponse:
-        """Returns main content HTML for any node type"""
+    @classmethod
+    def get_content(
+        cls: type['TreeView'], request: HttpRequest, node_type: str, node_id: int
+    ) -> HttpResponse:
+        """Returns main content HTML for any node type, plus its breadcrumb"""
         # If this is a modal action, delegate to ModalView
         if action := request.GET.get('action'):
-            return ModalView.handle_modal(request, node_type, node_id, action)
+            return ModalView.handle_modal(request, node_type, action, node_id)
 
         # Otherwise, show the content
         if node_type == 'dirnode':
-            node = get_object_or_404(DirNode, id=node_id)
-            # Get all descendant directories
-            all_dirs = [node] + list(node.get_descendants())
+            node = get_object_or_404(DirNode.objects.alive(), id=node_id)
 
             # Get all AIModels and Prompts from the directory and all its descendants
-            aimodels = AIModel.objects.filter(dirnode__in=all_dirs).order_by('display')
-            prompts = Prompt.objects.filter(dirnode__in=all_dirs).order_by('display')
+            aimodels = (
+                AIModel.objects.alive()
+                .filter(dirnode__path__startswith=node.path)
+                .order_by('display')
+            )
+            prompts = (
+                Prompt.objects.alive()
+                .filter(dirnode__path__startswith=node.path)
+                .order_by('display')
+            )
 
-            return render(
+            return cls.render_content(
                 request,
                 'dirnode/content.html',
                 {'dirnode': node, 'aimodels': aimodels, 'prompts': prompts},
+                node,
             )
         else:
             model = AIModel if node_type == 'aimodel' else Prompt
-            node = get_object_or_404(model, id=node_id)
+            node = get_object_or_404(
+                model.objects.alive().select_related('dirnode'), id=node_id
+            )
             template = f"{'ai' if node_type == 'aimodel' else 'prompt'}/card.html"
-            return render(request, template, {node_type: node})
+            return cls.render_content(request, template, {node_type: node}, node)
 
     @staticmethod
     def edit_node(request: HttpRequest, node_type: str, node_id: int) -> HttpResponse:
@@ -105,14 +366,19 @@ class TreeView:
         else:
             raise Http404('Node type not supported for editing')
 
-        node = get_object_or_404(model, id=node_id)
+        node = get_object_or_404(model.objects.alive(), id=node_id)
 
         if request.method == 'POST':
             form = form_class(request.POST, instance=node)
             if form.is_valid():
                 form.save()
                 template = f"{template.split('/')[0]}/card.html"
-                return render(request, template, {node_type: node})
+                response = render(request, template, {node_type: node})
+                if 'display' in form.changed_data:
+                    response.write(
+                        TreeView.render_sidebar_items(request, node.dirnode_id)
+                    )
+                return response
         else:
             form = form_class(instance=node)
 
@@ -128,6 +394,8 @@ class ModalView:
         'prompt': NodeType(Prompt, 'prompt'),
     }
 
+    TARGET_LIMIT = 20
+
     ACTIONS = {
         'add': Action(
             'Add',
@@ -148,6 +416,7 @@ class ModalView:
         'move': Action('Move', MoveForm),
         'copy': Action('Copy', CopyForm),
         'delete': Action('Delete', DeleteForm),
+        'publish': Action('Publish', PublishForm),
     }
 
     @classmethod
@@ -170,73 +439,119 @@ class ModalView:
             return action_config.form[node_type](data, initial=initial)
         elif action == 'rename':
             form_class = action_config.form[node_type]
-            instance = get_object_or_404(cls.NODES[node_type].model, id=node_id)
+            instance = get_object_or_404(
+                cls.NODES[node_type].model.objects.alive(), id=node_id
+            )
             return form_class(data, instance=instance)
         elif action in ['move', 'copy']:
-            form = action_config.form(data)
-
-            excluded_ids = set()
-            if node_id:
-                if node_type == 'dirnode':
-                    node = get_object_or_404(DirNode, id=node_id)
-                    excluded_ids.add(node.id)
-                    excluded_ids.update(child.id for child in node.get_descendants())
-                else:
-                    model = cls.NODES[node_type].model
-                    node = get_object_or_404(model, id=node_id)
-                    if node.dirnode:
-                        excluded_ids.add(node.dirnode.id)
-
-            choices = []
-            if node_type == 'dirnode':
-                choices.append(('', '(none - root level)'))
-
-            choices.extend(
-                (node.id, '—' * node.get_depth() + ' ' + node.display)
-                for node in DirNode.get_tree()
-                if node.id not in excluded_ids
+            return action_config.form(
+                data,
+                targets=cls._get_targets(node_type, node_id),
+                allow_root=node_type == 'dirnode',
             )
-            form.fields['target_id'].choices = choices
-
-            return form
         elif action == 'delete':
             return action_config.form(data)
+        elif action == 'publish':
+            if node_type != 'dirnode':
+                raise Http404('Only directories can be published')
+            return action_config.form(data)
 
         return None
 
-    @staticmethod
-    def _copy_directory_tree(node: DirNode, target_dir: int | None = None) -> DirNode:
-        """
-        Recursively copy a directory and all its contents.
-
-        Args:
-            node (DirNode): The directory node to copy
-            target_dir (DirNode, optional): The target parent directory
+    @classmethod
+    def _get_targets(
+        cls: type['ModalView'], node_type: str, node_id: int | None = None
+    ) -> DirNodeQuerySet:
+        """Directories a node can be moved or copied to, excluded in SQL."""
+        targets = DirNode.objects.alive()
+        if node_id:
+            model = cls.NODES[node_type].model
+            node = get_object_or_404(model.objects.alive(), id=node_id)
+            if node_type == 'dirnode':
+                targets = targets.exclude(path__startswith=node.path)
+            else:
+                targets = targets.exclude(id=node.dirnode_id)
+        return targets
 
-        Returns:
-            DirNode: The new copy of the directory
+    @classmethod
+    def search_targets(cls: type['ModalView'], request: HttpRequest) -> HttpResponse:
         """
-        if target_dir:
-            new_dir = target_dir.add_child(display=node.display)
-        else:
-            new_dir = DirNode.add_root(display=node.display)
+        Returns destination directories matching a search as HTML.
 
-        for aimodel in node.aimodels.all():
-            new_aimodel = AIModel.objects.get(id=aimodel.id)
-            new_aimodel.pk = None
-            new_aimodel.dirnode = new_dir
-            new_aimodel.save()
+        A plain search matches display names. A search containing slashes, such
+        as "redbox/ra", is read as a display path: each complete segment is
+        resolved with one query and the last one is matched as a prefix among
+        the children of the directories found.
+        """
+        node_type = request.GET.get('node_type', 'dirnode')
+        if node_type not in cls.NODES:
+            raise Http404('Unknown node type')
+        node_id = request.GET.get('node_id')
+        if node_id and not node_id.isdigit():
+            raise Http404('Unknown node')
+        targets = cls._get_targets(node_type, int(node_id) if node_id else None)
+
+        try:
+            limit = min(int(request.GET.get('limit', cls.TARGET_LIMIT)), 50)
+        except ValueError:
+            limit = cls.TARGET_LIMIT
+
+        query = request.GET.get('q', '').strip()
+        if '/' in query:
+            *segments, prefix = [segment.strip() for segment in query.split('/')]
+            parents = DirNode.objects.alive().filter(depth=1)
+            for segment in filter(None, segments):
+                paths = list(
+                    parents.filter(display=segment).values_list('path', flat=True)
+                )
+                parents = DirNode.objects.alive().filter(
+                    reduce(
+                        operator.or_,
+                        (
+                            Q(
+                                path__startswith=path,
+                                depth=len(path) // DirNode.steplen + 1,
+                            )
+                            for path in paths
+                        ),
+                        Q(pk__in=[]),
+                    )
+                )
+            targets = targets.filter(
+                id__in=parents.values('id'), display__istartswith=prefix
+            ).order_by('display')
+        elif query:
+            targets = targets.filter(display__icontains=query).order_by(
+                'depth', 'display'
+            )
 
-        for prompt in node.prompts.all():
-            new_prompt = Prompt.objects.get(id=prompt.id)
-            new_prompt.pk = None
-            new_prompt.dirnode = new_dir
-            new_prompt.save()
+        targets = list(targets[: limit + 1])
+        more = len(targets) > limit
+        targets = targets[:limit]
 
-        for child in node.get_children():
-            ModalView._copy_directory_tree(child, new_dir)
+        # Label each result with its parents, fetched in one query by path
+        ancestor_paths = {
+            path for node in targets for path in node.get_ancestor_paths()
+        }
+        displays = dict(
+            DirNode.objects.filter(path__in=ancestor_paths).values_list(
+                'path', 'display'
+            )
+        )
+        for node in targets:
+            node.display_path = ' / '.join(
+                displays.get(path, '') for path in node.get_ancestor_paths()
+            )
 
-        return new_dir
+        return render(
+            request,
+            'modal/targets.html',
+            {
+                'targets': targets,
+                'more': more,
+                'allow_root': node_type == 'dirnode' and not query,
+            },
+        )
 
     @classmethod
     def _process_action(
@@ -247,9 +562,14 @@ class ModalView:
         node_id: int,
         form: Form | None = None,
     ) -> HttpResponse:
-        """Process any modal action and return appropriate response."""
+        """
+        Process any modal action and return appropriate response.
+
+        The parts of the sidebar the action changed are appended as
+        out-of-band swaps, rather than the whole filesystem being reloaded.
+        """
         model = cls.NODES[node_type].model
-        node = get_object_or_404(model, id=node_id) if node_id else None
+        node = get_object_or_404(model.objects.alive(), id=node_id) if node_id else None
 
         # Get parent info before any action that might delete the node
         parent_type = parent_id = None
@@ -264,20 +584,50 @@ class ModalView:
                 parent_id = node.dirnode.id
 
         # Process the action
+        sidebar = []
         if action in ['add', 'rename']:
             result = form.save()
             response = TreeView.get_content(request, node_type, result.id)
+            if node_type != 'dirnode':
+                sidebar.append(
+                    TreeView.render_sidebar_items(request, result.dirnode_id)
+                )
+                if action == 'add':
+                    sidebar.append(
+                        TreeView.render_sidebar_counts(request, result.dirnode_id)
+                    )
+            elif action == 'add':
+                sidebar.append(TreeView.render_sidebar_insert(request, result))
+            else:
+                sidebar.append(TreeView.render_sidebar_row(request, result))
 
         elif action == 'delete':
-            node.delete()
+            if node_type == 'dirnode':
+                # The subtree is purged by a worker once the grace period is over
+                node.tombstone()
+                jobs.enqueue(
+                    'purge_deleted',
+                    description=f'Purge "{node.display}"',
+                    run_after=node.deleted_at
+                    + timedelta(seconds=settings.DELETION_GRACE_PERIOD),
+                )
+                sidebar.append(TreeView.render_sidebar_remove(node))
+            else:
+                node.delete()
+                sidebar.append(TreeView.render_sidebar_items(request, parent_id))
+            sidebar.append(TreeView.render_sidebar_counts(request, parent_id))
             if parent_type and parent_id:
                 response = TreeView.get_content(request, parent_type, parent_id)
             else:
-                response = render(request, 'welcome.html')
+                response = TreeView.render_content(request, 'welcome.html', {})
 
         elif action == 'move':
             target_id = form.cleaned_data['target_id']
-            target_dir = get_object_or_404(DirNode, id=target_id) if target_id else None
+            target_dir = (
+                get_object_or_404(DirNode.objects.alive(), id=target_id)
+                if target_id
+                else None
+            )
 
             if node_type == 'dirnode':
                 if target_dir:
@@ -291,35 +641,70 @@ class ModalView:
                             node.move(root_nodes[0], 'sorted-sibling')
                         else:
                             node.move(None, 'sorted-child')
+                node.refresh_from_db()
+                sidebar.append(TreeView.render_sidebar_remove(node))
+                sidebar.append(TreeView.render_sidebar_insert(request, node))
             else:
                 node.dirnode = target_dir
                 node.save()
+                sidebar.append(TreeView.render_sidebar_items(request, parent_id))
+                sidebar.append(TreeView.render_sidebar_items(request, target_dir.id))
+            sidebar.append(
+                TreeView.render_sidebar_counts(
+                    request, parent_id, target_dir and target_dir.id
+                )
+            )
 
             if target_dir:
                 response = TreeView.get_content(request, 'dirnode', target_dir.id)
             else:
-                response = render(request, 'welcome.html')
+                response = TreeView.render_content(request, 'welcome.html', {})
 
         elif action == 'copy':
             target_id = form.cleaned_data['target_id']
-            target_dir = get_object_or_404(DirNode, id=target_id) if target_id else None
+            target_dir = (
+                get_object_or_404(DirNode.objects.alive(), id=target_id)
+                if target_id
+                else None
+            )
 
             if node_type == 'dirnode':
-                new_dir = cls._copy_directory_tree(node, target_dir)
-                result_id = new_dir.id
+                # Directories can be any size, so they're copied by a worker
+                job = jobs.enqueue(
+                    'copy_directory',
+                    description=f'Copy "{node.display}"',
+                    node_id=node.id,
+                    target_id=target_id,
+                )
+                result_id = node.id
             else:
+                job = None
                 new_instance = model.objects.get(id=node_id)
                 new_instance.pk = None
                 new_instance.dirnode = target_dir
                 new_instance.save()
                 result_id = new_instance.id
+                sidebar.append(TreeView.render_sidebar_items(request, target_dir.id))
+                sidebar.append(TreeView.render_sidebar_counts(request, target_dir.id))
 
             if target_dir:
                 response = TreeView.get_content(request, 'dirnode', target_dir.id)
             else:
                 response = TreeView.get_content(request, node_type, result_id)
+            if job:
+                response.write(JobView.render_progress(request, job, oob=True))
+
+        elif action == 'publish':
+            job = jobs.enqueue(
+                'publish_snapshot',
+                description=f'Publish "{node.display}"',
+                node_id=node.id,
+            )
+            response = TreeView.get_content(request, 'dirnode', node.id)
+            response.write(JobView.render_progress(request, job, oob=True))
 
-        response['HX-Trigger'] = 'filesystemChanged'
+        for swap in sidebar:
+            response.write(swap)
         return response
 
     @classmethod
@@ -339,6 +724,10 @@ class ModalView:
             'action': action,
             'title': f'{cls.ACTIONS[action].name} {cls.NODES[node_type].display_name}',
         }
+        if action == 'publish':
+            context['snapshots'] = Snapshot.objects.filter(dirnode_id=node_id).order_by(
+                '-version'
+            )[:5]
 
         if request.method == 'POST':
             if form.is_valid():
@@ -358,5 +747,244 @@ class ModalView:
         return response
 
 
+class JobView:
+    """Shows the progress of queued jobs, and cancels them."""
+
+    @staticmethod
+    def render_progress(request: HttpRequest, job: Job, oob: bool = False) -> str:
+        """Renders a job's progress bar, polling until the job finishes."""
+        return render_to_string(
+            'job/progress.html', {'job': job, 'oob': oob}, request=request
+        )
+
+    @classmethod
+    def get_progress(
+        cls: type['JobView'], request: HttpRequest, job_id: int
+    ) -> HttpResponse:
+        """Returns a job's progress as HTML"""
+        job = get_object_or_404(Job, id=job_id)
+        response = HttpResponse(cls.render_progress(request, job))
+        if job.is_finished:
+            response['HX-Trigger'] = 'filesystemChanged'
+        return response
+
+    @classmethod
+    def cancel(cls: type['JobView'], request: HttpRequest, job_id: int) -> HttpResponse:
+        """Cancels a job and returns its progress as HTML"""
+        job = get_object_or_404(Job, id=job_id)
+        job.cancel()
+        return HttpResponse(cls.render_progress(request, job))
+
+
+class SnapshotView:
+    """Serves published snapshots."""
+
+    # A version's file never changes, so it can be cached for a year
+    IMMUTABLE = {'public': True, 'max_age': 365 * 24 * 60 * 60, 'immutable': True}
+
+    @classmethod
+    def get_snapshot(
+        cls: type['SnapshotView'], request: HttpRequest, dirnode_id: int, version: int
+    ) -> HttpResponse:
+        """Returns a snapshot file"""
+        snapshot = get_object_or_404(Snapshot, dirnode_id=dirnode_id, version=version)
+        etag = f'"{snapshot.sha256}"'
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(
+                snapshot.path.open('rb'),
+                as_attachment=True,
+                filename=snapshot.filename,
+                content_type='application/octet-stream',
+            )
+            response['ETag'] = etag
+        patch_cache_control(response, **cls.IMMUTABLE)
+        return response
+
+    @staticmethod
+    def get_latest(request: HttpRequest, dirnode_id: int) -> HttpResponse:
+        """Redirects to the newest snapshot of a directory"""
+        snapshot = (
+            Snapshot.objects.filter(dirnode_id=dirnode_id).order_by('-version').first()
+        )
+        if snapshot is None:
+            raise Http404('This directory has not been published')
+        response = HttpResponseRedirect(
+            reverse('get_snapshot', args=[dirnode_id, snapshot.version])
+        )
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class EventView:
+    """Streams changes to the tree as server-sent events."""
+
+    @staticmethod
+    def stream(request: HttpRequest, dirnode_id: int | None = None) -> HttpResponse:
+        """Streams the changes to the tree, or to a directory and beneath it"""
+        scope = request.api_key_scope
+        if (
+            settings.API_KEY_REQUIRED
+            and not scope
+            and not request.user.is_authenticated
+        ):
+            return unauthorized('An API key is required')
+
+        directories = DirNode.objects.alive()
+        scope_path = ''
+        if scope:
+            scope_path = (
+                directories.filter(id=scope.dirnode_id)
+                .values_list('path', flat=True)
+                .first()
+            )
+            if scope_path is None:
+                raise Http404("The API key's directory has been deleted")
+            directories = directories.filter(path__startswith=scope_path)
+            dirnode_id = dirnode_id or scope.dirnode_id
+        path = ''
+        if dirnode_id is not None:
+            path = get_object_or_404(
+                directories.values_list('path', flat=True), id=dirnode_id
+            )
+
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        try:
+            stream = events.Stream(
+                events.Subscription(path, scope_path),
+                int(last_event_id) if last_event_id.isdigit() else None,
+            )
+        except events.StreamsFull:
+            response = HttpResponse('Too many event streams', status=503)
+            response['Retry-After'] = str(events.RETRY // 1000)
+            return response
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        patch_cache_control(response, no_cache=True)
+        # Stops nginx from holding events back to fill its buffer
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class GatewayView:
+    """Forwards prompts to AI model endpoints on behalf of API key holders."""
+
+    @staticmethod
+    def error(message: str, status: int) -> JsonResponse:
+        return JsonResponse({'errors': [{'message': message}]}, status=status)
+
+    @staticmethod
+    def parse_id(value: int | str, type_name: str) -> int:
+        """An id, as a number or a GraphQL global id of the given type."""
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str) and value.isdigit():
+            return int(value)
+        try:
+            global_type, global_id = from_global_id(value)
+        except Exception:
+            global_type = global_id = None
+        if global_type != type_name or not global_id.isdigit():
+            raise ValueError(f'Not a {type_name} id: {value!r}')
+        return int(global_id)
+
+    @classmethod
+    def forward(cls, request: HttpRequest) -> HttpResponse:
+        """
+        Sends a prompt to an AI model and streams back the endpoint's response
+
+        Takes a JSON body with the `model` and `prompt`, as numbers or GraphQL
+        ids, and the `variables` to fill into the prompt's text. Both must be
+        in the API key's directory, and the AI model in the prompt's
+        directory or above it.
+        """
+        if not settings.GATEWAY_ENABLED:
+            raise Http404('The gateway is disabled')
+        scope = request.api_key_scope
+        if not scope:
+            return unauthorized('An API key is required')
+
+        try:
+            data = json.loads(request.body)
+            model_id = cls.parse_id(data['model'], 'AIModelType')
+            prompt_id = cls.parse_id(data['prompt'], 'PromptType')
+            variables = data.get('variables') or {}
+            if not isinstance(variables, dict):
+                raise ValueError('variables must be an object')
+        except (ValueError, TypeError, KeyError) as e:
+            return cls.error(f'Invalid request: {e}', 400)
+
+        visible = Q(dirnode__path__startswith=scope.path())
+        aimodel = (
+            AIModel.objects.alive()
+            .filter(visible, id=model_id)
+            .select_related('dirnode')
+            .first()
+        )
+        prompt = (
+            Prompt.objects.alive()
+            .filter(visible, id=prompt_id)
+            .select_related('dirnode', 'blob')
+            .first()
+        )
+        if aimodel is None or prompt is None:
+            return cls.error('No such AI model or prompt', 404)
+        if not prompt.dirnode.path.startswith(aimodel.dirnode.path):
+            return cls.error(
+                "The AI model isn't in the prompt's directory or above it", 400
+            )
+        if not aimodel.endpoint:
+            return cls.error('The AI model has no endpoint', 400)
+        try:
+            gateway.parse_endpoint(aimodel.endpoint)
+        except ValueError as e:
+            return cls.error(f"The AI model's endpoint is invalid: {e}", 400)
+
+        try:
+            response, body = gateway.forward(aimodel, prompt, variables)
+        except gateway.GatewayBusy:
+            response = cls.error('Too many requests to this endpoint', 503)
+            response['Retry-After'] = '1'
+            return response
+        except (OSError, http.client.HTTPException) as e:
+            logging.warning(f'Forwarding to {aimodel.endpoint} failed', exc_info=True)
+            return cls.error(f'The endpoint failed: {e}', 502)
+
+        streaming = StreamingHttpResponse(
+            body,
+            status=response.status,
+            content_type=response.getheader('Content-Type', 'application/json'),
+        )
+        patch_cache_control(streaming, no_store=True)
+        # Stops nginx from holding streamed responses back to fill its buffer
+        streaming['X-Accel-Buffering'] = 'no'
+        return streaming
+
+
 def health_check(request: HttpRequest) -> JsonResponse:
     return JsonResponse({'status': 'healthy'})
+
+
+def ready_check(request: HttpRequest) -> JsonResponse:
+    """Whether this process is warmed up and its database migrated."""
+    reason = startup.check_readiness()
+    if reason:
+        return JsonResponse({'status': 'unavailable', 'reason': reason}, status=503)
+    return JsonResponse({'status': 'ready'})
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """Counters in the Prometheus text format, for staff or METRICS_TOKEN."""
+    token = get_api_key(request)
+    if not (
+        request.user.is_staff
+        or (
+            settings.METRICS_TOKEN
+            and token
+            and constant_time_compare(token, settings.METRICS_TOKEN)
+        )
+    ):
+        return unauthorized('Staff or the metrics token is required')
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )